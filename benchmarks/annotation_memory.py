@@ -0,0 +1,129 @@
+"""
+Measure how much memory annotations take up, in bytes per annotation.
+
+This builds a corpus of annotations the same way a BioMegatron -> NameRes -> NodeNorm pipeline would (an
+Annotation, reannotated into a NormalizedAnnotation, normalized into another NormalizedAnnotation) using in-process
+annotators, so it doesn't need any services to be running. Run it with:
+
+    $ uv run python benchmarks/annotation_memory.py [number of documents]
+
+It also runs against older versions of renci-ner that don't have AnnotationProvenance.shared(), in which case a new
+AnnotationProvenance is created for every call, as annotators did at the time.
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    Annotator,
+    NormalizedAnnotation,
+)
+
+WORDS_PER_DOCUMENT = 50
+
+# AnnotationProvenance.shared() if this version of renci-ner has it, or the constructor otherwise.
+shared_provenance = getattr(AnnotationProvenance, "shared", AnnotationProvenance)
+
+
+class WordAnnotator(Annotator):
+    """Annotates every word in a text, like BioMegatron would."""
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        return shared_provenance("BioMegatron", "http://localhost", "0.1.0")
+
+    def annotate(self, text, props=None):
+        annotations = []
+        start = 0
+        for index, word in enumerate(text.split(" ")):
+            annotations.append(
+                Annotation(
+                    text=word,
+                    id=f"I{index}-",
+                    label="",
+                    type="biolink:NamedThing",
+                    start=start,
+                    end=start + len(word),
+                    provenance=self.provenance,
+                )
+            )
+            start += len(word) + 1
+        return AnnotatedText(text, annotations)
+
+
+class WordLinker(Annotator):
+    """Links every word to a made-up CURIE, like NameRes would."""
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        return shared_provenance("NameRes", "http://localhost", "1.0.0")
+
+    def annotate(self, text, props=None):
+        return AnnotatedText(
+            text,
+            [
+                NormalizedAnnotation(
+                    text=text,
+                    id=f"TEST:{text}",
+                    label=text,
+                    type="biolink:NamedThing",
+                    biolink_type="biolink:NamedThing",
+                    start=0,
+                    end=len(text),
+                    props={"score": 1.0},
+                    provenance=self.provenance,
+                )
+            ],
+        )
+
+
+def normalize(annotated_text: AnnotatedText) -> AnnotatedText:
+    """Normalize every annotation, like NodeNorm would."""
+    provenance = shared_provenance("NodeNorm", "http://localhost", "2.0.0")
+    return AnnotatedText(
+        annotated_text.text,
+        [
+            NormalizedAnnotation.from_annotation(
+                annotation, provenance=provenance, curie=annotation.id + ".1"
+            )
+            for annotation in annotated_text.annotations
+        ],
+    )
+
+
+def main(documents: int):
+    texts = [
+        " ".join(f"word{document}x{index}" for index in range(WORDS_PER_DOCUMENT))
+        for document in range(documents)
+    ]
+    annotator = WordAnnotator()
+    linker = WordLinker()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    corpus = [normalize(annotator.annotate(text).reannotate(linker)) for text in texts]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    annotations = sum(len(annotated_text.annotations) for annotated_text in corpus)
+    print(
+        json.dumps(
+            {
+                "documents": documents,
+                "annotations": annotations,
+                "bytes": after - before,
+                "bytes_per_annotation": round((after - before) / annotations, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
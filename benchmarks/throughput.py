@@ -0,0 +1,174 @@
+"""
+Measure the throughput, latency and memory use of representative pipelines against a local FakeServer, so that
+changes to the library's own overhead can be tracked over time without depending on the real services.
+
+Each scenario annotates the same documents with BioMegatron, reannotates them with NameRes or SAPBERT, and normalizes
+them with NodeNorm, like `tests/multiple_annotators/test_multiple_annotators.py`. We report documents per second,
+the median and 99th percentile time to annotate a document, the peak memory allocated while running the scenario
+(measured in a second, traced run), and the number of requests made. In the pipeline scenario, a document's time
+starts when the pipeline reads it, so it includes the time spent waiting behind other documents. Results are printed
+as JSON. Run it with:
+
+    $ uv run python benchmarks/throughput.py [--documents 200] [--latency 0.005] [--url http://localhost:8080]
+
+By default, the FakeServer runs in this process; to keep the server's work out of the measurements, run
+`python -m renci_ner.testing` in another process and pass its URL with `--url`.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from importlib.metadata import PackageNotFoundError, version
+
+from renci_ner.core import Pipeline
+from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
+from renci_ner.services.linkers.nameres import NameRes
+from renci_ner.services.ner.biomegatron import BioMegatron
+from renci_ner.services.normalization.nodenorm import NodeNorm
+from renci_ner.testing import FakeServer
+
+SENTENCES = [
+    "The brain is part of the nervous system.",
+    "Mutations in BRCA1 increase the risk of breast cancer.",
+    "Aspirin inhibits cyclooxygenase and reduces inflammation.",
+    "The patient presented with fever, cough and shortness of breath.",
+]
+
+
+def documents(count: int) -> list[str]:
+    """Return `count` short documents made up of a few sentences each."""
+    return [
+        " ".join(SENTENCES[(index + offset) % len(SENTENCES)] for offset in range(3))
+        for index in range(count)
+    ]
+
+
+def chain(linker, props: dict):
+    """Return a scenario that annotates each document in turn, as in test_multiple_annotators.py."""
+
+    def run(url: str, texts: list[str]) -> list[float]:
+        biomegatron = BioMegatron(url=url)
+        link = linker(url=url)
+        nodenorm = NodeNorm(url=url)
+
+        latencies = []
+        for text in texts:
+            start = time.perf_counter()
+            biomegatron.annotate(text).reannotate(link, props).transform(nodenorm)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    return run
+
+
+def pipeline(url: str, texts: list[str]) -> list[float]:
+    """A scenario that annotates documents with a Pipeline, with several documents in flight at once."""
+    pipeline = (
+        Pipeline(BioMegatron(url=url), max_in_flight=8)
+        .reannotate(NameRes(url=url), {"limit": 1, "max_workers": 4})
+        .transform(NodeNorm(url=url))
+    )
+
+    def records():
+        for text in texts:
+            yield {"text": text, "started": time.perf_counter()}
+
+    return [
+        time.perf_counter() - record["started"]
+        for record, _ in pipeline.run_records(records())
+    ]
+
+
+SCENARIOS = {
+    "biomegatron-nameres-nodenorm": chain(NameRes, {"limit": 1}),
+    "biomegatron-sapbert-nodenorm": chain(BabelSAPBERTAnnotator, {"limit": 1}),
+    "pipeline-biomegatron-nameres-nodenorm": pipeline,
+}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return a percentile of some values, by the nearest-rank method."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(scenario, url: str, texts: list[str], server: FakeServer = None) -> dict:
+    """Run a scenario twice -- once for timings, once for memory -- and summarize the results."""
+    if server is not None:
+        server.request_counts.clear()
+    start = time.perf_counter()
+    latencies = scenario(url, texts)
+    elapsed = time.perf_counter() - start
+    requests = sum(server.request_counts.values()) if server is not None else None
+
+    tracemalloc.start()
+    scenario(url, texts)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "docs_per_sec": round(len(texts) / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_memory_bytes": peak,
+        "requests": requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="Seconds the in-process FakeServer waits per request.",
+    )
+    parser.add_argument("--url", help="Use an already running FakeServer at this URL.")
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these."
+    )
+    args = parser.parse_args()
+
+    texts = documents(args.documents)
+    server = None
+    url = args.url
+    if url is None:
+        server = FakeServer(latency=args.latency).start()
+        url = server.url
+
+    try:
+        results = {
+            name: measure(SCENARIOS[name], url, texts, server)
+            for name in (args.scenario or SCENARIOS)
+        }
+    finally:
+        if server is not None:
+            server.stop()
+
+    try:
+        package_version = version("renci-ner")
+    except PackageNotFoundError:
+        package_version = None
+
+    json.dump(
+        {
+            "benchmark": "throughput",
+            "renci_ner_version": package_version,
+            "python": platform.python_version(),
+            "documents": len(texts),
+            "latency": args.latency if args.url is None else None,
+            "scenarios": results,
+        },
+        sys.stdout,
+        indent=2,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Caches for the results of service lookups.
+
+Biomedical texts mention the same entities over and over again, so caching the results of looking up a particular
+text (or normalizing a particular CURIE) can avoid most requests to a service. Services that support caching accept a
+`cache` argument, which can be any of the caches in this module:
+
+- `LRUCache` keeps up to `maxsize` results in memory, optionally expiring them after `ttl` seconds.
+- `SQLiteCache` stores results in an SQLite database on disk, which can be shared between processes.
+- `TieredCache` combines several caches, e.g. an LRUCache in front of an SQLiteCache.
+
+`SingleFlight` is not a cache, but complements one: it makes threads that look up the same key at the same time share
+a single request.
+
+Cached values must be JSON-serializable, as they are usually the raw responses from a service.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+# Returned by Cache.get() when a key is not in the cache, since None may be a cached value.
+MISSING = object()
+
+
+def make_key(*parts) -> str:
+    """
+    Make a cache key out of several JSON-serializable parts, e.g. the text being looked up, the properties that
+    affect the result and the version of the service.
+
+    :param parts: The parts of the key.
+    :return: A string that can be used as a cache key.
+    """
+    return json.dumps(parts, sort_keys=True, separators=(",", ":"))
+
+
+@dataclass
+class CacheStats:
+    """Counts of cache hits and misses."""
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that were found in the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Cache:
+    """
+    An interface for a cache of service results. Subclasses need to implement `_get()`, `_set()` and `clear()`;
+    this class keeps track of hits and misses.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Look up a key in the cache.
+
+        :param key: The key to look up (see make_key()).
+        :return: The cached value, or MISSING if it isn't in the cache.
+        """
+        value = self._get(key)
+        with self._stats_lock:
+            if value is MISSING:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        """
+        Store a value in the cache.
+
+        :param key: The key to store the value under (see make_key()).
+        :param value: The value to store, which must be JSON-serializable.
+        """
+        self._set(key, value)
+
+    def _get(self, key: str):
+        return MISSING
+
+    def _set(self, key: str, value):
+        pass
+
+    def clear(self):
+        """Remove every value from the cache."""
+
+
+class LRUCache(Cache):
+    """
+    An in-memory cache that keeps the `maxsize` most recently used values, each for up to `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float | None = None):
+        """
+        Set up an in-memory cache.
+
+        :param maxsize: The maximum number of values to keep. Default: 10,000.
+        :param ttl: The number of seconds to keep each value for. Default: None (keep values until they are evicted).
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def _get(self, key: str):
+        with self._lock:
+            if key not in self._values:
+                return MISSING
+            stored, value = self._values[key]
+            if self.ttl is not None and time.monotonic() - stored > self.ttl:
+                del self._values[key]
+                return MISSING
+            self._values.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value):
+        with self._lock:
+            self._values[key] = (time.monotonic(), value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class SQLiteCache(Cache):
+    """
+    A persistent cache stored in an SQLite database, which can be shared between threads and processes. Values are
+    stored as JSON and expire after `ttl` seconds.
+    """
+
+    def __init__(self, path, ttl: float | None = None, table: str = "cache"):
+        """
+        Set up an SQLite cache.
+
+        :param path: The path of the SQLite database file, which will be created if it doesn't exist.
+        :param ttl: The number of seconds to keep each value for. Default: None (keep values forever).
+        :param table: The name of the table to store values in, so that several caches can share one database.
+        """
+        super().__init__()
+        self.path = str(path)
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            # Write-ahead logging allows other processes to read while we write.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)'
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT COUNT(*) FROM "{self.table}"'
+            ).fetchone()[0]
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT value, stored FROM "{self.table}" WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return MISSING
+        value, stored = row
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            return MISSING
+        return json.loads(value)
+
+    def _set(self, key: str, value):
+        with self._lock, self._connection:
+            self._connection.execute(
+                f'INSERT OR REPLACE INTO "{self.table}" (key, value, stored) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time()),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute(f'DELETE FROM "{self.table}"')
+
+    def close(self):
+        """Close the connection to the database."""
+        self._connection.close()
+
+
+class TieredCache(Cache):
+    """
+    A cache made up of several caches that are checked in order, e.g. a fast in-memory cache in front of a slower
+    persistent cache. Values found in a later cache are copied into the earlier caches, and new values are stored in
+    every cache.
+    """
+
+    def __init__(self, *caches: Cache):
+        """
+        Set up a tiered cache.
+
+        :param caches: The caches to use, fastest first.
+        """
+        super().__init__()
+        self.caches = caches
+
+    def _get(self, key: str):
+        for index, cache in enumerate(self.caches):
+            value = cache.get(key)
+            if value is not MISSING:
+                for earlier_cache in self.caches[:index]:
+                    earlier_cache.set(key, value)
+                return value
+        return MISSING
+
+    def _set(self, key: str, value):
+        for cache in self.caches:
+            cache.set(key, value)
+
+    def clear(self):
+        for cache in self.caches:
+            cache.clear()
+
+
+class _Flight:
+    """A single call in progress in a SingleFlight, which other callers can wait for."""
+
+    __slots__ = ("done", "error", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        """Wait for the call to finish, and return its result or raise its exception."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesces identical lookups that are in progress at the same time: while one thread is looking up a key, other
+    threads that ask for the same key wait for that lookup to finish and share its result (or its exception), rather
+    than sending the same request to the service again. Unlike a cache, nothing is kept once the lookup has finished.
+
+    `do()` looks up a single key. Bulk lookups can use `claim()` to find out which of their keys no other thread is
+    looking up, look those up together, `finish()` each of them, and then wait for the rest.
+    """
+
+    def __init__(self):
+        # The number of calls that waited for another call instead of making their own.
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, function):
+        """
+        Call `function()` to look up a key, unless another thread is already looking up the same key, in which case
+        wait for it to finish instead.
+
+        :param key: The key being looked up (see make_key()).
+        :param function: A function with no arguments that looks up the key.
+        :return: The result of `function()`, which is shared by every caller waiting for it and so should not be
+            modified.
+        """
+        claimed, waiting = self.claim([key])
+        if not claimed:
+            return waiting[key].wait()
+
+        try:
+            result = function()
+        except BaseException as err:
+            self.finish(key, error=err)
+            raise
+        self.finish(key, result)
+        return result
+
+    def claim(self, keys: Iterable[str]) -> tuple[list[str], dict]:
+        """
+        Claim the keys that no other thread is looking up. The caller must look up each claimed key and then call
+        `finish()` with its result (or exception), even if the lookup fails, or other threads will wait for it
+        forever.
+
+        :param keys: The keys to look up.
+        :return: A list of the keys claimed by the caller, and a dictionary of the calls to wait for (with their
+            `wait()` method) for the keys that other threads are already looking up.
+        """
+        claimed = {}
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                if key in claimed or key in waiting:
+                    continue
+                flight = self._flights.get(key)
+                if flight is None:
+                    claimed[key] = self._flights[key] = _Flight()
+                else:
+                    waiting[key] = flight
+                    self.coalesced += 1
+        return list(claimed), waiting
+
+    def finish(self, key: str, result=None, error: BaseException | None = None):
+        """
+        Finish looking up a key claimed with `claim()`, passing its result (or the exception raised while looking it
+        up) to any threads waiting for it.
+        """
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.result = result
+        flight.error = error
+        flight.done.set()
@@ -1,29 +1,231 @@
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import importlib
+import logging
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Self
 
+from renci_ner.instrumentation import StatsCollector, in_current_context
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+# The default number of concurrent requests made by an AsyncAnnotator.
+DEFAULT_MAX_CONCURRENCY = 100
+
+# The default number of texts in progress at each stage of a Pipeline.
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+# Shared AnnotationProvenance instances, keyed by (name, url, version).
+_shared_provenances = {}
+
+
+@dataclass(frozen=True, slots=True)
 class AnnotationProvenance:
     """
     The provenance of an annotation. The goal is to simply record the name, URL, and version of the service that
     produced this annotation -- in the future, we might also want to record the properties used in making this
     annotation.
+
+    Provenances are immutable, so a single instance can be shared by every annotation produced by a service: use
+    `AnnotationProvenance.shared()` to get one.
     """
 
     name: str
     url: str
     version: str
 
+    @classmethod
+    def shared(cls, name: str, url: str, version: str) -> Self:
+        """
+        Return a shared AnnotationProvenance with this name, URL and version, creating it if necessary.
 
-@dataclass
+        :param name: The name of the service.
+        :param url: The URL of the service.
+        :param version: The version of the service.
+        :return: An AnnotationProvenance that is shared with every other caller asking for the same provenance.
+        """
+        key = (name, url, version)
+        provenance = _shared_provenances.get(key)
+        if provenance is None:
+            provenance = _shared_provenances.setdefault(key, cls(name, url, version))
+        return provenance
+
+
+class AnnotationHistory(Sequence):
+    """
+    An immutable, persistent list of the annotations that an annotation is based on, oldest first.
+
+    Each AnnotationHistory only stores its last annotation, a pointer to the history before it and its length, so
+    extending a history with another annotation is O(1) and shares the rest of the chain with the original: a pipeline
+    of k stages over n annotations stores O(n) links rather than O(n*k) list cells. Indexing walks back from the end of
+    the history, so `history[-1]` is O(1) while `history[0]` is O(len(history)).
+
+    Histories compare equal to lists and tuples with the same annotations in the same order.
+    """
+
+    __slots__ = ("depth", "last", "previous")
+
+    def __init__(self, last=None, previous: Self | None = None):
+        """
+        Create a history. Most code should use `AnnotationHistory.EMPTY`, `AnnotationHistory.from_iterable()` or
+        `extended_with()` instead of calling this directly.
+
+        :param last: The last annotation in this history, or None for an empty history.
+        :param previous: The history before the last annotation (or None if this is the first annotation).
+        """
+        if last is None:
+            previous = None
+            depth = 0
+        elif previous is None:
+            depth = 1
+        else:
+            depth = previous.depth + 1
+
+        self.last = last
+        self.previous = previous
+        self.depth = depth
+
+    @classmethod
+    def from_iterable(cls, annotations: Iterable) -> Self:
+        """
+        Return a history containing these annotations. Histories are returned unchanged.
+
+        :param annotations: The annotations to include, oldest first.
+        :return: An AnnotationHistory.
+        """
+        if isinstance(annotations, AnnotationHistory):
+            return annotations
+        history = cls.EMPTY
+        for annotation in annotations:
+            history = history.extended_with(annotation)
+        return history
+
+    def extended_with(self, annotation) -> Self:
+        """
+        Return a new history made up of this history followed by an annotation. This history is not modified.
+
+        :param annotation: The annotation to add at the end of the history.
+        :return: A new AnnotationHistory that shares this history.
+        """
+        return AnnotationHistory(annotation, self if self.depth else None)
+
+    def __len__(self) -> int:
+        return self.depth
+
+    def __iter__(self) -> Iterator:
+        return reversed(self._reversed_annotations())
+
+    def __reversed__(self) -> Iterator:
+        return iter(self._reversed_annotations())
+
+    def _reversed_annotations(self) -> list:
+        annotations = []
+        history = self
+        while history is not None and history.depth:
+            annotations.append(history.last)
+            history = history.previous
+        return annotations
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+
+        if index < 0:
+            index += self.depth
+        if not 0 <= index < self.depth:
+            raise IndexError("AnnotationHistory index out of range")
+
+        history = self
+        for _ in range(self.depth - 1 - index):
+            history = history.previous
+        return history.last
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, (AnnotationHistory, list, tuple)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return all(a is b or a == b for a, b in zip(self, other))
+
+    # Annotations are mutable, so histories of them can't be hashed.
+    __hash__ = None
+
+    def __repr__(self):
+        return f"AnnotationHistory({list(self)!r})"
+
+    def __reduce__(self):
+        # Pickle the links rather than a flattened list, so that histories shared between annotations are only
+        # stored once.
+        return AnnotationHistory, (self.last, self.previous)
+
+
+AnnotationHistory.EMPTY = AnnotationHistory()
+
+
+class ProvenanceView(Sequence):
+    """
+    A read-only view of the provenances of an annotation: the provenances of every annotation in its history, followed
+    by its own provenance. The view is computed lazily from the annotation, and compares equal to lists and tuples of
+    the same provenances.
+    """
+
+    __slots__ = ("annotation",)
+
+    def __init__(self, annotation):
+        self.annotation = annotation
+
+    def __len__(self) -> int:
+        return len(self.annotation.based_on) + 1
+
+    def __iter__(self) -> Iterator[AnnotationProvenance]:
+        for annotation in self.annotation.based_on:
+            yield annotation.provenance
+        yield self.annotation.provenance
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("ProvenanceView index out of range")
+
+        if index == length - 1:
+            return self.annotation.provenance
+        return self.annotation.based_on[index].provenance
+
+    def __eq__(self, other):
+        if not isinstance(other, (ProvenanceView, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+@dataclass(slots=True)
 class Annotation:
     """
     A class for storing a single annotation.
 
-    The `based_on` field is a list of other annotations that this annotation is based on, in order of annotation:
-    for example, if you run an annotation through BioMegatron, then SAPBERT, then NodeNorm, the BioMegatron annotation
-    will be at `based_on[0]`, SAPBERT annotation will be at `based_on[1]`, and NodeNorm annotation will be at
-    `based_on[2]`.
+    The `based_on` field is an AnnotationHistory of other annotations that this annotation is based on, in order of
+    annotation: for example, if you run an annotation through BioMegatron, then SAPBERT, then NodeNorm, the BioMegatron
+    annotation will be at `based_on[0]`, SAPBERT annotation will be at `based_on[1]`, and NodeNorm annotation will be
+    at `based_on[2]`. Histories are immutable and share their earlier entries, so adding a stage is O(1) and the same
+    history can be shared between annotations (e.g. all the annotations produced by reannotating a single annotation).
+    Lists or tuples passed in as `based_on` are converted into histories.
     """
 
     text: str
@@ -33,16 +235,24 @@ class Annotation:
     start: int
     end: int
     provenance: AnnotationProvenance
-    based_on: list[Self] = field(default_factory=list)
+    based_on: AnnotationHistory = field(default_factory=lambda: AnnotationHistory.EMPTY)
     props: dict = field(default_factory=dict)
 
+    def __post_init__(self):
+        if not isinstance(self.based_on, AnnotationHistory):
+            self.based_on = AnnotationHistory.from_iterable(self.based_on)
+
     @property
-    def provenances(self) -> list[AnnotationProvenance]:
-        """Return a list of provenances for this annotation and its based_on annotations."""
-        return list(map(lambda ann: ann.provenance, self.based_on)) + [self.provenance]
+    def provenances(self) -> ProvenanceView:
+        """Return a view of the provenances of this annotation's based_on annotations, followed by its own."""
+        return ProvenanceView(self)
 
+    def history(self) -> AnnotationHistory:
+        """Return the history of any annotation based on this annotation, i.e. its based_on followed by itself."""
+        return self.based_on.extended_with(self)
 
-@dataclass
+
+@dataclass(slots=True)
 class NormalizedAnnotation(Annotation):
     """
     A NormalizedAnnotation is an Annotation that has been normalized. It has a Biolink type (starting with `biolink:`),
@@ -64,8 +274,8 @@ class NormalizedAnnotation(Annotation):
 
         # TODO: it'd probably be a good idea to check formatting for CURIEs as well, but that's less well defined.
 
-        # No problems.
-        super().__setattr__(name, value)
+        # No problems. (We can't use the zero-argument form of super() in a slotted dataclass.)
+        super(NormalizedAnnotation, self).__setattr__(name, value)
 
     @classmethod
     def from_annotation(
@@ -114,7 +324,7 @@ class NormalizedAnnotation(Annotation):
             start=annotation.start,
             end=annotation.end,
             provenance=provenance,
-            based_on=[*annotation.based_on, annotation],
+            based_on=annotation.history(),
             props=annotation.props,
             # These fields are overwritten during normalization.
             id=curie,
@@ -128,12 +338,21 @@ class NormalizedAnnotation(Annotation):
 class AnnotatedText:
     """
     A class for storing a text along with a set of annotations from a single source.
+
+    The `errors` field lists any problems encountered while producing these annotations that did not stop the
+    rest of the text from being annotated (e.g. a single annotation that could not be reannotated).
     """
 
     text: str
     annotations: list[Annotation] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
 
-    def transform(self, transformer: "Transformer", props: dict = None) -> Self:
+    def transform(
+        self,
+        transformer: "Transformer",
+        props: dict | None = None,
+        stats: "StatsCollector" = None,
+    ) -> Self:
         """
         Transform the annotations in this AnnotatedText with a transformer.
 
@@ -141,14 +360,28 @@ class AnnotatedText:
 
         :param transformer: A Transformer to transform this annotated text.
         :param props: The properties to pass to the transformer.
+        :param stats: A StatsCollector (see renci_ner.instrumentation) to record this transformation in, as a stage
+            named after the transformer's class. Default: don't record it.
         :return: The transformed AnnotatedText.
         """
         if props is None:
             props = {}
 
+        if stats is not None:
+            return stats.run_stage(
+                type(transformer).__name__, transformer.transform, self, props
+            )
+
         return transformer.transform(self, props)
 
-    def reannotate(self, annotator: "Annotator", props: dict = None) -> Self:
+    def reannotate(
+        self,
+        annotator: "Annotator",
+        props: dict | None = None,
+        max_workers: int | None = None,
+        stats: "StatsCollector" = None,
+        collect_errors: bool | None = None,
+    ) -> Self:
         """
         Reannotate the annotations in this AnnotatedText with another annotator.
 
@@ -160,26 +393,143 @@ class AnnotatedText:
         - If an annotation is annotated by the next annotator with multiple annotations, we will replace this
           annotation with all of those annotations, with provenance and based_on fields updated appropriately.
 
+        If `max_workers` is greater than one, the annotator will be called on up to that many texts concurrently.
+        If `collect_errors` is true, an annotation that could not be reannotated is left as-is and the error is added
+        to the `errors` of the returned AnnotatedText, rather than aborting the entire reannotation. This works in the
+        same way whether or not the calls are concurrent.
+
         :param annotator: The other annotator to annotate these annotations with.
         :type annotator: Annotator
         :param props: A dictionary of properties to pass to the annotator.
+        :param max_workers: The maximum number of concurrent calls to the annotator. Overrides the `max_workers`
+            property if set. Default: one call at a time.
+        :param stats: A StatsCollector (see renci_ner.instrumentation) to record this reannotation in, as a stage
+            named after the annotator's class. Default: don't record it.
+        :param collect_errors: Whether to record annotations that could not be reannotated in `errors` rather than
+            raising the error. Overrides the `collect_errors` property if set. Default: False.
+        :return: AnnotatedText with annotations re-annotated with the other annotator.
+        """
+
+        if props is None:
+            props = {}
+
+        if max_workers is not None:
+            props = {**props, "max_workers": max_workers}
+        if collect_errors is not None:
+            props = {**props, "collect_errors": collect_errors}
+
+        if stats is not None:
+            return stats.run_stage(
+                type(annotator).__name__, type(self).reannotate, self, annotator, props
+            )
+
+        # Annotate every distinct annotation text once, in a single batch, so that annotators with a bulk endpoint
+        # can look up the whole document in a handful of requests.
+        texts = self._distinct_texts()
+        results = annotator.annotate_batch(texts, props=props)
+
+        return self._replace_annotations(annotator.provenance, texts, results)
+
+    async def areannotate(
+        self,
+        annotator: "AsyncAnnotator",
+        props: dict | None = None,
+        max_concurrency: int | None = None,
+        stats: "StatsCollector" = None,
+        collect_errors: bool | None = None,
+    ) -> Self:
+        """
+        Reannotate the annotations in this AnnotatedText with an asynchronous annotator. This works in the same way
+        as `reannotate()`, except that up to `max_concurrency` texts may be annotated at the same time.
+
+        :param annotator: The other annotator to annotate these annotations with.
+        :type annotator: AsyncAnnotator
+        :param props: A dictionary of properties to pass to the annotator.
+        :param max_concurrency: The maximum number of annotator calls in flight at once. Overrides the
+            `max_concurrency` property if set. Default: 100.
+        :param stats: A StatsCollector to record this reannotation in, as in `reannotate()`.
+        :param collect_errors: Whether to record annotations that could not be reannotated in `errors` rather than
+            raising the error, as in `reannotate()`. Default: False.
         :return: AnnotatedText with annotations re-annotated with the other annotator.
         """
 
         if props is None:
             props = {}
 
+        if max_concurrency is not None:
+            props = {**props, "max_concurrency": max_concurrency}
+        if collect_errors is not None:
+            props = {**props, "collect_errors": collect_errors}
+
+        if stats is not None:
+            return await stats.arun_stage(
+                type(annotator).__name__, type(self).areannotate, self, annotator, props
+            )
+
+        texts = self._distinct_texts()
+        results = await annotator.annotate_batch(texts, props=props)
+
+        return self._replace_annotations(annotator.provenance, texts, results)
+
+    async def atransform(
+        self,
+        transformer: "AsyncTransformer",
+        props: dict | None = None,
+        stats: "StatsCollector" = None,
+    ) -> Self:
+        """
+        Transform the annotations in this AnnotatedText with an asynchronous transformer.
+
+        :param transformer: An AsyncTransformer to transform this annotated text.
+        :param props: The properties to pass to the transformer.
+        :param stats: A StatsCollector to record this transformation in, as in `transform()`.
+        :return: The transformed AnnotatedText.
+        """
+        if props is None:
+            props = {}
+
+        if stats is not None:
+            return await stats.arun_stage(
+                type(transformer).__name__, transformer.transform, self, props
+            )
+
+        return await transformer.transform(self, props)
+
+    def _distinct_texts(self) -> list[str]:
+        """Return the distinct texts of the annotations in this AnnotatedText, in order of first appearance."""
+        return list(dict.fromkeys(annotation.text for annotation in self.annotations))
+
+    def _replace_annotations(
+        self,
+        provenance: AnnotationProvenance,
+        texts: list[str],
+        annotated_texts: list["AnnotatedText"],
+    ) -> Self:
+        """
+        Replace each annotation in this AnnotatedText with the annotations found for its text by a reannotation,
+        fixing up their start/end indices, provenance and based_on.
+
+        :param provenance: The provenance of the annotator used for the reannotation.
+        :param texts: The distinct annotation texts that were reannotated.
+        :param annotated_texts: The result of reannotating each of those texts, in the same order.
+        :return: AnnotatedText with the reannotated annotations.
+        """
+        results = dict(zip(texts, annotated_texts))
+
+        errors = list(self.errors)
+        for result in results.values():
+            errors.extend(result.errors)
+
         new_annotations = []
         for annotation in self.annotations:
-            annotated_text = annotator.annotate(annotation.text, props=props)
-            reannotations = annotated_text.annotations
+            reannotations = results[annotation.text].annotations
             if len(reannotations) == 0:
                 # Leave the current annotation unchanged.
                 new_annotations.append(annotation)
             else:
                 # We have one or more annotations. So we need to update the based_on by adding annotation to the
-                # existing list.
-                new_based_on = [*annotation.based_on, annotation]
+                # existing history, which will be shared between all the reannotations.
+                new_based_on = annotation.history()
                 base_start = annotation.start
 
                 for reannotation in reannotations:
@@ -189,15 +539,362 @@ class AnnotatedText:
                     text_size = len(reannotation.text)
                     assert text_size == (reannotation.end - reannotation.start)
 
-                    reannotation.start = base_start + new_start
-                    reannotation.end = base_start + new_start + text_size
+                    # The same reannotation may be shared by several annotations with the same text, so we make
+                    # a copy rather than modifying it in place.
+                    new_annotations.append(
+                        dataclasses.replace(
+                            reannotation,
+                            start=base_start + new_start,
+                            end=base_start + new_start + text_size,
+                            provenance=provenance,
+                            based_on=new_based_on,
+                            props=dict(reannotation.props),
+                        )
+                    )
+
+        return AnnotatedText(self.text, new_annotations, errors)
+
+
+def _import_optional(module: str, extra: str):
+    """Import an optional dependency, with a helpful error message if it isn't installed."""
+    try:
+        return importlib.import_module(module)
+    except ImportError as err:
+        raise ImportError(
+            f"This feature requires {module}: install it with `pip install renci-ner[{extra}]`."
+        ) from err
+
+
+class DictionaryColumn:
+    """
+    A dictionary-encoded column: every distinct value is stored once in `values`, and each row is stored as an
+    integer code into `values` in the `codes` array. None is stored as the code -1.
+    """
+
+    __slots__ = ("_index", "codes", "values")
+
+    def __init__(self):
+        self.values = []
+        self.codes = array("q")
+        self._index = {}
 
-                    reannotation.provenance = annotator.provenance
-                    reannotation.based_on = new_based_on
+    def encode(self, value) -> int:
+        """Return the code for a value, adding it to `values` if necessary (but not adding a row)."""
+        if value is None:
+            return -1
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self._index[value] = code
+        return code
 
-                    new_annotations.append(reannotation)
+    def append(self, value):
+        """Add a row with this value."""
+        self.codes.append(self.encode(value))
 
-        return AnnotatedText(self.text, new_annotations)
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index: int):
+        code = self.codes[index]
+        return None if code < 0 else self.values[code]
+
+    def __iter__(self) -> Iterator:
+        values = self.values
+        return (None if code < 0 else values[code] for code in self.codes)
+
+    def to_arrow(self):
+        """Return this column as a pyarrow.DictionaryArray. Requires pyarrow."""
+        pa = _import_optional("pyarrow", "arrow")
+        indices = _int64_to_arrow(pa, self.codes)
+        if -1 in self.codes:
+            indices = pa.array(
+                [None if code < 0 else code for code in self.codes], type=pa.int64()
+            )
+        return pa.DictionaryArray.from_arrays(
+            indices, pa.array(self.values, type=pa.string())
+        )
+
+
+def _int64_to_arrow(pa, values: array):
+    """
+    Copy an array('q') into a pyarrow Int64Array. We copy it (a single memcpy) rather than wrapping it, because an
+    array that is exporting its buffer can't be resized, so later calls to AnnotationBatch.add() would fail.
+    """
+    return pa.Array.from_buffers(
+        pa.int64(), len(values), [None, pa.py_buffer(values.tobytes())]
+    )
+
+
+class AnnotationBatch:
+    """
+    A columnar store for the annotations of many texts, for use when there are too many annotations to store as
+    individual Annotation objects (e.g. for analytics over a large corpus).
+
+    Each row is one annotation. Its `document` (the index of its text in `texts`), `starts` and `ends` are stored in
+    integer arrays; its text, ID, label, type and Biolink type are stored in dictionary-encoded columns, so that each
+    distinct string is only stored once; and its provenance is stored as a code into a small table of provenances.
+    Properties and based_on histories are stored as-is, with empty properties stored as None.
+
+    Use `from_annotated_texts()` and `to_annotated_texts()` to convert to and from AnnotatedTexts, `to_numpy()` and
+    `to_arrow()` to copy the columns into NumPy or Arrow, and `Annotator.annotate_columnar()` to
+    annotate texts directly into a batch.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.errors = {}
+        self.documents = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.annotation_texts = DictionaryColumn()
+        self.ids = DictionaryColumn()
+        self.labels = DictionaryColumn()
+        self.types = DictionaryColumn()
+        self.biolink_types = DictionaryColumn()
+        self.provenances = DictionaryColumn()
+        self.props = []
+        self.histories = [AnnotationHistory.EMPTY]
+        self.history_codes = array("q")
+        self._history_index = {}
+
+    def __len__(self) -> int:
+        """The number of annotations in this batch."""
+        return len(self.starts)
+
+    def add_text(self, text: str, errors: Iterable[str] = ()) -> int:
+        """
+        Add a text to this batch.
+
+        :param text: The text that was annotated.
+        :param errors: Any errors encountered while annotating this text.
+        :return: The index of this text, to be used as the `document` of its annotations.
+        """
+        self.texts.append(text)
+        document = len(self.texts) - 1
+        errors = list(errors)
+        if errors:
+            self.errors[document] = errors
+        return document
+
+    def add(
+        self,
+        document: int,
+        text: str,
+        id: str,
+        label: str,
+        type: str,
+        start: int,
+        end: int,
+        provenance: AnnotationProvenance,
+        biolink_type: str | None = None,
+        props: dict | None = None,
+        based_on: AnnotationHistory = AnnotationHistory.EMPTY,
+    ):
+        """
+        Add an annotation to this batch, without creating an Annotation object. The arguments are the same as the
+        fields of Annotation; if `biolink_type` is set, the annotation is a NormalizedAnnotation.
+
+        :param document: The index of the text this annotation belongs to (see `add_text()`).
+        """
+        self.documents.append(document)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.annotation_texts.append(text)
+        self.ids.append(id)
+        self.labels.append(label)
+        self.types.append(type)
+        self.biolink_types.append(biolink_type)
+        self.provenances.append(provenance)
+        self.props.append(props or None)
+        self.history_codes.append(self._history_code(based_on))
+
+    def _history_code(self, based_on: AnnotationHistory) -> int:
+        """Return the code for a based_on history. Histories are shared between annotations, so we compare them by
+        identity rather than by value."""
+        if len(based_on) == 0:
+            return 0
+        code = self._history_index.get(id(based_on))
+        if code is None:
+            code = len(self.histories)
+            self.histories.append(based_on)
+            self._history_index[id(based_on)] = code
+        return code
+
+    def append(self, document: int, annotation: Annotation):
+        """Add an Annotation object to this batch."""
+        self.add(
+            document,
+            text=annotation.text,
+            id=annotation.id,
+            label=annotation.label,
+            type=annotation.type,
+            start=annotation.start,
+            end=annotation.end,
+            provenance=annotation.provenance,
+            biolink_type=getattr(annotation, "biolink_type", None),
+            props=annotation.props,
+            based_on=annotation.based_on,
+        )
+
+    @classmethod
+    def from_annotated_texts(cls, annotated_texts: Iterable[AnnotatedText]) -> Self:
+        """Return a batch containing the annotations (and errors) of these AnnotatedTexts."""
+        batch = cls()
+        for annotated_text in annotated_texts:
+            document = batch.add_text(annotated_text.text, annotated_text.errors)
+            for annotation in annotated_text.annotations:
+                batch.append(document, annotation)
+        return batch
+
+    def annotation(self, index: int) -> Annotation:
+        """Return the annotation in a particular row as an Annotation (or NormalizedAnnotation) object."""
+        fields = {
+            "text": self.annotation_texts[index],
+            "id": self.ids[index],
+            "label": self.labels[index],
+            "type": self.types[index],
+            "start": self.starts[index],
+            "end": self.ends[index],
+            "provenance": self.provenances[index],
+            "based_on": self.histories[self.history_codes[index]],
+            "props": dict(self.props[index] or {}),
+        }
+        biolink_type = self.biolink_types[index]
+        if biolink_type is None:
+            return Annotation(**fields)
+        return NormalizedAnnotation(biolink_type=biolink_type, **fields)
+
+    def __iter__(self) -> Iterator[Annotation]:
+        """Iterate over the annotations in this batch as Annotation objects."""
+        return (self.annotation(index) for index in range(len(self)))
+
+    def to_annotated_texts(self) -> list[AnnotatedText]:
+        """Return one AnnotatedText for each text in this batch, with its annotations and errors."""
+        annotated_texts = [
+            AnnotatedText(text, [], list(self.errors.get(document, [])))
+            for document, text in enumerate(self.texts)
+        ]
+        for index, document in enumerate(self.documents):
+            annotated_texts[document].annotations.append(self.annotation(index))
+        return annotated_texts
+
+    def to_numpy(self) -> dict:
+        """
+        Return the columns of this batch as NumPy arrays. Requires NumPy.
+
+        The integer columns are copied, so the batch can still be added to afterwards. Dictionary-encoded columns
+        are returned as arrays of codes (e.g. `id_codes`) -- look the codes up in e.g. `batch.ids.values`, with
+        -1 meaning None.
+
+        :return: A dictionary of column names to NumPy arrays.
+        """
+        np = _import_optional("numpy", "numpy")
+
+        def as_numpy(values: array):
+            # Copy the column: a view would stop the array from being resized by a later add().
+            return (
+                np.frombuffer(values, dtype=np.int64).copy()
+                if values
+                else np.zeros(0, np.int64)
+            )
+
+        return {
+            "document": as_numpy(self.documents),
+            "start": as_numpy(self.starts),
+            "end": as_numpy(self.ends),
+            "text_codes": as_numpy(self.annotation_texts.codes),
+            "id_codes": as_numpy(self.ids.codes),
+            "label_codes": as_numpy(self.labels.codes),
+            "type_codes": as_numpy(self.types.codes),
+            "biolink_type_codes": as_numpy(self.biolink_types.codes),
+            "provenance_codes": as_numpy(self.provenances.codes),
+        }
+
+    def to_arrow(self):
+        """
+        Return this batch as a pyarrow.Table, with one row per annotation. Requires pyarrow.
+
+        The integer columns are copied, so the batch can still be added to afterwards, and string columns are
+        dictionary-encoded. Provenances are
+        returned as dictionary-encoded `provenance_name`, `provenance_url` and `provenance_version` columns.
+        Properties and based_on histories are not included.
+        """
+        pa = _import_optional("pyarrow", "arrow")
+
+        provenance_codes = _int64_to_arrow(pa, self.provenances.codes)
+        provenance_columns = {
+            f"provenance_{name}": pa.DictionaryArray.from_arrays(
+                provenance_codes,
+                pa.array(
+                    [
+                        getattr(provenance, name)
+                        for provenance in self.provenances.values
+                    ],
+                    type=pa.string(),
+                ),
+            )
+            for name in ("name", "url", "version")
+        }
+
+        return pa.table(
+            {
+                "document": _int64_to_arrow(pa, self.documents),
+                "start": _int64_to_arrow(pa, self.starts),
+                "end": _int64_to_arrow(pa, self.ends),
+                "text": self.annotation_texts.to_arrow(),
+                "id": self.ids.to_arrow(),
+                "label": self.labels.to_arrow(),
+                "type": self.types.to_arrow(),
+                "biolink_type": self.biolink_types.to_arrow(),
+                **provenance_columns,
+            }
+        )
+
+
+def _collect_errors(props: dict) -> bool:
+    """Return True if the `collect_errors` property asks for failures to be recorded rather than raised."""
+    value = props.get("collect_errors", False)
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
+def _map_texts(
+    name: str, function, texts: list[str], props: dict
+) -> tuple[list, list[str | None]]:
+    """
+    Call `function(text, props)` on each text. If the `max_workers` property is greater than one, up to that many
+    calls are made concurrently. If the `collect_errors` property is true, a call that fails is logged and recorded as
+    an error; otherwise the first failure is raised.
+
+    :param name: The name of the annotator, for error messages.
+    :param function: The function to call on each text.
+    :param texts: The texts to call it on.
+    :param props: The properties to pass to the function.
+    :return: A list of results and a list of errors (None if there was no error), in the same order as `texts`.
+    """
+    collect_errors = _collect_errors(props)
+
+    def call(text):
+        try:
+            return function(text, props), None
+        except Exception as err:
+            if not collect_errors:
+                raise
+            message = f"{name} could not annotate {text!r}: {err}"
+            logger.error(message)
+            return None, message
+
+    max_workers = props.get("max_workers", 1)
+    if max_workers <= 1 or len(texts) <= 1:
+        outcomes = [call(text) for text in texts]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(in_current_context(call), texts))
+
+    return [result for result, _ in outcomes], [error for _, error in outcomes]
 
 
 class Annotator:
@@ -212,13 +909,13 @@ class Annotator:
 
         :return AnnotationProvenance: The provenance of annotations generated by this Annotator.:
         """
-        return AnnotationProvenance(
+        return AnnotationProvenance.shared(
             name="Annotator",
             url="http://example.org/",
             version="0.0.1",
         )
 
-    def annotate(self, text: str, props: dict = None) -> AnnotatedText:
+    def annotate(self, text: str, props: dict | None = None) -> AnnotatedText:
         """
         Annotate a text. Service-specific properties (see supported_properties for descriptions) can be passed in via
         `props`.
@@ -229,6 +926,44 @@ class Annotator:
         """
         return AnnotatedText(text, [])
 
+    def annotate_batch(
+        self, texts: list[str], props: dict | None = None
+    ) -> list[AnnotatedText]:
+        """
+        Annotate several texts with the same properties. Annotators that can look up many texts in a single request
+        should override this method; by default, we call `annotate()` on each text in turn.
+
+        If the `max_workers` property is greater than one, up to that many `annotate()` calls will be made
+        concurrently. If the `collect_errors` property is true, any text that could not be annotated will be returned
+        without annotations and with the error recorded in its `errors`; otherwise the error is raised.
+
+        :param texts: The texts to annotate.
+        :param props: Properties supported by this annotator to use during the annotation.
+        :return: A list of AnnotatedText, one for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = _map_texts(type(self).__name__, self.annotate, texts, props)
+        return [
+            AnnotatedText(text, [], [error]) if error is not None else result
+            for text, result, error in zip(texts, results, errors)
+        ]
+
+    def annotate_columnar(
+        self, texts: list[str], props: dict | None = None
+    ) -> AnnotationBatch:
+        """
+        Annotate several texts into a single columnar AnnotationBatch. Annotators that can add their results to the
+        batch without creating Annotation objects should override this method; by default, we convert the results
+        of `annotate_batch()`.
+
+        :param texts: The texts to annotate.
+        :param props: Properties supported by this annotator to use during the annotation.
+        :return: An AnnotationBatch with one text for each text in `texts` in the same order.
+        """
+        return AnnotationBatch.from_annotated_texts(self.annotate_batch(texts, props))
+
     def supported_properties(self) -> dict[str, str]:
         """
         Return a dictionary of supported properties for this service. The keys are the property names, and the values
@@ -254,7 +989,7 @@ class Transformer:
         return {}
 
     def transform(
-        self, annotated_text: AnnotatedText, props: dict = None
+        self, annotated_text: AnnotatedText, props: dict | None = None
     ) -> AnnotatedText:
         """
         Transform an annotated text into a new annotated text.
@@ -266,3 +1001,302 @@ class Transformer:
         :return: The transformed AnnotatedText.
         """
         return annotated_text
+
+    def transform_many(
+        self, annotated_texts: Iterable[AnnotatedText], props: dict | None = None
+    ) -> Iterator[AnnotatedText]:
+        """
+        Transform many annotated texts, e.g. every document in a corpus. Transformers that can transform many texts
+        more efficiently than one at a time should override this method; by default, we call `transform()` on each
+        text in turn.
+
+        :param annotated_texts: The annotated texts to transform. This may be a generator.
+        :param props: Properties supported by this transformer to use during the transformation.
+        :return: A generator of the transformed AnnotatedTexts, in the same order.
+        """
+        for annotated_text in annotated_texts:
+            yield self.transform(annotated_text, props)
+
+
+class AsyncAnnotator:
+    """
+    An interface for a service that can annotate text asynchronously, for use in asyncio applications.
+    """
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """
+        Return an AnnotationProvenance describing annotations produced by this service.
+
+        :return AnnotationProvenance: The provenance of annotations generated by this AsyncAnnotator.
+        """
+        return AnnotationProvenance.shared(
+            name="AsyncAnnotator",
+            url="http://example.org/",
+            version="0.0.1",
+        )
+
+    async def annotate(self, text: str, props: dict | None = None) -> AnnotatedText:
+        """
+        Annotate a text. Service-specific properties (see supported_properties for descriptions) can be passed in via
+        `props`.
+
+        :param text: The text to annotate.
+        :param props: Properties supported by this annotator to use during the annotation.
+        :return AnnotatedText: The annotated text.
+        """
+        return AnnotatedText(text, [])
+
+    async def annotate_batch(
+        self, texts: list[str], props: dict | None = None
+    ) -> list[AnnotatedText]:
+        """
+        Annotate several texts with the same properties. By default, we call `annotate()` on every text with up to
+        `max_concurrency` (default: 100) calls in flight at once. If the `collect_errors` property is true, any text
+        that could not be annotated will be returned without annotations and with the error recorded in its
+        `errors`; otherwise the error is raised.
+
+        :param texts: The texts to annotate.
+        :param props: Properties supported by this annotator to use during the annotation.
+        :return: A list of AnnotatedText, one for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        collect_errors = _collect_errors(props)
+        semaphore = asyncio.Semaphore(
+            props.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        )
+
+        async def annotate_one(text: str) -> AnnotatedText:
+            async with semaphore:
+                try:
+                    return await self.annotate(text, props=props)
+                except Exception as err:
+                    if not collect_errors:
+                        raise
+                    message = (
+                        f"{type(self).__name__} could not annotate {text!r}: {err}"
+                    )
+                    logger.error(message)
+                    return AnnotatedText(text, [], [message])
+
+        return list(await asyncio.gather(*(annotate_one(text) for text in texts)))
+
+    def supported_properties(self) -> dict[str, str]:
+        """
+        Return a dictionary of supported properties for this service. The keys are the property names, and the values
+        are descriptions of the properties.
+
+        :return: A dictionary of supported properties, with the values describing each property.
+        """
+        return {}
+
+
+class AsyncTransformer:
+    """
+    An interface for transforming annotated text asynchronously, for use in asyncio applications.
+    """
+
+    def supported_properties(self) -> dict[str, str]:
+        """
+        Return a dictionary of supported properties for this service. The keys are the property names, and the values
+        are descriptions of the properties.
+
+        :return: A dictionary of supported properties, with the values describing each property.
+        """
+        return {}
+
+    async def transform(
+        self, annotated_text: AnnotatedText, props: dict | None = None
+    ) -> AnnotatedText:
+        """
+        Transform an annotated text into a new annotated text.
+
+        Note that in this case the Transformer is responsible for updating the provenance of the transformed annotations.
+
+        :param annotated_text: The annotated text to transform.
+        :param props: Properties supported by this transformer to use during the transformation.
+        :return: The transformed AnnotatedText.
+        """
+        return annotated_text
+
+
+def _ordered_map(
+    function, items: Iterator, executor: ThreadPoolExecutor, max_in_flight: int
+) -> Iterator:
+    """
+    Apply a function to each (record, value) pair from an iterator in a thread pool, with up to `max_in_flight`
+    calls outstanding at once, and yield (record, result) pairs in the original order. Items are only read from
+    the iterator as space becomes available, so a slow consumer will slow down the producer.
+    """
+    in_flight = collections.deque()
+    for record, value in items:
+        in_flight.append((record, executor.submit(function, value)))
+        if len(in_flight) >= max_in_flight:
+            record, future = in_flight.popleft()
+            yield record, future.result()
+    while in_flight:
+        record, future = in_flight.popleft()
+        yield record, future.result()
+
+
+class Pipeline:
+    """
+    A pipeline for annotating a stream of texts: each text is annotated with an Annotator, and the resulting
+    AnnotatedText is then reannotated and transformed by any number of further stages, in order.
+
+    Every stage runs in its own thread pool with up to `max_in_flight` texts in progress, so different texts can be
+    at different stages at the same time (e.g. NodeNorm normalizing one document while NameRes is linking the next
+    and BioMegatron is annotating the one after that). Texts are only read from the input as the pipeline has room
+    for them, and results are yielded in the same order as the input.
+
+    By default, a stage that fails on a text raises its error, which ends the run and discards the texts that are
+    still in progress. If `collect_errors` is true, the failure is instead recorded in the `errors` of that text's
+    AnnotatedText (with the annotations it had before the failing stage), and the run carries on with the next text.
+
+    For example:
+
+        pipeline = Pipeline(BioMegatron()).reannotate(NameRes(), {"limit": 1}).transform(NodeNorm())
+        for annotated_text in pipeline.run(texts):
+            ...
+    """
+
+    def __init__(
+        self,
+        annotator: Annotator,
+        props: dict | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        collect_errors: bool = False,
+    ):
+        """
+        Create a pipeline that starts by annotating each text with an annotator.
+
+        :param annotator: The annotator to annotate each text with.
+        :param props: The properties to pass to the annotator.
+        :param max_in_flight: The maximum number of texts being annotated at once. Default: 8.
+        :param collect_errors: Whether to record a stage that fails on a text in the `errors` of its AnnotatedText
+            rather than raising the error. Default: False.
+        """
+        self.collect_errors = collect_errors
+        self.stages = []
+        self._add_stage(
+            lambda text: annotator.annotate(text, props),
+            max_in_flight,
+            f"{type(annotator).__name__} could not annotate",
+        )
+
+    def _add_stage(self, function, max_in_flight: int, failure: str) -> Self:
+        """
+        Add a stage that applies a function to the output of the previous stage.
+
+        :param function: The function to apply.
+        :param max_in_flight: The maximum number of calls to the function at once.
+        :param failure: The start of the error message recorded when the function fails on a text.
+        :return: This pipeline, so that stages can be chained.
+        """
+        self.stages.append((function, max_in_flight, failure))
+        return self
+
+    def _recording_errors(self, function, failure: str):
+        """
+        Wrap a stage function so that a failure is recorded in the `errors` of the text's AnnotatedText instead of
+        being raised, if this pipeline collects errors.
+        """
+        if not self.collect_errors:
+            return function
+
+        def call(value):
+            try:
+                return function(value)
+            except Exception as err:
+                # The first stage is given the text, and later stages the AnnotatedText from the previous stage.
+                if isinstance(value, AnnotatedText):
+                    annotated_text = value
+                else:
+                    annotated_text = AnnotatedText(value, [])
+                message = f"{failure} {annotated_text.text!r}: {err}"
+                logger.exception(message)
+                return AnnotatedText(
+                    annotated_text.text,
+                    annotated_text.annotations,
+                    [*annotated_text.errors, message],
+                )
+
+        return call
+
+    def reannotate(
+        self,
+        annotator: Annotator,
+        props: dict | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ) -> Self:
+        """
+        Add a stage that reannotates each AnnotatedText with another annotator (see AnnotatedText.reannotate()).
+
+        :param annotator: The annotator to reannotate each AnnotatedText with.
+        :param props: The properties to pass to the annotator.
+        :param max_in_flight: The maximum number of texts being reannotated at once. Default: 8.
+        :return: This pipeline, so that stages can be chained.
+        """
+        return self._add_stage(
+            lambda annotated_text: annotated_text.reannotate(annotator, props),
+            max_in_flight,
+            f"{type(annotator).__name__} could not reannotate",
+        )
+
+    def transform(
+        self,
+        transformer: Transformer,
+        props: dict | None = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    ) -> Self:
+        """
+        Add a stage that transforms each AnnotatedText with a transformer (see AnnotatedText.transform()).
+
+        :param transformer: The transformer to transform each AnnotatedText with.
+        :param props: The properties to pass to the transformer.
+        :param max_in_flight: The maximum number of texts being transformed at once. Default: 8.
+        :return: This pipeline, so that stages can be chained.
+        """
+        return self._add_stage(
+            lambda annotated_text: annotated_text.transform(transformer, props),
+            max_in_flight,
+            f"{type(transformer).__name__} could not transform",
+        )
+
+    def run_records(
+        self, records: Iterable[dict], text_field: str = "text"
+    ) -> Iterator[tuple[dict, AnnotatedText]]:
+        """
+        Run the pipeline on a stream of records, such as the lines of a JSONL file (e.g.
+        `pipeline.run_records(map(json.loads, file))`).
+
+        :param records: The records to annotate. This may be a generator.
+        :param text_field: The field in each record that contains the text to annotate. Default: "text".
+        :return: A generator of (record, AnnotatedText) pairs, in the same order as the records.
+        """
+        with contextlib.ExitStack() as stack:
+            items = ((record, record[text_field]) for record in records)
+            for function, max_in_flight, failure in self.stages:
+                executor = stack.enter_context(
+                    ThreadPoolExecutor(max_workers=max_in_flight)
+                )
+                items = _ordered_map(
+                    in_current_context(self._recording_errors(function, failure)),
+                    items,
+                    executor,
+                    max_in_flight,
+                )
+            yield from items
+
+    def run(self, texts: Iterable[str]) -> Iterator[AnnotatedText]:
+        """
+        Run the pipeline on a stream of texts.
+
+        :param texts: The texts to annotate. This may be a generator.
+        :return: A generator of AnnotatedTexts, in the same order as the texts.
+        """
+        records = ({"text": text} for text in texts)
+        for _, annotated_text in self.run_records(records):
+            yield annotated_text
@@ -0,0 +1,247 @@
+"""
+Instrumentation for finding out where the time goes in a pipeline.
+
+Every service reports each request it makes (with its size, network latency and JSON parse time) and the number of
+annotations it produces to the instruments that have been added with `add_instrument()` or `instrument()`. There are
+no instruments by default, in which case services only check that there aren't any.
+
+To write your own instrument (e.g. to create OpenTelemetry spans or log slow requests), subclass Instrument and
+override `on_request()` and/or `on_annotations()`. Instruments may be called from several threads at once.
+
+Instruments can also be scoped to a single call with `scoped_instrument()`, in which case they only receive the
+events of services called by the current thread (or asyncio task) while it is active, and of the thread pools that
+the library starts on its behalf. Overlapping calls on other threads each have their own scoped instruments.
+
+StatsCollector is an instrument that adds up these numbers for each service. It can also be passed as `stats` to
+`AnnotatedText.reannotate()` and `transform()`, which then add up how long each stage took, counting only the events
+of that stage:
+
+    stats = StatsCollector()
+    annotated = biomegatron.annotate(text).reannotate(nameres, stats=stats).transform(nodenorm, stats=stats)
+    print(stats.as_dict())
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+
+@dataclass(slots=True)
+class RequestEvent:
+    """A description of a single request made to a service."""
+
+    service: str
+    method: str
+    url: str
+    # The HTTP status code of the response, or None if no response was received.
+    status: int = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    # The time from sending the request to receiving the response.
+    network_seconds: float = 0.0
+    # The time taken to parse the JSON response.
+    parse_seconds: float = 0.0
+    # A description of the error, if the request failed.
+    error: str = None
+
+
+class Instrument:
+    """An interface for receiving instrumentation from services. The default implementations do nothing."""
+
+    def on_request(self, event: RequestEvent):
+        """Called after every request made by a service, whether or not it succeeded."""
+
+    def on_annotations(self, service: str, count: int):
+        """Called whenever a service produces some annotations."""
+
+
+# The instruments currently receiving events. This is replaced (rather than modified) whenever it changes, so that it
+# can be read without a lock.
+_instruments = ()
+_instruments_lock = threading.Lock()
+
+
+def add_instrument(instrument: Instrument):
+    """Start sending events from every service to an instrument."""
+    global _instruments
+    with _instruments_lock:
+        _instruments = (*_instruments, instrument)
+
+
+def remove_instrument(instrument: Instrument):
+    """Stop sending events to an instrument added with add_instrument()."""
+    global _instruments
+    with _instruments_lock:
+        _instruments = tuple(i for i in _instruments if i is not instrument)
+
+
+@contextmanager
+def instrument(instrument: Instrument):
+    """A context manager that sends events from every service to an instrument while it is active."""
+    add_instrument(instrument)
+    try:
+        yield instrument
+    finally:
+        remove_instrument(instrument)
+
+
+# The instruments scoped to the current thread or asyncio task by scoped_instrument(), in addition to _instruments.
+_scoped_instruments = contextvars.ContextVar("scoped_instruments", default=())
+
+
+@contextmanager
+def scoped_instrument(instrument: Instrument):
+    """
+    A context manager that sends events to an instrument from the services called by the current thread or asyncio
+    task (and the thread pools started for it with `in_current_context()`) while it is active. Unlike `instrument()`,
+    overlapping scopes on different threads don't see each other's events, and an instrument that is scoped more than
+    once (or also added with `add_instrument()`) still receives each event once.
+    """
+    token = _scoped_instruments.set((*_scoped_instruments.get(), instrument))
+    try:
+        yield instrument
+    finally:
+        _scoped_instruments.reset(token)
+
+
+def in_current_context(function):
+    """
+    Wrap a function that will be called from a thread pool so that it sees the scoped instruments of the thread that
+    wrapped it. Each call runs in its own copy of that thread's context, so calls can run in several threads at once.
+    """
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(function, *args)
+
+
+def _current_instruments():
+    """Return the instruments that should receive events from the current thread, without duplicates."""
+    scoped = _scoped_instruments.get()
+    if not scoped:
+        return _instruments
+    current = list(_instruments)
+    for instrument in scoped:
+        if not any(instrument is other for other in current):
+            current.append(instrument)
+    return current
+
+
+def is_enabled() -> bool:
+    """Return True if any instruments are receiving events from the current thread."""
+    return bool(_instruments) or bool(_scoped_instruments.get())
+
+
+def emit_request(event: RequestEvent):
+    """Send a RequestEvent to every instrument."""
+    for current in _current_instruments():
+        current.on_request(event)
+
+
+def emit_annotations(service: str, count: int):
+    """Tell every instrument that a service has produced some annotations."""
+    for current in _current_instruments():
+        current.on_annotations(service, count)
+
+
+@dataclass
+class ServiceStats:
+    """The totals for the requests made to a single service."""
+
+    requests: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    network_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    annotations: int = 0
+
+
+@dataclass
+class StageStats:
+    """The totals for a single stage (e.g. reannotating with NameRes) of a pipeline."""
+
+    runs: int = 0
+    annotations: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+
+class StatsCollector(Instrument):
+    """An instrument that adds up the requests and annotations of each service, and the time taken by each stage."""
+
+    def __init__(self):
+        self.services = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def on_request(self, event: RequestEvent):
+        with self._lock:
+            stats = self.services.setdefault(event.service, ServiceStats())
+            stats.requests += 1
+            if event.error is not None:
+                stats.errors += 1
+            stats.bytes_sent += event.bytes_sent
+            stats.bytes_received += event.bytes_received
+            stats.network_seconds += event.network_seconds
+            stats.parse_seconds += event.parse_seconds
+
+    def on_annotations(self, service: str, count: int):
+        with self._lock:
+            self.services.setdefault(service, ServiceStats()).annotations += count
+
+    def record_stage(self, name: str, annotations: int, errors: int, seconds: float):
+        """Add a single run of a stage to the totals for that stage."""
+        with self._lock:
+            stats = self.stages.setdefault(name, StageStats())
+            stats.runs += 1
+            stats.annotations += annotations
+            stats.errors += errors
+            stats.seconds += seconds
+
+    def run_stage(self, name: str, function, annotated_text, *args):
+        """
+        Call a function on an AnnotatedText (e.g. a reannotation) while collecting the events of the services it
+        calls, and record how long it took as a run of a stage. Only the errors added by the function are counted,
+        not those the AnnotatedText already had from earlier stages. Stages may run at the same time on different
+        threads (or asyncio tasks), and only collect their own events.
+
+        :param name: The name of the stage.
+        :param function: The function to call, as `function(annotated_text, *args)`.
+        :param annotated_text: The AnnotatedText that the stage starts from.
+        :param args: Any other arguments to pass to the function.
+        :return: The AnnotatedText returned by the function.
+        """
+        with scoped_instrument(self):
+            start = time.perf_counter()
+            result = function(annotated_text, *args)
+            self.record_stage(
+                name,
+                len(result.annotations),
+                len(result.errors) - len(annotated_text.errors),
+                time.perf_counter() - start,
+            )
+        return result
+
+    async def arun_stage(self, name: str, function, annotated_text, *args):
+        """Like `run_stage()`, but for an async function."""
+        with scoped_instrument(self):
+            start = time.perf_counter()
+            result = await function(annotated_text, *args)
+            self.record_stage(
+                name,
+                len(result.annotations),
+                len(result.errors) - len(annotated_text.errors),
+                time.perf_counter() - start,
+            )
+        return result
+
+    def as_dict(self) -> dict:
+        """Return the totals as a JSON-serializable dictionary."""
+        with self._lock:
+            return {
+                "services": {
+                    name: asdict(stats) for name, stats in self.services.items()
+                },
+                "stages": {name: asdict(stats) for name, stats in self.stages.items()},
+            }
@@ -0,0 +1,327 @@
+"""
+Reading and writing AnnotatedTexts as JSON Lines or MessagePack.
+
+Both formats are streams of records, one for each AnnotatedText, so that very large result files can be written and
+read one AnnotatedText at a time:
+
+- `to_jsonl()`/`from_jsonl()` write and read JSON Lines files, with one JSON object per line.
+- `to_msgpack()`/`from_msgpack()` write and read a compact binary stream of MessagePack objects. This requires the
+  msgpack package: install it with `pip install renci-ner[msgpack]`.
+- `AnnotationWriter` and `AnnotationReader` write and read either format incrementally.
+
+Rather than repeating every provenance and every annotation in a `based_on` history for each annotation (as pickling
+would), each provenance is only written once per file and each ancestor annotation is only written once per record;
+annotations then refer to them by index. A record looks like this:
+
+    {
+        "text": "The brain",
+        "errors": [],
+        "provenances": [["BioMegatron", "https://...", "1.0.0"]],   # Provenances first used in this record.
+        "ancestors": [{...}, ...],                                   # Annotations found in based_on histories.
+        "histories": [[0, -1], ...],                                 # (ancestor, previous history) pairs.
+        "annotations": [{...}, ...],
+    }
+
+Annotations are written as objects with the fields of Annotation, with `provenance` as an index into the provenances
+of the file and `based_on` as an index into the histories of the record (-1 for an empty history). Empty `props` and
+`based_on` fields are left out. NormalizedAnnotations always have a `biolink_type` field (null if they don't have a
+Biolink type) and plain Annotations never do, which is how the two are told apart.
+"""
+
+import json
+import os
+from collections.abc import Iterable, Iterator
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationHistory,
+    AnnotationProvenance,
+    NormalizedAnnotation,
+    _import_optional,
+)
+
+# The formats supported by AnnotationWriter and AnnotationReader.
+FORMATS = ("jsonl", "msgpack")
+
+
+class _Encoder:
+    """Converts AnnotatedTexts into records, remembering which provenances have already been written."""
+
+    def __init__(self):
+        self.provenances = {}
+
+    def encode(self, annotated_text: AnnotatedText) -> dict:
+        self._new_provenances = []
+        # Ancestors and histories are shared by identity within a record, so we index them by id(). The record
+        # keeps them alive until we're done, so their ids can't be reused.
+        self._ancestors = []
+        self._ancestor_indexes = {}
+        self._histories = []
+        self._history_indexes = {}
+
+        annotations = [
+            self._encode_annotation(annotation)
+            for annotation in annotated_text.annotations
+        ]
+
+        record = {"text": annotated_text.text}
+        if annotated_text.errors:
+            record["errors"] = list(annotated_text.errors)
+        if self._new_provenances:
+            record["provenances"] = self._new_provenances
+        if self._ancestors:
+            record["ancestors"] = self._ancestors
+            record["histories"] = self._histories
+        record["annotations"] = annotations
+        return record
+
+    def _provenance_index(self, provenance: AnnotationProvenance) -> int:
+        index = self.provenances.get(provenance)
+        if index is None:
+            index = len(self.provenances)
+            self.provenances[provenance] = index
+            self._new_provenances.append(
+                [provenance.name, provenance.url, provenance.version]
+            )
+        return index
+
+    def _history_index(self, history: AnnotationHistory) -> int:
+        if history is None or len(history) == 0:
+            return -1
+        index = self._history_indexes.get(id(history))
+        if index is None:
+            previous = self._history_index(history.previous)
+            last = self._ancestor_index(history.last)
+            index = len(self._histories)
+            self._histories.append([last, previous])
+            self._history_indexes[id(history)] = index
+        return index
+
+    def _ancestor_index(self, annotation: Annotation) -> int:
+        index = self._ancestor_indexes.get(id(annotation))
+        if index is None:
+            encoded = self._encode_annotation(annotation)
+            index = len(self._ancestors)
+            self._ancestors.append(encoded)
+            self._ancestor_indexes[id(annotation)] = index
+        return index
+
+    def _encode_annotation(self, annotation: Annotation) -> dict:
+        encoded = {
+            "text": annotation.text,
+            "id": annotation.id,
+            "label": annotation.label,
+            "type": annotation.type,
+            "start": annotation.start,
+            "end": annotation.end,
+            "provenance": self._provenance_index(annotation.provenance),
+        }
+        if isinstance(annotation, NormalizedAnnotation):
+            encoded["biolink_type"] = annotation.biolink_type
+        if len(annotation.based_on) > 0:
+            encoded["based_on"] = self._history_index(annotation.based_on)
+        if annotation.props:
+            encoded["props"] = annotation.props
+        return encoded
+
+
+class _Decoder:
+    """Converts records back into AnnotatedTexts, remembering the provenances read so far."""
+
+    def __init__(self):
+        self.provenances = []
+
+    def decode(self, record: dict) -> AnnotatedText:
+        for name, url, version in record.get("provenances", []):
+            self.provenances.append(AnnotationProvenance.shared(name, url, version))
+
+        # Ancestors may refer to histories (and histories to ancestors) that appear earlier in the record.
+        ancestors = []
+        histories = []
+        encoded_ancestors = record.get("ancestors", [])
+        for last, previous in record.get("histories", []):
+            while len(ancestors) <= last:
+                ancestors.append(
+                    self._decode_annotation(
+                        encoded_ancestors[len(ancestors)], histories
+                    )
+                )
+            histories.append(
+                AnnotationHistory(
+                    ancestors[last], histories[previous] if previous >= 0 else None
+                )
+            )
+
+        return AnnotatedText(
+            record["text"],
+            [
+                self._decode_annotation(encoded, histories)
+                for encoded in record.get("annotations", [])
+            ],
+            list(record.get("errors", [])),
+        )
+
+    def _decode_annotation(self, encoded: dict, histories: list) -> Annotation:
+        based_on = encoded.get("based_on", -1)
+        fields = {
+            "text": encoded["text"],
+            "id": encoded["id"],
+            "label": encoded["label"],
+            "type": encoded["type"],
+            "start": encoded["start"],
+            "end": encoded["end"],
+            "provenance": self.provenances[encoded["provenance"]],
+            "based_on": histories[based_on]
+            if based_on >= 0
+            else AnnotationHistory.EMPTY,
+            "props": encoded.get("props", {}),
+        }
+        if "biolink_type" in encoded:
+            return NormalizedAnnotation(biolink_type=encoded["biolink_type"], **fields)
+        return Annotation(**fields)
+
+
+def _check_format(format: str):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}: must be one of {FORMATS}.")
+
+
+class AnnotationWriter:
+    """
+    Writes AnnotatedTexts to a JSON Lines or MessagePack file one at a time. Can be used as a context manager.
+    """
+
+    def __init__(self, file, format: str = "jsonl"):
+        """
+        :param file: A path, or a file opened for writing (in text mode for JSON Lines, binary mode for MessagePack).
+            Files that we open ourselves are closed by `close()`.
+        :param format: "jsonl" (default) or "msgpack".
+        """
+        _check_format(format)
+        self.format = format
+        self._encoder = _Encoder()
+        if format == "msgpack":
+            self._packer = _import_optional("msgpack", "msgpack").Packer()
+
+        self._owns_file = isinstance(file, (str, os.PathLike))
+        if self._owns_file:
+            # The file outlives this method, and is closed by close() (or on leaving a with block).
+            file = open(file, "w" if format == "jsonl" else "wb")  # noqa: SIM115
+        self.file = file
+
+    def write(self, annotated_text: AnnotatedText):
+        """Write a single AnnotatedText."""
+        record = self._encoder.encode(annotated_text)
+        if self.format == "jsonl":
+            self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        else:
+            self.file.write(self._packer.pack(record))
+
+    def write_all(self, annotated_texts: Iterable[AnnotatedText]):
+        """Write every AnnotatedText in an iterable."""
+        for annotated_text in annotated_texts:
+            self.write(annotated_text)
+
+    def close(self):
+        """Close the file if we opened it, or flush it otherwise."""
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AnnotationReader:
+    """
+    Reads AnnotatedTexts from a JSON Lines or MessagePack file one at a time. Iterate over the reader to get each
+    AnnotatedText in turn. Can be used as a context manager.
+    """
+
+    def __init__(self, file, format: str = "jsonl"):
+        """
+        :param file: A path, or a file opened for reading (in text mode for JSON Lines, binary mode for MessagePack).
+            Files that we open ourselves are closed by `close()`.
+        :param format: "jsonl" (default) or "msgpack".
+        """
+        _check_format(format)
+        self.format = format
+        self._decoder = _Decoder()
+        self._owns_file = isinstance(file, (str, os.PathLike))
+        if self._owns_file:
+            # The file outlives this method, and is closed by close() (or on leaving a with block).
+            file = open(file, "r" if format == "jsonl" else "rb")  # noqa: SIM115
+        self.file = file
+
+    def _records(self) -> Iterator[dict]:
+        if self.format == "jsonl":
+            for line in self.file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            msgpack = _import_optional("msgpack", "msgpack")
+            yield from msgpack.Unpacker(self.file, raw=False)
+
+    def __iter__(self) -> Iterator[AnnotatedText]:
+        for record in self._records():
+            yield self._decoder.decode(record)
+
+    def close(self):
+        """Close the file if we opened it."""
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def to_jsonl(annotated_texts: Iterable[AnnotatedText], file):
+    """
+    Write AnnotatedTexts to a JSON Lines file.
+
+    :param annotated_texts: An iterable of AnnotatedTexts, which will be written one at a time.
+    :param file: A path or a file opened for writing in text mode.
+    """
+    with AnnotationWriter(file, "jsonl") as writer:
+        writer.write_all(annotated_texts)
+
+
+def from_jsonl(file) -> Iterator[AnnotatedText]:
+    """
+    Read AnnotatedTexts from a JSON Lines file written by `to_jsonl()`, one at a time.
+
+    :param file: A path or a file opened for reading in text mode.
+    :return: An iterator of AnnotatedTexts.
+    """
+    with AnnotationReader(file, "jsonl") as reader:
+        yield from reader
+
+
+def to_msgpack(annotated_texts: Iterable[AnnotatedText], file):
+    """
+    Write AnnotatedTexts to a MessagePack file. Requires msgpack.
+
+    :param annotated_texts: An iterable of AnnotatedTexts, which will be written one at a time.
+    :param file: A path or a file opened for writing in binary mode.
+    """
+    with AnnotationWriter(file, "msgpack") as writer:
+        writer.write_all(annotated_texts)
+
+
+def from_msgpack(file) -> Iterator[AnnotatedText]:
+    """
+    Read AnnotatedTexts from a MessagePack file written by `to_msgpack()`, one at a time. Requires msgpack.
+
+    :param file: A path or a file opened for reading in binary mode.
+    :return: An iterator of AnnotatedTexts.
+    """
+    with AnnotationReader(file, "msgpack") as reader:
+        yield from reader
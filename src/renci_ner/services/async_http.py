@@ -0,0 +1,236 @@
+#
+# Shared support for the asynchronous versions of the RENCI NER services, which use httpx
+# (https://www.python-httpx.org/) rather than requests. httpx is an optional dependency: install it with
+# `pip install renci-ner[async]`.
+#
+
+import asyncio
+import logging
+import time
+
+from renci_ner import instrumentation
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import Resilience, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Configuration.
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_TIMEOUT = 120
+
+
+def _import_httpx():
+    """Import httpx, with a helpful error message if it isn't installed."""
+    try:
+        import httpx
+    except ImportError as err:
+        raise ImportError(
+            "The asynchronous RENCI NER services require httpx: install it with `pip install renci-ner[async]`."
+        ) from err
+    return httpx
+
+
+def create_async_client(
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections=None,
+    timeout=DEFAULT_TIMEOUT,
+):
+    """
+    Create an httpx.AsyncClient with a connection pool large enough to keep many requests in flight. A single client
+    can (and should) be shared between all the asynchronous services used in an application.
+
+    :param max_connections: The maximum number of concurrent connections. Default: 100.
+    :param max_keepalive_connections: The maximum number of idle connections to keep alive. Default: max_connections.
+    :param timeout: The default timeout for requests in seconds. Default: 120 seconds.
+    :return: An httpx.AsyncClient.
+    """
+    httpx = _import_httpx()
+
+    if max_keepalive_connections is None:
+        max_keepalive_connections = max_connections
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        ),
+        timeout=timeout,
+    )
+
+
+class AsyncService:
+    """
+    Common code for the asynchronous services: an httpx.AsyncClient (created on first use if one isn't provided)
+    and the OpenAPI version of the service, which is looked up on the first request unless it is pinned or cached.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        client=None,
+        timeout=DEFAULT_TIMEOUT,
+        openapi_version=None,
+        version_cache_ttl=0,
+        resilience: Resilience = None,
+        service: str = "service",
+    ):
+        """
+        Set up an asynchronous service.
+
+        :param url: The URL of the service.
+        :param client: An httpx.AsyncClient to use, which may be shared with other services. If not provided, one will
+            be created with create_async_client() on first use, and closed by aclose().
+        :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance, instead of looking it up.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk. Default: 0.
+        :param resilience: The Resilience (see renci_ner.services.resilience) that decides when to retry requests
+            to this service or fail fast. Default: Resilience().
+        :param service: The name of the service, for logging and instrumentation of the OpenAPI version lookup.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.resilience = resilience if resilience is not None else Resilience()
+        self._openapi_version = OpenAPIVersion(
+            url,
+            timeout=timeout,
+            version=openapi_version,
+            cache_ttl=version_cache_ttl,
+            service=service,
+            resilience=self.resilience,
+        )
+        self._client = client
+        self._owns_client = client is None
+
+    @property
+    def client(self):
+        """The httpx.AsyncClient used by this service."""
+        if self._client is None:
+            self._client = create_async_client(timeout=self.timeout)
+        return self._client
+
+    @property
+    def openapi_version(self):
+        """The version of this service if it is already known, or None if it hasn't been looked up yet."""
+        return self._openapi_version.known_version
+
+    async def ensure_openapi_version(self) -> str:
+        """
+        Look up the OpenAPI version of this service, if we haven't already.
+
+        :return: The OpenAPI version of this service, or "NA" if the service doesn't report one.
+        """
+        return await self._openapi_version.aget(self)
+
+    async def _send(
+        self, service: str, method: str, url: str, parse_ok: bool, **kwargs
+    ):
+        """
+        Make a single attempt at a request, reporting it to any instruments.
+
+        :param parse_ok: Whether to parse any successful response as JSON, rather than only a 200 response.
+        :return: The response and its parsed JSON (or None if it was not parsed).
+        """
+
+        def should_parse(response):
+            return response.is_success if parse_ok else response.status_code == 200
+
+        if not instrumentation.is_enabled():
+            response = await self.client.request(method, url, **kwargs)
+            return response, response.json() if should_parse(response) else None
+
+        event = instrumentation.RequestEvent(service, method, url)
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            event.network_seconds = time.perf_counter() - start
+            event.status = response.status_code
+            event.bytes_sent = len(response.request.content)
+            event.bytes_received = len(response.content)
+
+            if not should_parse(response):
+                event.error = f"HTTP {response.status_code}"
+                return response, None
+
+            start = time.perf_counter()
+            result = response.json()
+            event.parse_seconds = time.perf_counter() - start
+            return response, result
+        except Exception as err:
+            if event.network_seconds == 0.0:
+                event.network_seconds = time.perf_counter() - start
+            event.error = repr(err)
+            raise
+        finally:
+            instrumentation.emit_request(event)
+
+    async def request_json(
+        self,
+        service: str,
+        method: str,
+        url: str,
+        raise_for_status=True,
+        retries: int | None = None,
+        **kwargs,
+    ):
+        """
+        Make a request to this service and parse its JSON response, retrying transient errors as configured by
+        `self.resilience`. This is the asynchronous equivalent of renci_ner.services.http.request_json().
+
+        :param service: The name of the service, for logging and instrumentation.
+        :param method: The HTTP method, e.g. "GET" or "POST".
+        :param url: The URL to request.
+        :param raise_for_status: Whether to raise an HTTPStatusError if the response has an error status. If False,
+            the JSON response is only parsed if the status is 200.
+        :param retries: The maximum number of retries, overriding the retry policy of `self.resilience`.
+        :param kwargs: Any other arguments to pass to the client (e.g. `json`, `params` or `timeout`).
+        :return: The response and its parsed JSON (or None if it was not parsed).
+        :raises CircuitOpenError: If the circuit breaker for this service is open.
+        """
+        httpx = _import_httpx()
+        resilience = self.resilience
+
+        attempt = 0
+        while True:
+            resilience.before_attempt(service, attempt)
+            try:
+                response, result = await self._send(
+                    service, method, url, raise_for_status, **kwargs
+                )
+            except httpx.TransportError as err:
+                delay = resilience.after_attempt(attempt, retries=retries)
+                if delay is None:
+                    raise
+                problem = repr(err)
+            else:
+                delay = resilience.after_attempt(
+                    attempt,
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After")),
+                    retries,
+                )
+                if delay is None:
+                    break
+                problem = f"status code {response.status_code}"
+
+            logger.warning(
+                f"{service} request to {url} failed with {problem} (attempt {attempt + 1}), retrying in {delay:.2f}s."
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if raise_for_status:
+            response.raise_for_status()
+        return response, result
+
+    async def aclose(self):
+        """Close the httpx.AsyncClient, if it was created by this service."""
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        await self.ensure_openapi_version()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
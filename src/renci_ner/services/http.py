@@ -0,0 +1,192 @@
+#
+# Shared support for the Requests sessions used by the RENCI NER services.
+#
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from renci_ner import instrumentation
+from renci_ner.services.resilience import Resilience, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# Configuration.
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 100
+# Requests that fail are retried by each service's Resilience, so the session itself only retries once, and only
+# when it couldn't connect (i.e. before anything was sent), so that retries aren't multiplied.
+DEFAULT_MAX_RETRIES = 1
+DEFAULT_RETRY_BACKOFF = 0.1
+
+
+def create_session(
+    pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    keep_alive=True,
+    pool_connections=DEFAULT_POOL_CONNECTIONS,
+    pool_block=False,
+) -> requests.Session:
+    """
+    Create a Requests session tuned for making many concurrent requests to RENCI NER services. Every service
+    creates its own session by default, but a single session can be created with this function and passed to
+    several services to share a connection pool between them.
+
+    :param pool_maxsize: The maximum number of connections to keep open to each host. This should be at least as
+        large as the number of threads making requests. Default: 100.
+    :param max_retries: The number of times to retry a request that could not connect to the service. Other errors
+        (e.g. timeouts, interrupted responses or error statuses) are never retried by the session: the services
+        retry those (and connection errors) with their Resilience, with backoff and a retry budget, so retrying them
+        here as well would multiply the number of attempts. Default: 1.
+    :param keep_alive: Whether to keep connections open between requests. Default: True.
+    :param pool_connections: The number of hosts to keep connection pools for. Default: 10.
+    :param pool_block: Whether to wait for a connection to become available when all `pool_maxsize` connections
+        are in use (True) or to open a new connection that will be discarded afterwards (False). Default: False.
+    :return: A Requests session.
+    """
+    session = requests.Session()
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=DEFAULT_RETRY_BACKOFF,
+            # All the requests we make are lookups, so it's safe to retry POSTs as well as GETs.
+            allowed_methods=None,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    return session
+
+
+def _body_size(body) -> int:
+    """Return the size of a request body, which may be missing, a string or bytes."""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    return len(body)
+
+
+def _send(session, service: str, method: str, url: str, parse_ok: bool, **kwargs):
+    """
+    Make a single attempt at a request, reporting it to any instruments.
+
+    :param parse_ok: Whether to parse any successful response as JSON, rather than only a 200 response.
+    :return: The response and its parsed JSON (or None if it was not parsed).
+    """
+    send = session.get if method == "GET" else session.post
+
+    def should_parse(response):
+        return response.status_code < 400 if parse_ok else response.status_code == 200
+
+    if not instrumentation.is_enabled():
+        response = send(url, **kwargs)
+        return response, response.json() if should_parse(response) else None
+
+    event = instrumentation.RequestEvent(service, method, url)
+    start = time.perf_counter()
+    try:
+        response = send(url, **kwargs)
+        event.network_seconds = time.perf_counter() - start
+        event.status = response.status_code
+        request = getattr(response, "request", None)
+        event.bytes_sent = _body_size(getattr(request, "body", None))
+        event.bytes_received = len(getattr(response, "content", b"") or b"")
+
+        if not should_parse(response):
+            event.error = f"HTTP {response.status_code}"
+            return response, None
+
+        start = time.perf_counter()
+        result = response.json()
+        event.parse_seconds = time.perf_counter() - start
+        return response, result
+    except Exception as err:
+        if event.network_seconds == 0.0:
+            event.network_seconds = time.perf_counter() - start
+        event.error = repr(err)
+        raise
+    finally:
+        instrumentation.emit_request(event)
+
+
+def request_json(
+    session,
+    service: str,
+    method: str,
+    url: str,
+    raise_for_status=True,
+    resilience: Resilience = None,
+    retries: int | None = None,
+    **kwargs,
+):
+    """
+    Make a request to a service and parse its JSON response, retrying transient errors as configured by `resilience`
+    and reporting every attempt to any instruments (see renci_ner.instrumentation).
+
+    :param session: The Requests session to use.
+    :param service: The name of the service, for logging and instrumentation.
+    :param method: The HTTP method, e.g. "GET" or "POST".
+    :param url: The URL to request.
+    :param raise_for_status: Whether to raise an HTTPError if the response has an error status. If False, the JSON
+        response is only parsed if the status is 200.
+    :param resilience: The Resilience (see renci_ner.services.resilience) that decides whether to retry or fail fast.
+        Default: make a single attempt.
+    :param retries: The maximum number of retries, overriding the retry policy of `resilience`.
+    :param kwargs: Any other arguments to pass to the session (e.g. `json`, `params` or `timeout`).
+    :return: The response and its parsed JSON (or None if it was not parsed).
+    :raises CircuitOpenError: If the circuit breaker for this service is open.
+    """
+    attempt = 0
+    while True:
+        if resilience is None:
+            response, result = _send(
+                session, service, method, url, raise_for_status, **kwargs
+            )
+            break
+
+        resilience.before_attempt(service, attempt)
+        try:
+            response, result = _send(
+                session, service, method, url, raise_for_status, **kwargs
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            delay = resilience.after_attempt(attempt, retries=retries)
+            if delay is None:
+                raise
+            problem = repr(err)
+        else:
+            delay = resilience.after_attempt(
+                attempt,
+                response.status_code,
+                parse_retry_after(response.headers.get("Retry-After")),
+                retries,
+            )
+            if delay is None:
+                break
+            problem = f"status code {response.status_code}"
+
+        logger.warning(
+            f"{service} request to {url} failed with {problem} (attempt {attempt + 1}), retrying in {delay:.2f}s."
+        )
+        time.sleep(delay)
+        attempt += 1
+
+    if raise_for_status:
+        response.raise_for_status()
+    return response, result
@@ -3,20 +3,121 @@
 # Source code: https://github.com/RENCI-NER/sapbert
 # Hosted at: https://sap-qdrant.apps.renci.org/docs
 #
-import requests
 
+from renci_ner import instrumentation
+from renci_ner.cache import SingleFlight, make_key
 from renci_ner.core import (
     AnnotatedText,
+    AnnotationBatch,
     AnnotationProvenance,
     Annotator,
+    AsyncAnnotator,
     NormalizedAnnotation,
+    _map_texts,
 )
+from renci_ner.services.async_http import AsyncService
+from renci_ner.services.http import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    create_session,
+    request_json,
+)
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import Resilience
 
 # Configuration.
 RENCI_SAPBERT_URL = "https://sap-qdrant.apps.renci.org"
 DEFAULT_LIMIT = 10
 
 
+def _annotate_request(text: str, props: dict) -> dict:
+    """Return the JSON request for annotating a text with SAPBERT."""
+    return {
+        "text": text,
+        "model_name": "sapbert",
+        "count": props.get("limit", DEFAULT_LIMIT),
+    }
+
+
+def _results_to_annotations(
+    text: str, results: list, props: dict, provenance: AnnotationProvenance
+) -> list[NormalizedAnnotation]:
+    """
+    Convert the results returned by SAPBERT into NormalizedAnnotations, skipping any below the minimum score.
+
+    :param text: The text that was annotated.
+    :param results: The results returned by SAPBERT for that text.
+    :param props: The properties used to annotate this text.
+    :param provenance: The provenance of the SAPBERT service that returned these results.
+    :return: A list of NormalizedAnnotations.
+    """
+    # Find all the results that meet our criteria.
+    annotations = []
+    for result in _filter_results(results, props):
+        annotations.append(
+            # Since SAPBERT is normalized to Babel, we can treat it as a NormalizedAnnotation.
+            NormalizedAnnotation(
+                text=text,
+                id=result.get("curie", ""),
+                label=result.get("name", ""),
+                biolink_type=result.get("category", ""),
+                type=result.get("category", ""),
+                props={
+                    "score": result.get("score", 0),
+                },
+                provenance=provenance,
+                # Since we're using the whole text, let's just use that
+                # as the start/end.
+                start=0,
+                end=len(text),
+            )
+        )
+    instrumentation.emit_annotations(provenance.name, len(annotations))
+    return annotations
+
+
+def _filter_results(results: list, props: dict) -> list:
+    """Return the results returned by SAPBERT that meet the minimum score in `props`."""
+    min_score = props.get("score", 0)
+    return [result for result in results if result.get("score", 0) >= min_score]
+
+
+def _add_results_to_batch(
+    batch: AnnotationBatch,
+    document: int,
+    text: str,
+    results: list,
+    props: dict,
+    provenance: AnnotationProvenance,
+):
+    """
+    Add the SAPBERT results for a single text to an AnnotationBatch, skipping any below the minimum score, without
+    creating NormalizedAnnotation objects.
+
+    :param batch: The batch to add the annotations to.
+    :param document: The index of the text in the batch.
+    :param text: The text that was annotated.
+    :param results: The results returned by SAPBERT for that text.
+    :param props: The properties used to annotate this text.
+    :param provenance: The provenance of the SAPBERT service that returned these results.
+    """
+    results = _filter_results(results, props)
+    instrumentation.emit_annotations(provenance.name, len(results))
+    for result in results:
+        batch.add(
+            document,
+            text=text,
+            id=result.get("curie", ""),
+            label=result.get("name", ""),
+            type=result.get("category", ""),
+            start=0,
+            end=len(text),
+            provenance=provenance,
+            biolink_type=result.get("category", ""),
+            props={"score": result.get("score", 0)},
+        )
+
+
 class BabelSAPBERTAnnotator(Annotator):
     """
     Provides an Annotator interface to a SAPBERT service.
@@ -25,39 +126,76 @@ class BabelSAPBERTAnnotator(Annotator):
     @property
     def provenance(self) -> AnnotationProvenance:
         """Return an AnnotationProvenance describing annotations produced by this service."""
-        return AnnotationProvenance(
+        return AnnotationProvenance.shared(
             name="BabelSAPBERT", url=RENCI_SAPBERT_URL, version=self.openapi_version
         )
 
     def __init__(
-        self, url=RENCI_SAPBERT_URL, requests_session=requests.Session(), timeout=120
+        self,
+        url=RENCI_SAPBERT_URL,
+        requests_session=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        keep_alive=True,
+        resilience=None,
     ):
         """
         Set up a SAPBERT service.
 
         :param url: The URL of a SAPBERT service.
-        :param requests_session: A Requests session object to use instead of the default one.
+        :param requests_session: A Requests session to use, which may be shared with other services (see
+            create_session()). If not provided, a new session is created for this service.
         :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document when it is first needed.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk, so that other
+            processes don't need to look it up again. Default: 0 (don't cache on disk).
+        :param pool_maxsize: The maximum number of concurrent connections to this service, if we create the
+            session. Default: 100.
+        :param max_retries: The number of times the session retries a request that could not connect, if we create
+            the session. All other retries are made by `resilience`. Default: 1.
+        :param keep_alive: Whether to keep connections to this service open, if we create the session.
+            Default: True.
+        :param resilience: The Resilience (see renci_ner.services.resilience) that decides when to retry requests
+            to this service or fail fast. Default: Resilience().
         """
         self.url = url
         self.annotate_url = url + "/annotate/"
+        if requests_session is None:
+            requests_session = create_session(
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                keep_alive=keep_alive,
+            )
         self.requests_session = requests_session
-
-        response = self.requests_session.get(
-            self.url + "/openapi.json", timeout=timeout
-        )
-        response.raise_for_status()
-        openapi_data = response.json()
-        self.openapi_version = openapi_data.get("info", {"version": "NA"}).get(
-            "version", "NA"
+        self.resilience = resilience if resilience is not None else Resilience()
+        # Identical requests in progress in several threads at once share a single response.
+        self.in_flight = SingleFlight()
+        self._openapi_version = OpenAPIVersion(
+            url,
+            timeout=timeout,
+            version=openapi_version,
+            cache_ttl=version_cache_ttl,
+            service="BabelSAPBERT",
+            resilience=self.resilience,
         )
 
+    @property
+    def openapi_version(self) -> str:
+        """The version of this service, looked up from its OpenAPI document on first use."""
+        return self._openapi_version.get(self.requests_session)
+
     def supported_properties(self):
         """Configurable properties for SAPBERT."""
         return {
             "timeout": "The timeout in seconds for requests to SAPBERT. Default: 120 seconds.",
             "limit": "The maximum number of results to return.",
             "score": "The minimum score for this result returned by SAPBERT (higher is better).",
+            "max_workers": "The maximum number of concurrent requests to SAPBERT when annotating many texts. Default: 1 (one request at a time).",
+            "collect_errors": "Whether to record texts that could not be looked up in their `errors` rather than raising the error, when annotating many texts. Default: false.",
         }
 
     def annotate(self, text, props=None) -> AnnotatedText:
@@ -71,48 +209,191 @@ class BabelSAPBERTAnnotator(Annotator):
         if props is None:
             props = {}
 
-        session = self.requests_session
-        timeout = props.get("timeout", 120)
+        return AnnotatedText(
+            text,
+            _results_to_annotations(
+                text, self._lookup(text, props), props, self.provenance
+            ),
+        )
 
-        min_score = props.get("score", 0)
-        limit = props.get("limit", DEFAULT_LIMIT)
+    def annotate_batch(self, texts, props=None) -> list[AnnotatedText]:
+        """
+        Annotate several texts using BabelSAPBERT. Each distinct text is only looked up once.
 
-        response = session.post(
-            self.annotate_url,
-            json={
-                "text": text,
-                "model_name": "sapbert",
-                "count": limit,
-            },
-            timeout=timeout,
-        )
+        The SAPBERT service only accepts a single text per request and has no bulk endpoint, so a batch is as many
+        requests as it has distinct texts. They are sent one at a time by default, as with other annotators, so that
+        annotating a large batch doesn't flood the service; set `max_workers` to keep up to that many requests in
+        flight at once over the session's kept-alive connections.
+
+        If `collect_errors` is true, a text that could not be looked up is returned without annotations and with the
+        error recorded; otherwise the error is raised.
 
-        response.raise_for_status()
-        results = response.json()
-
-        # Find all the results that meet our criteria.
-        annotations = []
-        for result in results:
-            if result.get("score", 0) < min_score:
-                continue
-
-            annotations.append(
-                # Since SAPBERT is normalized to Babel, we can treat it as a NormalizedAnnotation.
-                NormalizedAnnotation(
-                    text=text,
-                    id=result.get("curie", ""),
-                    label=result.get("name", ""),
-                    biolink_type=result.get("category", ""),
-                    type=result.get("category", ""),
-                    props={
-                        "score": result.get("score", 0),
-                    },
-                    provenance=self.provenance,
-                    # Since we're using the whole text, let's just use that
-                    # as the start/end.
-                    start=0,
-                    end=len(text),
+        :param texts: The texts to annotate.
+        :param props: The properties to pass to SAPBERT.
+        :return: A list of AnnotatedText objects, one for each text in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = self._lookup_all(texts, props)
+
+        provenance = self.provenance
+        return [
+            AnnotatedText(text, [], [errors[text]])
+            if text in errors
+            else AnnotatedText(
+                text, _results_to_annotations(text, results[text], props, provenance)
+            )
+            for text in texts
+        ]
+
+    def annotate_columnar(self, texts, props=None) -> AnnotationBatch:
+        """
+        Annotate several texts in the same way as `annotate_batch()`, but add the results directly to an
+        AnnotationBatch.
+
+        :param texts: The texts to annotate.
+        :param props: The properties to pass to SAPBERT.
+        :return: An AnnotationBatch with one text for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = self._lookup_all(texts, props)
+
+        provenance = self.provenance
+        batch = AnnotationBatch()
+        for text in texts:
+            if text in errors:
+                batch.add_text(text, [errors[text]])
+            else:
+                _add_results_to_batch(
+                    batch, batch.add_text(text), text, results[text], props, provenance
                 )
+        return batch
+
+    def _lookup_all(self, texts: list[str], props: dict) -> tuple[dict, dict]:
+        """
+        Look up every distinct text, with up to `max_workers` requests in flight at once (default: one).
+
+        :param texts: The texts to look up.
+        :param props: The properties to pass to SAPBERT.
+        :return: A dictionary of the SAPBERT results for each text, and a dictionary of the error message for each
+            text that could not be looked up.
+        """
+        distinct = list(dict.fromkeys(texts))
+        lookups, lookup_errors = _map_texts(
+            "BabelSAPBERT",
+            self._lookup,
+            distinct,
+            props,
+        )
+
+        results = {}
+        errors = {}
+        for text, result, error in zip(distinct, lookups, lookup_errors):
+            if error is None:
+                results[text] = result
+            else:
+                errors[text] = error
+        return results, errors
+
+    def _lookup(self, text: str, props: dict) -> list:
+        """
+        Look up a single text using SAPBERT, returning all of its results. Identical requests in progress in several
+        threads at once share a single response, which every caller filters and converts into its own annotations.
+        """
+        request = _annotate_request(text, props)
+
+        def lookup():
+            _, results = request_json(
+                self.requests_session,
+                "BabelSAPBERT",
+                "POST",
+                self.annotate_url,
+                resilience=self.resilience,
+                json=request,
+                timeout=props.get("timeout", 120),
             )
+            return results
+
+        return self.in_flight.do(make_key(self.annotate_url, request), lookup)
+
+
+class AsyncBabelSAPBERTAnnotator(AsyncService, AsyncAnnotator):
+    """
+    An asynchronous version of BabelSAPBERTAnnotator, for use in asyncio applications. Requires httpx.
+    """
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this service."""
+        return AnnotationProvenance.shared(
+            name="BabelSAPBERT", url=RENCI_SAPBERT_URL, version=self.openapi_version
+        )
 
-        return AnnotatedText(text, annotations)
+    def __init__(
+        self,
+        url=RENCI_SAPBERT_URL,
+        client=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        resilience=None,
+    ):
+        """
+        Set up an asynchronous SAPBERT service.
+
+        :param url: The URL of a SAPBERT service.
+        :param client: An httpx.AsyncClient to use, which may be shared with other services.
+        :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document on the first request.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk. Default: 0.
+        :param resilience: The Resilience that decides when to retry requests to this service or fail fast.
+            Default: Resilience().
+        """
+        super().__init__(
+            url,
+            client=client,
+            timeout=timeout,
+            openapi_version=openapi_version,
+            version_cache_ttl=version_cache_ttl,
+            resilience=resilience,
+            service="BabelSAPBERT",
+        )
+        self.annotate_url = url + "/annotate/"
+
+    def supported_properties(self):
+        """Configurable properties for SAPBERT."""
+        return {
+            "timeout": "The timeout in seconds for requests to SAPBERT. Default: 120 seconds.",
+            "limit": "The maximum number of results to return.",
+            "score": "The minimum score for this result returned by SAPBERT (higher is better).",
+            "max_concurrency": "The maximum number of requests to SAPBERT in flight at once. Default: 100.",
+        }
+
+    async def annotate(self, text, props=None) -> AnnotatedText:
+        """
+        Annotate text using BabelSAPBERT.
+
+        :param text: The text to annotate.
+        :param props: The properties to pass to SAPBERT.
+        :return: An AnnotatedText object containing the annotations.
+        """
+        if props is None:
+            props = {}
+
+        await self.ensure_openapi_version()
+
+        _, results = await self.request_json(
+            "BabelSAPBERT",
+            "POST",
+            self.annotate_url,
+            json=_annotate_request(text, props),
+            timeout=props.get("timeout", self.timeout),
+        )
+
+        return AnnotatedText(
+            text, _results_to_annotations(text, results, props, self.provenance)
+        )
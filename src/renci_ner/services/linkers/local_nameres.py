@@ -0,0 +1,342 @@
+#
+# A local, offline alternative to NameRes, which looks up texts in an on-disk index of the synonyms of every Babel
+# clique rather than sending them to the NameRes service. Texts are matched exactly, after normalization (Unicode
+# normalization, case folding and collapsing whitespace), or by prefix if `autocomplete` is set.
+#
+# An index is a directory containing a sorted string table of normalized synonyms, which is memory-mapped and
+# binary-searched, so that it loads instantly and only the parts that are looked up need to be in memory:
+#
+# - `keys.dat`: the UTF-8 encoded synonyms, in sorted order, one after the other.
+# - `key_offsets.bin`: the offset of each synonym in `keys.dat` as 64-bit integers, followed by the length of the file.
+# - `postings.bin`: the cliques with each synonym, as 64-bit integers (`clique << 1 | 1` if the synonym is the
+#   preferred name of the clique, `clique << 1` otherwise), best match first.
+# - `posting_offsets.bin`: the offset of the postings of each synonym in `postings.bin`, followed by its length.
+# - `cliques.jsonl`: the CURIE, label, types, taxa, clique size and synonyms of each clique, one per line.
+# - `clique_offsets.bin`: the byte offset of each line in `cliques.jsonl`.
+# - `clique_sizes.bin`: the size of each clique, so that matches can be ranked without parsing their records.
+# - `index.json`: metadata about the index, such as its `version`.
+#
+# Use build_index() to build an index from a Babel synonym dump.
+#
+import bisect
+import heapq
+import json
+import unicodedata
+from array import array
+from collections.abc import Iterable
+from pathlib import Path
+
+from renci_ner.core import (
+    AnnotatedText,
+    AnnotationProvenance,
+    Annotator,
+)
+from renci_ner.services.linkers.nameres import _as_bool, _results_to_annotations
+from renci_ner.store import (
+    _Mapped,
+    _SortedStrings,
+    _write_integers,
+    _write_sorted_strings,
+)
+
+# Configuration.
+DEFAULT_LIMIT = 10
+# Scores for a match on the preferred name of a clique, a match on any other synonym, and a prefix match.
+PREFERRED_NAME_SCORE = 1.0
+SYNONYM_SCORE = 0.5
+AUTOCOMPLETE_FACTOR = 0.5
+
+
+def normalize(text: str) -> str:
+    """Normalize a text for lookup: Unicode NFKC normalization, case folding and collapsing whitespace."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def _biolink(type: str) -> str:
+    """Babel synonym dumps may leave out the `biolink:` prefix of types."""
+    return type if type.startswith("biolink:") else "biolink:" + type
+
+
+def build_index(path, records: Iterable[dict], version: str | None = None):
+    """
+    Build an index for LocalNameRes from a Babel synonym dump. The synonyms of every clique are held in memory
+    while the index is sorted.
+
+    :param path: The directory to write the index to, which is created if necessary.
+    :param records: An iterable of Babel synonym records (e.g. each line of a Babel synonym file, parsed as JSON),
+        with the `curie`, `preferred_name`, `names`, `types`, `taxa` and `clique_identifier_count` of each clique.
+    :param version: The version of the index (e.g. the Babel release it was built from), recorded in provenance.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    entries = []
+    clique_offsets = array("q")
+    clique_sizes = array("q")
+    with open(path / "cliques.jsonl", "wb") as cliques_file:
+        for clique, record in enumerate(records):
+            label = record.get("preferred_name", "")
+            names = list(dict.fromkeys([label, *record.get("names", [])]))
+            clique_size = record.get("clique_identifier_count", 1)
+            clique_offsets.append(cliques_file.tell())
+            clique_sizes.append(clique_size)
+            cliques_file.write(
+                json.dumps(
+                    {
+                        "curie": record["curie"],
+                        "label": label,
+                        "types": [_biolink(type) for type in record.get("types", [])]
+                        or ["biolink:NamedThing"],
+                        "taxa": record.get("taxa", []),
+                        "clique_identifier_count": clique_size,
+                        "synonyms": [name for name in names if name],
+                    }
+                ).encode()
+                + b"\n"
+            )
+
+            preferred_key = normalize(label)
+            for key in dict.fromkeys(normalize(name) for name in names):
+                if key:
+                    is_preferred = key == preferred_key
+                    # Sort each synonym's postings by preferred names first, then larger cliques first.
+                    entries.append(
+                        (key.encode(), not is_preferred, -clique_size, clique)
+                    )
+
+    entries.sort()
+    keys = []
+    postings = array("q")
+    posting_offsets = array("q")
+    for key, not_preferred, _, clique in entries:
+        if not keys or key != keys[-1]:
+            keys.append(key)
+            posting_offsets.append(len(postings))
+        postings.append(clique << 1 | (not not_preferred))
+    posting_offsets.append(len(postings))
+
+    _write_sorted_strings(path / "keys.dat", path / "key_offsets.bin", keys)
+    _write_integers(path / "postings.bin", postings)
+    _write_integers(path / "posting_offsets.bin", posting_offsets)
+    _write_integers(path / "clique_offsets.bin", clique_offsets)
+    _write_integers(path / "clique_sizes.bin", clique_sizes)
+    with open(path / "index.json", "w") as file:
+        json.dump(
+            {
+                "version": version,
+                "synonyms": len(keys),
+                "cliques": len(clique_offsets),
+            },
+            file,
+        )
+
+
+class LocalNameRes(Annotator):
+    """
+    Looks up texts in a local index of Babel synonyms, as an offline replacement for NameRes or as a fast first tier
+    in front of it. Results have the same format as NameRes results, so annotations have the same properties.
+    """
+
+    def __init__(self, path, fallback: Annotator = None):
+        """
+        Load a local synonym index.
+
+        :param path: The directory containing the index (see build_index()).
+        :param fallback: An annotator (usually NameRes) to look up texts that aren't in the index. Default: None
+            (texts that aren't in the index aren't annotated).
+        """
+        self.path = Path(path)
+        self.fallback = fallback
+        with open(self.path / "index.json") as file:
+            self.metadata = json.load(file)
+
+        self._keys_file = _Mapped(self.path / "keys.dat")
+        self._key_offsets = _Mapped(self.path / "key_offsets.bin")
+        self._postings = _Mapped(self.path / "postings.bin")
+        self._posting_offsets = _Mapped(self.path / "posting_offsets.bin")
+        self._cliques = _Mapped(self.path / "cliques.jsonl")
+        self._clique_offsets = _Mapped(self.path / "clique_offsets.bin")
+        self._clique_sizes = _Mapped(self.path / "clique_sizes.bin")
+        self._keys = _SortedStrings(self._keys_file, self._key_offsets)
+
+    def close(self):
+        """Close the files of the index."""
+        for mapped in (
+            self._keys_file,
+            self._key_offsets,
+            self._postings,
+            self._posting_offsets,
+            self._cliques,
+            self._clique_offsets,
+            self._clique_sizes,
+        ):
+            mapped.close()
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this annotator."""
+        return AnnotationProvenance.shared(
+            name="LocalNameRes",
+            url=self.path.resolve().as_uri(),
+            version=self.metadata.get("version") or "NA",
+        )
+
+    def supported_properties(self):
+        """Configurable properties, which work in the same way as for NameRes."""
+        return {
+            "autocomplete": "(true/false, default: false) Whether to also match synonyms that start with the text.",
+            "limit": f"(int, default: {DEFAULT_LIMIT}) The number of results to return.",
+            "biolink_types": "(list of biolink types, default: []) The biolink types to filter results to, combined with OR.",
+            "only_prefixes": "(list of prefixes, default: []) The prefixes to filter results to, combined with OR.",
+            "exclude_prefixes": "(list of prefixes, default: []) The prefixes to exclude from search results, combined with AND.",
+            "only_taxa": "(list of taxa, default: []) The taxa to filter results to as NCBITaxon identifiers, combined with OR.",
+        }
+
+    def annotate(self, text, props=None) -> AnnotatedText:
+        """
+        Look up a text in the index, or with the fallback annotator if it isn't in the index at all. A text that is in
+        the index but whose matches are all removed by the filters isn't annotated.
+
+        :param text: A piece of text with the label of a biomedical entity (e.g. "brain" or "ACT1").
+        :param props: A dictionary of properties, as for NameRes.
+        :return: An AnnotatedText object containing the annotations.
+        """
+        if props is None:
+            props = {}
+
+        scores = self._match(text, props)
+        if not scores and self.fallback is not None:
+            return self.fallback.annotate(text, props)
+        return AnnotatedText(
+            text,
+            _results_to_annotations(
+                text, self._results(scores, props), self.provenance
+            ),
+        )
+
+    def annotate_batch(self, texts, props=None) -> list[AnnotatedText]:
+        """
+        Look up several texts in the index, and send any that aren't in the index at all to the fallback annotator
+        together, so that NameRes can look them up with its bulk lookup endpoint.
+
+        Note that when reannotating, every annotation gets the provenance of this annotator, including those found
+        by the fallback annotator.
+
+        :param texts: A list of texts with the labels of biomedical entities.
+        :param props: A dictionary of properties, as for NameRes.
+        :return: A list of AnnotatedText objects, one for each text in the same order.
+        """
+        if props is None:
+            props = {}
+
+        provenance = self.provenance
+        annotated = {}
+        misses = []
+        for text in dict.fromkeys(texts):
+            scores = self._match(text, props)
+            if not scores and self.fallback is not None:
+                misses.append(text)
+            else:
+                annotated[text] = AnnotatedText(
+                    text,
+                    _results_to_annotations(
+                        text, self._results(scores, props), provenance
+                    ),
+                )
+
+        if misses:
+            annotated.update(zip(misses, self.fallback.annotate_batch(misses, props)))
+        return [annotated[text] for text in texts]
+
+    def lookup(self, text: str, props: dict | None = None) -> list[dict]:
+        """
+        Look up a text in the index.
+
+        :param text: The text to look up.
+        :param props: A dictionary of properties, as for NameRes.
+        :return: A list of results in the same format as NameRes results, best first.
+        """
+        if props is None:
+            props = {}
+        return self._results(self._match(text, props), props)
+
+    def _match(self, text: str, props: dict) -> dict[int, float]:
+        """
+        Find the cliques with a synonym that matches a text exactly or, with autocomplete, starts with it.
+
+        :return: The best score of each matching clique, or an empty dictionary if the text isn't in the index.
+        """
+        key = normalize(text).encode()
+        if not key:
+            return {}
+
+        # Find the range of synonyms that match the text exactly or, with autocomplete, start with it.
+        lower = bisect.bisect_left(self._keys, key)
+        upper = (
+            lower + 1 if lower < len(self._keys) and self._keys[lower] == key else lower
+        )
+        if _as_bool(props.get("autocomplete", False)):
+            # No UTF-8 encoded text contains the byte 0xff, so this sorts after every key starting with the text.
+            upper = bisect.bisect_left(self._keys, key + b"\xff", lo=upper)
+
+        # Score every clique found, keeping its best score.
+        scores = {}
+        postings = self._postings.integers
+        offsets = self._posting_offsets.integers
+        for index in range(lower, upper):
+            factor = 1.0 if self._keys[index] == key else AUTOCOMPLETE_FACTOR
+            for posting in postings[offsets[index] : offsets[index + 1]]:
+                score = factor * (
+                    PREFERRED_NAME_SCORE if posting & 1 else SYNONYM_SCORE
+                )
+                clique = posting >> 1
+                if score > scores.get(clique, 0):
+                    scores[clique] = score
+        return scores
+
+    def _results(self, scores: dict[int, float], props: dict) -> list[dict]:
+        """
+        Filter and rank the cliques found by _match(). Cliques are ranked by score and then by clique size (larger
+        cliques are usually more useful, as in NameRes) without parsing their records, and records are only parsed
+        in that order until `limit` of them have passed the filters.
+
+        :return: A list of results in the same format as NameRes results, best first.
+        """
+        limit = props.get("limit", DEFAULT_LIMIT)
+        biolink_types = set(props.get("biolink_types", []))
+        only_prefixes = tuple(prefix + ":" for prefix in props.get("only_prefixes", []))
+        exclude_prefixes = tuple(
+            prefix + ":" for prefix in props.get("exclude_prefixes", [])
+        )
+        only_taxa = set(props.get("only_taxa", []))
+
+        # Ties are broken by the order of the cliques in the synonym dump.
+        sizes = self._clique_sizes.integers
+        ranked = [(-score, -sizes[clique], clique) for clique, score in scores.items()]
+        if not (biolink_types or only_prefixes or exclude_prefixes or only_taxa):
+            # Without filters, every clique we parse is returned.
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            heapq.heapify(ranked)
+
+        results = []
+        while ranked and len(results) < limit:
+            negative_score, _, clique = heapq.heappop(ranked)
+            result = self._clique(clique)
+            curie = result["curie"]
+            if biolink_types and biolink_types.isdisjoint(result["types"]):
+                continue
+            if only_prefixes and not curie.startswith(only_prefixes):
+                continue
+            if exclude_prefixes and curie.startswith(exclude_prefixes):
+                continue
+            if only_taxa and only_taxa.isdisjoint(result["taxa"]):
+                continue
+            result["score"] = -negative_score
+            result["highlighting"] = {}
+            results.append(result)
+        return results
+
+    def _clique(self, clique: int) -> dict:
+        """Return the record for a clique."""
+        return json.loads(self._cliques.line(self._clique_offsets.integers[clique]))
@@ -0,0 +1,286 @@
+#
+# A local, in-process alternative to BabelSAPBERTAnnotator, which links texts to Babel cliques by comparing SAPBERT
+# embeddings against an exported embedding index on disk, without needing the SAPBERT service.
+#
+# An index is a directory containing:
+#
+# - `embeddings.npy`: a float32 NumPy matrix with one L2-normalized row for each clique, which is memory-mapped so that
+#   only the parts being searched need to be in memory.
+# - `cliques.jsonl`: one JSON object for each row of the matrix, with the `curie`, `label` and `category` (Biolink
+#   type) of the clique. This is memory-mapped as well, and only the rows in the results are ever parsed.
+# - `clique_offsets.bin`: the byte offset of each line in `cliques.jsonl` as 64-bit integers.
+# - `index.json`: metadata about the index, such as the `model` used to compute the embeddings and its `version`.
+#
+# Use write_index() to export an index. Texts are embedded by an Encoder, which must use the same model as the index.
+# This requires NumPy: install it with `pip install renci-ner[numpy]`.
+#
+import json
+from array import array
+from pathlib import Path
+from typing import Protocol
+
+from renci_ner.core import (
+    AnnotatedText,
+    AnnotationProvenance,
+    Annotator,
+    _import_optional,
+)
+from renci_ner.services.linkers.babelsapbert import (
+    DEFAULT_LIMIT,
+    _results_to_annotations,
+)
+from renci_ner.store import _Mapped, _write_integers
+
+# Configuration.
+EMBEDDINGS_FILE = "embeddings.npy"
+CLIQUES_FILE = "cliques.jsonl"
+CLIQUE_OFFSETS_FILE = "clique_offsets.bin"
+METADATA_FILE = "index.json"
+# The number of rows of the embedding matrix to compare against at once, which bounds the memory used by a search.
+DEFAULT_SEARCH_CHUNK_SIZE = 65536
+
+
+class Encoder(Protocol):
+    """
+    A model that embeds texts as vectors, e.g. a SAPBERT model loaded with the transformers or sentence-transformers
+    packages. Any object with an `encode()` method will do: it doesn't need to subclass Encoder.
+    """
+
+    def encode(self, texts: list[str]):
+        """
+        Embed some texts.
+
+        :param texts: The texts to embed.
+        :return: A NumPy matrix with one row for each text, with the same number of columns as the index.
+        """
+        ...
+
+
+def _normalize_rows(np, matrix):
+    """Return a float32 copy of a matrix with every row scaled to unit length, so that dot products are cosines."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def write_index(
+    path, embeddings, cliques, model: str | None = None, version: str | None = None
+):
+    """
+    Export an embedding index for LocalSAPBERTAnnotator.
+
+    :param path: The directory to write the index to, which is created if necessary.
+    :param embeddings: A matrix with one embedding for each clique, which will be L2-normalized.
+    :param cliques: An iterable of dictionaries with the `curie`, `label` and `category` of each clique, in the same
+        order as the rows of `embeddings`.
+    :param model: The name of the model used to compute the embeddings.
+    :param version: The version of the index (e.g. the Babel release it was built from), recorded in provenance.
+    """
+    np = _import_optional("numpy", "numpy")
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    embeddings = _normalize_rows(np, embeddings)
+    clique_offsets = array("q")
+    with open(path / CLIQUES_FILE, "wb") as f:
+        for clique in cliques:
+            clique_offsets.append(f.tell())
+            f.write(
+                json.dumps(
+                    {
+                        "curie": clique["curie"],
+                        "label": clique.get("label", ""),
+                        "category": clique.get("category") or "biolink:NamedThing",
+                    }
+                ).encode()
+                + b"\n"
+            )
+    count = len(clique_offsets)
+    if count != len(embeddings):
+        raise ValueError(
+            f"Found {count} cliques but {len(embeddings)} embeddings: these must be the same."
+        )
+
+    _write_integers(path / CLIQUE_OFFSETS_FILE, clique_offsets)
+    np.save(path / EMBEDDINGS_FILE, embeddings)
+    with open(path / METADATA_FILE, "w") as f:
+        json.dump(
+            {
+                "model": model,
+                "version": version,
+                "count": count,
+                "dimensions": int(embeddings.shape[1]),
+            },
+            f,
+        )
+
+
+class LocalSAPBERTAnnotator(Annotator):
+    """
+    Links texts to Babel cliques using a local embedding index, as a drop-in replacement for BabelSAPBERTAnnotator.
+    Scores are cosine similarities between the embedding of the text and the embedding of each clique. Requires
+    NumPy.
+    """
+
+    def __init__(
+        self,
+        path,
+        encoder: Encoder,
+        approximate_index=None,
+        search_chunk_size: int = DEFAULT_SEARCH_CHUNK_SIZE,
+    ):
+        """
+        Load a local embedding index.
+
+        :param path: The directory containing the index (see write_index()).
+        :param encoder: The Encoder to embed texts with, which must use the same model as the index.
+        :param approximate_index: An approximate nearest-neighbor index over the same (normalized) embeddings to
+            search instead of comparing against every row, e.g. a faiss.IndexHNSWFlat with the inner product metric.
+            This can be anything with a faiss-style `search(queries, k)` method that returns a matrix of scores and a
+            matrix of row numbers (-1 for missing results). Default: None (exact search).
+        :param search_chunk_size: The number of rows to compare against at once in an exact search. Default: 65536.
+        """
+        self.np = _import_optional("numpy", "numpy")
+        self.path = Path(path)
+        self.encoder = encoder
+        self.approximate_index = approximate_index
+        self.search_chunk_size = search_chunk_size
+
+        with open(self.path / METADATA_FILE) as f:
+            self.metadata = json.load(f)
+        self.embeddings = self.np.load(self.path / EMBEDDINGS_FILE, mmap_mode="r")
+
+        self._cliques = _Mapped(self.path / CLIQUES_FILE)
+        self._clique_offsets = _Mapped(self.path / CLIQUE_OFFSETS_FILE)
+        if len(self._clique_offsets.integers) != len(self.embeddings):
+            raise ValueError(
+                f"{self.path} has {len(self._clique_offsets.integers)} cliques but {len(self.embeddings)} embeddings."
+            )
+
+    def close(self):
+        """Close the memory-mapped cliques of the index."""
+        self._cliques.close()
+        self._clique_offsets.close()
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this annotator."""
+        return AnnotationProvenance.shared(
+            name="LocalSAPBERT",
+            url=self.path.resolve().as_uri(),
+            version=self.metadata.get("version") or "NA",
+        )
+
+    def supported_properties(self):
+        """Configurable properties, which work in the same way as for BabelSAPBERTAnnotator."""
+        return {
+            "limit": f"The maximum number of results to return. Default: {DEFAULT_LIMIT}.",
+            "score": "The minimum cosine similarity for a result (higher is better). Default: 0.",
+        }
+
+    def annotate(self, text, props=None) -> AnnotatedText:
+        """
+        Link a text to the most similar Babel cliques.
+
+        :param text: The text to annotate.
+        :param props: The properties to use (see supported_properties()).
+        :return: An AnnotatedText object containing the annotations.
+        """
+        return self.annotate_batch([text], props)[0]
+
+    def annotate_batch(self, texts, props=None) -> list[AnnotatedText]:
+        """
+        Link several texts to their most similar Babel cliques, embedding and searching for every distinct text
+        at once.
+
+        :param texts: The texts to annotate.
+        :param props: The properties to use (see supported_properties()).
+        :return: A list of AnnotatedText objects, one for each text in the same order.
+        """
+        if props is None:
+            props = {}
+
+        distinct = list(dict.fromkeys(texts))
+        results = dict(
+            zip(distinct, self.search(distinct, props.get("limit", DEFAULT_LIMIT)))
+        )
+
+        provenance = self.provenance
+        return [
+            AnnotatedText(
+                text, _results_to_annotations(text, results[text], props, provenance)
+            )
+            for text in texts
+        ]
+
+    def search(self, texts: list[str], limit: int = DEFAULT_LIMIT) -> list[list[dict]]:
+        """
+        Find the most similar cliques to each text.
+
+        :param texts: The texts to search for.
+        :param limit: The number of cliques to return for each text.
+        :return: For each text, a list of results in the same format as the SAPBERT service (with the `curie`,
+            `name`, `category` and `score` of each clique), most similar first.
+        """
+        np = self.np
+        if not texts or limit <= 0 or len(self.embeddings) == 0:
+            return [[] for _ in texts]
+
+        queries = _normalize_rows(np, self.encoder.encode(texts))
+        if self.approximate_index is not None:
+            scores, rows = self.approximate_index.search(queries, limit)
+        else:
+            scores, rows = self._exact_search(queries, limit)
+
+        return [
+            [
+                {**self._clique(row), "score": float(score)}
+                for score, row in zip(text_scores, text_rows)
+                if row >= 0
+            ]
+            for text_scores, text_rows in zip(scores, rows)
+        ]
+
+    def _exact_search(self, queries, limit: int):
+        """
+        Compare the queries against every row of the embedding matrix, a chunk at a time, keeping the best `limit`
+        rows for each query.
+
+        :return: A matrix of scores and a matrix of row numbers, with one row for each query, best first.
+        """
+        np = self.np
+        limit = min(limit, len(self.embeddings))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, len(self.embeddings), self.search_chunk_size):
+            chunk = self.embeddings[start : start + self.search_chunk_size]
+            scores = queries @ chunk.T
+            rows = np.broadcast_to(
+                np.arange(start, start + len(chunk), dtype=np.int64), scores.shape
+            )
+
+            # Keep the best `limit` of the rows kept so far and the rows in this chunk.
+            scores = np.concatenate((best_scores, scores), axis=1)
+            rows = np.concatenate((best_rows, rows), axis=1)
+            if scores.shape[1] > limit:
+                keep = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return (
+            np.take_along_axis(best_scores, order, axis=1),
+            np.take_along_axis(best_rows, order, axis=1),
+        )
+
+    def _clique(self, row: int) -> dict:
+        """Return the CURIE, name and category of the clique in a row, in the same format as the SAPBERT service."""
+        clique = json.loads(self._cliques.line(self._clique_offsets.integers[row]))
+        return {
+            "curie": clique["curie"],
+            "name": clique.get("label", ""),
+            "category": clique.get("category", ""),
+        }
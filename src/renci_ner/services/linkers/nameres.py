@@ -3,17 +3,179 @@
 # Source code: https://github.com/TranslatorSRI/NameResolution
 # Hosted at: https://name-resolution-sri.renci.org/docs
 #
-import requests
+import asyncio
+import copy
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
+from renci_ner import instrumentation
+from renci_ner.cache import MISSING, SingleFlight, make_key
 from renci_ner.core import (
+    DEFAULT_MAX_CONCURRENCY,
     AnnotatedText,
+    AnnotationBatch,
     AnnotationProvenance,
     Annotator,
+    AsyncAnnotator,
     NormalizedAnnotation,
+    _collect_errors,
 )
+from renci_ner.services.async_http import AsyncService
+from renci_ner.services.http import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    create_session,
+    request_json,
+)
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import Resilience
+
+logger = logging.getLogger(__name__)
 
 # Configuration.
 RENCI_NAMERES_URL = "https://name-resolution-sri.renci.org"
+DEFAULT_BATCH_SIZE = 100
+
+
+def _as_bool(value) -> bool:
+    """NameRes properties may be given as booleans or as 'true'/'false' strings."""
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
+def _lookup_params(text: str, props: dict) -> dict:
+    """Return the query parameters for looking up a single text with the NameRes lookup endpoint."""
+    return {
+        "string": text,
+        "autocomplete": props.get("autocomplete", "false"),
+        "limit": props.get("limit", 10),
+        "highlighting": props.get("highlighting", "false"),
+        "biolink_type": "|".join(props.get("biolink_types", [])),
+        "only_prefixes": "|".join(props.get("only_prefixes", [])),
+        "exclude_prefixes": "|".join(props.get("exclude_prefixes", [])),
+        "only_taxa": "|".join(props.get("only_taxa", [])),
+    }
+
+
+def _bulk_lookup_request(texts: list[str], props: dict) -> dict:
+    """Return the JSON request for looking up several texts with the NameRes bulk lookup endpoint."""
+    return {
+        "strings": texts,
+        "autocomplete": _as_bool(props.get("autocomplete", False)),
+        "limit": props.get("limit", 10),
+        "highlighting": _as_bool(props.get("highlighting", False)),
+        "biolink_types": props.get("biolink_types", []),
+        "only_prefixes": "|".join(props.get("only_prefixes", [])),
+        "exclude_prefixes": "|".join(props.get("exclude_prefixes", [])),
+        "only_taxa": "|".join(props.get("only_taxa", [])),
+    }
+
+
+def _batches(texts: list[str], props: dict) -> list[list[str]]:
+    """Split a list of texts into batches of `batch_size` texts for the bulk lookup endpoint."""
+    batch_size = props.get("batch_size", DEFAULT_BATCH_SIZE)
+    return [
+        texts[index : index + batch_size] for index in range(0, len(texts), batch_size)
+    ]
+
+
+def _result_to_annotation(
+    text: str, result: dict, provenance: AnnotationProvenance
+) -> NormalizedAnnotation:
+    """
+    Convert a single NameRes lookup result into a NormalizedAnnotation.
+
+    :param text: The text that was looked up.
+    :param result: A single result returned by NameRes for that text.
+    :param provenance: The provenance of the NameRes service that returned this result.
+    :return: A NormalizedAnnotation covering the entire text.
+    """
+    return NormalizedAnnotation(
+        text=text,
+        id=result.get("curie", ""),
+        label=result.get("label", ""),
+        biolink_type=result.get("types", ["biolink:NamedThing"])[0],
+        type=result.get("types", ["biolink:NamedThing"])[0],
+        props=_result_props(result),
+        provenance=provenance,
+        # Since we're using the whole text, let's just use that
+        # as the start/end.
+        start=0,
+        end=len(text),
+    )
+
+
+def _results_to_annotations(
+    text: str, results: list, provenance: AnnotationProvenance
+) -> list[NormalizedAnnotation]:
+    """Convert all the NameRes lookup results for a text into NormalizedAnnotations."""
+    annotations = [
+        _result_to_annotation(text, result, provenance) for result in results
+    ]
+    instrumentation.emit_annotations(provenance.name, len(annotations))
+    return annotations
+
+
+def _result_props(result: dict) -> dict:
+    """
+    Return the properties of the annotation for a single NameRes lookup result. Results may be cached and shared
+    between callers, so the properties get their own copies of its lists and dictionaries.
+    """
+    return {
+        "score": result.get("score", 0),
+        "clique_identifier_count": result.get("clique_identifier_count", 0),
+        "synonyms": list(result.get("synonyms", [])),
+        "highlighting": copy.deepcopy(result.get("highlighting", {})),
+        "types": list(result.get("types", [])),
+        "taxa": list(result.get("taxa", [])),
+    }
+
+
+def _add_results_to_batch(
+    batch: AnnotationBatch,
+    document: int,
+    text: str,
+    results: list,
+    provenance: AnnotationProvenance,
+):
+    """
+    Add the NameRes lookup results for a single text to an AnnotationBatch, without creating NormalizedAnnotation
+    objects.
+
+    :param batch: The batch to add the annotations to.
+    :param document: The index of the text in the batch.
+    :param text: The text that was looked up.
+    :param results: The results returned by NameRes for that text.
+    :param provenance: The provenance of the NameRes service that returned these results.
+    """
+    instrumentation.emit_annotations(provenance.name, len(results))
+    for result in results:
+        biolink_type = result.get("types", ["biolink:NamedThing"])[0]
+        batch.add(
+            document,
+            text=text,
+            id=result.get("curie", ""),
+            label=result.get("label", ""),
+            type=biolink_type,
+            start=0,
+            end=len(text),
+            provenance=provenance,
+            biolink_type=biolink_type,
+            props=_result_props(result),
+        )
+
+
+def _bulk_results_to_annotated_texts(
+    texts: list[str], results: dict, provenance: AnnotationProvenance
+) -> list[AnnotatedText]:
+    """Convert the response from the NameRes bulk lookup endpoint into one AnnotatedText for each text."""
+    return [
+        AnnotatedText(
+            text, _results_to_annotations(text, results.get(text, []), provenance)
+        )
+        for text in texts
+    ]
 
 
 class NameRes(Annotator):
@@ -24,31 +186,73 @@ class NameRes(Annotator):
     @property
     def provenance(self) -> AnnotationProvenance:
         """Return an AnnotationProvenance describing annotations produced by this service."""
-        return AnnotationProvenance(
+        return AnnotationProvenance.shared(
             name="NameRes", url=RENCI_NAMERES_URL, version=self.openapi_version
         )
 
     def __init__(
-        self, url=RENCI_NAMERES_URL, requests_session=requests.Session(), timeout=120
+        self,
+        url=RENCI_NAMERES_URL,
+        requests_session=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        keep_alive=True,
+        cache=None,
+        resilience=None,
     ):
         """
         Set up a NameRes service.
 
         :param url: The URL of the NameRes service.
-        :param requests_session: A Requests session object to use instead of the default one.
+        :param requests_session: A Requests session to use, which may be shared with other services (see
+            create_session()). If not provided, a new session is created for this service.
         :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document when it is first needed.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk, so that other
+            processes don't need to look it up again. Default: 0 (don't cache on disk).
+        :param pool_maxsize: The maximum number of concurrent connections to this service, if we create the
+            session. Default: 100.
+        :param max_retries: The number of times the session retries a request that could not connect, if we create
+            the session. All other retries are made by `resilience`. Default: 1.
+        :param keep_alive: Whether to keep connections to this service open, if we create the session.
+            Default: True.
+        :param cache: A cache (see renci_ner.cache) to store lookup results in, so that each text only needs to
+            be looked up once for each combination of properties. Default: None (don't cache).
+        :param resilience: The Resilience (see renci_ner.services.resilience) that decides when to retry requests
+            to this service or fail fast. Default: Resilience().
         """
         self.url = url
+        self.cache = cache
+        # Lookups of the same text that are in progress in several threads at once share a single request.
+        self.in_flight = SingleFlight()
         self.lookup_url = url + "/lookup"
+        self.bulk_lookup_url = url + "/bulk-lookup"
+        if requests_session is None:
+            requests_session = create_session(
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                keep_alive=keep_alive,
+            )
         self.requests_session = requests_session
-
-        response = self.requests_session.get(self.url + "/openapi.json", timeout=120)
-        response.raise_for_status()
-        openapi_data = response.json()
-        self.openapi_version = openapi_data.get("info", {"version": "NA"}).get(
-            "version", "NA"
+        self.resilience = resilience if resilience is not None else Resilience()
+        self._openapi_version = OpenAPIVersion(
+            url,
+            timeout=timeout,
+            version=openapi_version,
+            cache_ttl=version_cache_ttl,
+            service="NameRes",
+            resilience=self.resilience,
         )
 
+    @property
+    def openapi_version(self) -> str:
+        """The version of this service, looked up from its OpenAPI document on first use."""
+        return self._openapi_version.get(self.requests_session)
+
     def supported_properties(self):
         """Configurable properties for NameRes."""
         return {
@@ -60,6 +264,9 @@ class NameRes(Annotator):
             "only_prefixes": "(list of prefixes, default: []) The prefixes to filter results to, combined with OR.",
             "exclude_prefixes": "(list of prefixes, default: []) The prefixes to exclude from search results, combined with AND.",
             "only_taxa": "(list of taxa, default: []) The taxa to filter results to as NCBITaxon identifiers, combined with OR.",
+            "batch_size": f"(int, default: {DEFAULT_BATCH_SIZE}) The number of texts to send in each bulk lookup request.",
+            "max_workers": "(int, default: 1) The maximum number of concurrent requests to NameRes when annotating many texts.",
+            "collect_errors": "(true/false, default: false) Whether to record texts that could not be looked up in their `errors` rather than raising the error, when annotating many texts.",
         }
 
     def annotate(self, text, props=None) -> AnnotatedText:
@@ -73,49 +280,322 @@ class NameRes(Annotator):
         if props is None:
             props = {}
 
-        session = self.requests_session
-        timeout = props.get("timeout", 120)
+        key = self._cache_key(text, props)
+        results = MISSING
+        if self.cache is not None:
+            results = self.cache.get(key)
+
+        if results is MISSING:
+            # Every caller converts the shared results into its own annotations, so they can't affect each other.
+            results = self.in_flight.do(key, lambda: self._lookup(text, props, key))
+
+        provenance = self.provenance
+        annotations = _results_to_annotations(text, results, provenance)
+
+        return AnnotatedText(text, annotations)
 
-        response = session.get(
+    def _lookup(self, text: str, props: dict, key: str) -> list:
+        """Look up a single text using the NameRes lookup endpoint, and cache the results if we have a cache."""
+        _, results = request_json(
+            self.requests_session,
+            "NameRes",
+            "GET",
             self.lookup_url,
-            params={
-                "string": text,
-                "autocomplete": props.get("autocomplete", "false"),
-                "limit": props.get("limit", 10),
-                "highlighting": props.get("highlighting", "false"),
-                "biolink_type": "|".join(props.get("biolink_types", [])),
-                "only_prefixes": "|".join(props.get("only_prefixes", [])),
-                "exclude_prefixes": "|".join(props.get("exclude_prefixes", [])),
-                "only_taxa": "|".join(props.get("only_taxa", [])),
-            },
-            timeout=timeout,
+            resilience=self.resilience,
+            params=_lookup_params(text, props),
+            timeout=props.get("timeout", 120),
         )
 
-        response.raise_for_status()
-        results = response.json()
-
-        annotations = [
-            NormalizedAnnotation(
-                text=text,
-                id=result.get("curie", ""),
-                label=result.get("label", ""),
-                biolink_type=result.get("types", ["biolink:NamedThing"])[0],
-                type=result.get("types", ["biolink:NamedThing"])[0],
-                props={
-                    "score": result.get("score", 0),
-                    "clique_identifier_count": result.get("clique_identifier_count", 0),
-                    "synonyms": result.get("synonyms", []),
-                    "highlighting": result.get("highlighting", {}),
-                    "types": result.get("types", []),
-                    "taxa": result.get("taxa", []),
-                },
-                provenance=self.provenance,
-                # Since we're using the whole text, let's just use that
-                # as the start/end.
-                start=0,
-                end=len(text),
+        if self.cache is not None:
+            self.cache.set(key, results)
+        return results
+
+    def _cache_key(self, text: str, props: dict) -> str:
+        """
+        Return the cache key for looking up a text: this includes the properties that affect the results and the
+        version of NameRes, so that results are looked up again when NameRes is updated.
+        """
+        request = _bulk_lookup_request([], props)
+        del request["strings"]
+        return make_key("NameRes", self.url, self.openapi_version, text, request)
+
+    def _bulk_lookup(self, texts: list[str], props: dict) -> dict[str, list]:
+        """
+        Look up a single batch of texts using the NameRes bulk lookup endpoint, and cache the results if we have
+        a cache.
+
+        :param texts: The texts to look up in a single request.
+        :param props: A dictionary of properties to configure NameRes.
+        :return: A dictionary of the NameRes results for each text.
+        """
+        _, response_json = request_json(
+            self.requests_session,
+            "NameRes",
+            "POST",
+            self.bulk_lookup_url,
+            resilience=self.resilience,
+            json=_bulk_lookup_request(texts, props),
+            timeout=props.get("timeout", 120),
+        )
+
+        results = {text: response_json.get(text, []) for text in texts}
+        if self.cache is not None:
+            for text, text_results in results.items():
+                self.cache.set(self._cache_key(text, props), text_results)
+        return results
+
+    def annotate_batch(self, texts, props=None) -> list[AnnotatedText]:
+        """
+        Annotate several pieces of text using the NameRes bulk lookup endpoint, sending `batch_size` texts
+        per request. If `max_workers` is greater than one, up to that many requests will be made concurrently. If
+        `collect_errors` is true, the texts in a request that fails will be returned without annotations and with the
+        error recorded; otherwise the error is raised. If we have a cache, only texts that aren't in the cache will be
+        looked up, and texts that another thread is already looking up share its results.
+
+        :param texts: A list of texts with the labels of biomedical entities.
+        :param props: A dictionary of properties to configure NameRes.
+        :return: A list of AnnotatedText objects, one for each text in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = self._lookup_all(texts, props)
+
+        provenance = self.provenance
+        return [
+            AnnotatedText(text, [], [errors[text]])
+            if text in errors
+            else AnnotatedText(
+                text, _results_to_annotations(text, results[text], provenance)
             )
-            for result in results
+            for text in texts
         ]
 
+    def annotate_columnar(self, texts, props=None) -> AnnotationBatch:
+        """
+        Annotate several pieces of text in the same way as `annotate_batch()`, but add the results directly to an
+        AnnotationBatch.
+
+        :param texts: A list of texts with the labels of biomedical entities.
+        :param props: A dictionary of properties to configure NameRes.
+        :return: An AnnotationBatch with one text for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = self._lookup_all(texts, props)
+
+        provenance = self.provenance
+        batch = AnnotationBatch()
+        for text in texts:
+            if text in errors:
+                batch.add_text(text, [errors[text]])
+            else:
+                _add_results_to_batch(
+                    batch, batch.add_text(text), text, results[text], provenance
+                )
+        return batch
+
+    def _lookup_all(self, texts: list[str], props: dict) -> tuple[dict, dict]:
+        """
+        Look up every text, using the cache where possible and the bulk lookup endpoint for everything else. Texts
+        that another thread is already looking up (with `annotate()` or a bulk lookup) aren't looked up again: we
+        look up the rest, and then wait for the other threads to finish and share their results.
+
+        :param texts: The texts to look up.
+        :param props: A dictionary of properties to configure NameRes.
+        :return: A dictionary of the NameRes results for each text, and a dictionary of the error message for each
+            text that could not be looked up.
+        """
+        keys = {text: self._cache_key(text, props) for text in texts}
+        results = {}
+        if self.cache is not None:
+            for text, key in keys.items():
+                cached = self.cache.get(key)
+                if cached is not MISSING:
+                    results[text] = cached
+
+        claimed, waiting = self.in_flight.claim(
+            key for text, key in keys.items() if text not in results
+        )
+        claimed = set(claimed)
+        unfinished = [text for text in keys if keys[text] in claimed]
+
+        max_workers = props.get("max_workers", 1)
+        batches = _batches(unfinished, props)
+
+        collect_errors = _collect_errors(props)
+        errors = {}
+
+        def bulk_lookup(batch):
+            try:
+                batch_results = self._bulk_lookup(batch, props)
+            except Exception as err:
+                for text in batch:
+                    self.in_flight.finish(keys[text], error=err)
+                    claimed.discard(keys[text])
+                if not collect_errors:
+                    raise
+                message = f"NameRes could not look up {len(batch)} texts: {err}"
+                logger.error(message)
+                errors.update((text, message) for text in batch)
+                return {}
+
+            for text in batch:
+                self.in_flight.finish(keys[text], batch_results[text])
+                claimed.discard(keys[text])
+            return batch_results
+
+        try:
+            if max_workers <= 1 or len(batches) <= 1:
+                for batch in batches:
+                    results.update(bulk_lookup(batch))
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for batch_results in executor.map(
+                        instrumentation.in_current_context(bulk_lookup), batches
+                    ):
+                        results.update(batch_results)
+        except BaseException as err:
+            # Don't leave other threads waiting for the batches we didn't get to.
+            for key in claimed:
+                self.in_flight.finish(key, error=err)
+            raise
+
+        for text, key in keys.items():
+            if key not in waiting:
+                continue
+            try:
+                results[text] = waiting[key].wait()
+            except Exception as err:
+                if not collect_errors:
+                    raise
+                message = f"NameRes could not look up {text!r}: {err}"
+                logger.error(message)
+                errors[text] = message
+
+        return results, errors
+
+
+class AsyncNameRes(AsyncService, AsyncAnnotator):
+    """
+    An asynchronous version of NameRes, for use in asyncio applications. Requires httpx.
+    """
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this service."""
+        return AnnotationProvenance.shared(
+            name="NameRes", url=RENCI_NAMERES_URL, version=self.openapi_version
+        )
+
+    def __init__(
+        self,
+        url=RENCI_NAMERES_URL,
+        client=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        resilience=None,
+    ):
+        """
+        Set up an asynchronous NameRes service.
+
+        :param url: The URL of the NameRes service.
+        :param client: An httpx.AsyncClient to use, which may be shared with other services.
+        :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document on the first request.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk. Default: 0.
+        :param resilience: The Resilience that decides when to retry requests to this service or fail fast.
+            Default: Resilience().
+        """
+        super().__init__(
+            url,
+            client=client,
+            timeout=timeout,
+            openapi_version=openapi_version,
+            version_cache_ttl=version_cache_ttl,
+            resilience=resilience,
+            service="NameRes",
+        )
+        self.lookup_url = url + "/lookup"
+        self.bulk_lookup_url = url + "/bulk-lookup"
+
+    def supported_properties(self):
+        """Configurable properties for NameRes."""
+        return {
+            **NameRes.supported_properties(self),
+            "max_concurrency": "(int, default: 100) The maximum number of requests to NameRes in flight at once.",
+        }
+
+    async def annotate(self, text, props=None) -> AnnotatedText:
+        """
+        Annotate a piece of text using NameRes.
+
+        :param text: A piece of text with the label of a biomedical entity (e.g. "brain" or "ACT1").
+        :param props: A dictionary of properties to configure NameRes.
+        :return: An AnnotatedText object containing the annotations.
+        """
+        if props is None:
+            props = {}
+
+        await self.ensure_openapi_version()
+
+        _, results = await self.request_json(
+            "NameRes",
+            "GET",
+            self.lookup_url,
+            params=_lookup_params(text, props),
+            timeout=props.get("timeout", self.timeout),
+        )
+
+        provenance = self.provenance
+        annotations = _results_to_annotations(text, results, provenance)
+
         return AnnotatedText(text, annotations)
+
+    async def annotate_batch(self, texts, props=None) -> list[AnnotatedText]:
+        """
+        Annotate several pieces of text using the NameRes bulk lookup endpoint, sending `batch_size` texts
+        per request with up to `max_concurrency` requests in flight at once. If `collect_errors` is true, the texts in
+        a request that fails will be returned without annotations and with the error recorded; otherwise the error is
+        raised.
+
+        :param texts: A list of texts with the labels of biomedical entities.
+        :param props: A dictionary of properties to configure NameRes.
+        :return: A list of AnnotatedText objects, one for each text in the same order.
+        """
+        if props is None:
+            props = {}
+
+        await self.ensure_openapi_version()
+        collect_errors = _collect_errors(props)
+        semaphore = asyncio.Semaphore(
+            props.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        )
+
+        async def bulk_lookup(batch: list[str]) -> list[AnnotatedText]:
+            async with semaphore:
+                try:
+                    _, results = await self.request_json(
+                        "NameRes",
+                        "POST",
+                        self.bulk_lookup_url,
+                        json=_bulk_lookup_request(batch, props),
+                        timeout=props.get("timeout", self.timeout),
+                    )
+                    return _bulk_results_to_annotated_texts(
+                        batch, results, self.provenance
+                    )
+                except Exception as err:
+                    if not collect_errors:
+                        raise
+                    message = f"NameRes could not look up {len(batch)} texts: {err}"
+                    logger.error(message)
+                    return [AnnotatedText(text, [], [message]) for text in batch]
+
+        results = await asyncio.gather(
+            *(bulk_lookup(batch) for batch in _batches(texts, props))
+        )
+        return [annotated_text for batch in results for annotated_text in batch]
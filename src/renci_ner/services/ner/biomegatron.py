@@ -4,12 +4,268 @@
 # Hosted at: https://med-nemo.apps.renci.org/docs
 #
 
-import requests
+import bisect
 
-from renci_ner.core import AnnotatedText, Annotation, AnnotationProvenance, Annotator
+from renci_ner import instrumentation
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationBatch,
+    AnnotationProvenance,
+    Annotator,
+    AsyncAnnotator,
+    _map_texts,
+)
+from renci_ner.services.async_http import AsyncService
+from renci_ner.services.http import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    create_session,
+    request_json,
+)
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import Resilience
 
 # Configuration.
 RENCI_BIOMEGATRON_URL = "https://med-nemo.apps.renci.org"
+DEFAULT_CHUNK_OVERLAP = 100
+DEFAULT_PACK_SIZE = 5000
+
+# The separator placed between texts packed into a single request by annotate_many().
+PACK_SEPARATOR = "\n\n"
+
+# Places where we prefer to split long texts into chunks, from most to least preferred.
+CHUNK_BOUNDARIES = ("\n\n", "\n", ". ", "? ", "! ", "; ", " ")
+
+
+def _annotate_request(text: str) -> dict:
+    """Return the JSON request for annotating a text with BioMegatron."""
+    return {
+        "text": text,
+        "model_name": "token_classification",
+    }
+
+
+def _chunk_spans(text: str, chunk_size: int, overlap: int) -> list[tuple[int, int]]:
+    """
+    Split a text into chunks of at most `chunk_size` characters, preferably at paragraph or sentence boundaries, with
+    each chunk overlapping the previous one by about `overlap` characters.
+
+    :param text: The text to split.
+    :param chunk_size: The maximum number of characters in each chunk.
+    :param overlap: The number of characters each chunk should share with the previous chunk. Must be less than half
+        of `chunk_size`, so that each chunk starts well after the previous one.
+    :return: A list of (start, end) offsets of each chunk in the text.
+    """
+    if not 0 <= overlap < chunk_size // 2:
+        raise ValueError(
+            f"Invalid chunk_overlap: must be at least 0 and less than half of chunk_size ({chunk_size}) but got {overlap}."
+        )
+    if len(text) <= chunk_size:
+        return [(0, len(text))]
+
+    spans = []
+    start = 0
+    while True:
+        end = start + chunk_size
+        if end >= len(text):
+            spans.append((start, len(text)))
+            return spans
+
+        # Split at the last boundary in the second half of the chunk, or at the end of the chunk if there isn't one.
+        for boundary in CHUNK_BOUNDARIES:
+            split = text.rfind(boundary, start + chunk_size // 2, end)
+            if split >= 0:
+                end = split + len(boundary)
+                break
+        spans.append((start, end))
+
+        # Start the next chunk at the beginning of a word about `overlap` characters before the end of this chunk,
+        # but always move forward.
+        next_start = max(end - overlap, start + 1)
+        space = text.find(" ", next_start, end)
+        start = space + 1 if 0 <= space < end - 1 else next_start
+
+
+def _merge_chunk_results(
+    text: str, spans: list[tuple[int, int]], results: list[dict]
+) -> dict:
+    """
+    Merge the BioMegatron results for each chunk of a text into a single result for the whole text: denotation
+    offsets are moved back to the original text, and denotations found in more than one chunk are only included once.
+    A denotation that ends at the end of a chunk (or starts at its start) might have been cut off, so we drop it if
+    the neighbouring chunk on that side was annotated and covers the whole denotation, since that chunk will have
+    found it too. Chunks that don't overlap don't cover each other's edges, so nothing is dropped between them.
+
+    :param text: The original text.
+    :param spans: The (start, end) offsets of each chunk.
+    :param results: The BioMegatron result for each chunk, or None if that chunk could not be annotated.
+    :return: A BioMegatron result for the whole text.
+    """
+    denotations = []
+    seen = set()
+    for index, ((chunk_start, chunk_end), result) in enumerate(zip(spans, results)):
+        if result is None:
+            continue
+        # The end of the previous chunk and the start of the next one, if they were annotated.
+        previous_end = (
+            spans[index - 1][1]
+            if index > 0 and results[index - 1] is not None
+            else None
+        )
+        next_start = (
+            spans[index + 1][0]
+            if index + 1 < len(spans) and results[index + 1] is not None
+            else None
+        )
+        for denotation in result.get("denotations", []):
+            span = denotation.get("span", {})
+            begin = span.get("begin", -1) + chunk_start
+            end = span.get("end", -1) + chunk_start
+            # A denotation at the edge of both chunks is kept in the later one, where it doesn't end at the edge.
+            if (
+                next_start is not None and end >= chunk_end and next_start <= begin
+            ) or (
+                previous_end is not None and begin <= chunk_start and previous_end > end
+            ):
+                continue
+
+            key = (begin, end, denotation.get("obj"), denotation.get("id"))
+            if key in seen:
+                continue
+            seen.add(key)
+            denotations.append(
+                {**denotation, "span": {**span, "begin": begin, "end": end}}
+            )
+
+    denotations.sort(key=lambda denotation: denotation["span"]["begin"])
+    return {"text": text, "denotations": denotations}
+
+
+def _pack_texts(texts: list[str], pack_size: int) -> list[list[int]]:
+    """
+    Group texts into packs that can be joined with PACK_SEPARATOR into texts of at most `pack_size` characters.
+    Texts that are longer than `pack_size` are put into packs of their own.
+
+    :param texts: The texts to pack.
+    :param pack_size: The maximum number of characters in each packed text.
+    :return: A list of packs, each of which is a list of indexes into `texts`.
+    """
+    packs = []
+    pack = []
+    pack_length = 0
+    for index, text in enumerate(texts):
+        length = len(text) + (len(PACK_SEPARATOR) if pack else 0)
+        if pack and pack_length + length > pack_size:
+            packs.append(pack)
+            pack = []
+            pack_length = 0
+            length = len(text)
+        pack.append(index)
+        pack_length += length
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def _split_packed_result(texts: list[str], result: dict) -> list[dict]:
+    """
+    Split the BioMegatron result for several texts joined with PACK_SEPARATOR into one result for each text, with
+    denotation offsets relative to that text. Denotations that cross from one text into the next are dropped.
+
+    :param texts: The texts that were packed, in order.
+    :param result: The BioMegatron result for the packed text.
+    :return: A BioMegatron result for each text.
+    """
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text) + len(PACK_SEPARATOR)
+
+    results = [{"text": text, "denotations": []} for text in texts]
+    for denotation in result.get("denotations", []):
+        span = denotation.get("span", {})
+        begin = span.get("begin", -1)
+        end = span.get("end", -1)
+        index = bisect.bisect_right(starts, begin) - 1
+        if index < 0 or end > starts[index] + len(texts[index]):
+            continue
+
+        results[index]["denotations"].append(
+            {
+                **denotation,
+                "span": {
+                    **span,
+                    "begin": begin - starts[index],
+                    "end": end - starts[index],
+                },
+            }
+        )
+    return results
+
+
+def _denotations_to_annotations(
+    result: dict, provenance: AnnotationProvenance
+) -> list[Annotation]:
+    """
+    Convert the denotations returned by BioMegatron into Annotations.
+
+    :param result: The response from the BioMegatron annotate endpoint.
+    :param provenance: The provenance of the BioMegatron service that returned this result.
+    :return: A list of Annotations, one for each denotation.
+    """
+    annotations = []
+    for denotation in result.get("denotations", []):
+        span = denotation.get("span", {})
+        start_index = span.get("begin", -1)
+        end_index = span.get("end", -1)
+
+        annotations.append(
+            Annotation(
+                text=denotation.get("text", ""),
+                start=start_index,
+                end=end_index,
+                id=denotation.get("id", ""),
+                label="",
+                type=denotation.get("obj", ""),
+                props={},
+                provenance=provenance,
+            )
+        )
+    instrumentation.emit_annotations(provenance.name, len(annotations))
+    return annotations
+
+
+def _add_denotations_to_batch(
+    batch: AnnotationBatch,
+    document: int,
+    result: dict,
+    provenance: AnnotationProvenance,
+):
+    """
+    Add the denotations returned by BioMegatron for a single text to an AnnotationBatch, without creating Annotation
+    objects.
+
+    :param batch: The batch to add the annotations to.
+    :param document: The index of the text in the batch.
+    :param result: The response from the BioMegatron annotate endpoint.
+    :param provenance: The provenance of the BioMegatron service that returned this result.
+    """
+    denotations = result.get("denotations", [])
+    instrumentation.emit_annotations(provenance.name, len(denotations))
+    for denotation in denotations:
+        span = denotation.get("span", {})
+        batch.add(
+            document,
+            text=denotation.get("text", ""),
+            id=denotation.get("id", ""),
+            label="",
+            type=denotation.get("obj", ""),
+            start=span.get("begin", -1),
+            end=span.get("end", -1),
+            provenance=provenance,
+        )
 
 
 class BioMegatron(Annotator):
@@ -20,41 +276,78 @@ class BioMegatron(Annotator):
     @property
     def provenance(self) -> AnnotationProvenance:
         """Return an AnnotationProvenance describing annotations produced by this service."""
-        return AnnotationProvenance(
+        return AnnotationProvenance.shared(
             name="BioMegatron", url=RENCI_BIOMEGATRON_URL, version=self.openapi_version
         )
 
     def __init__(
         self,
         url=RENCI_BIOMEGATRON_URL,
-        requests_session=requests.Session(),
+        requests_session=None,
         timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        keep_alive=True,
+        resilience=None,
     ):
         """
         Set up a BioMegatron service.
 
         :param url: The URL of the BioMegatron service.
-        :param requests_session: A Requests session object to use instead of the default one.
+        :param requests_session: A Requests session to use, which may be shared with other services (see
+            create_session()). If not provided, a new session is created for this service.
         :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document when it is first needed.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk, so that other
+            processes don't need to look it up again. Default: 0 (don't cache on disk).
+        :param pool_maxsize: The maximum number of concurrent connections to this service, if we create the
+            session. Default: 100.
+        :param max_retries: The number of times the session retries a request that could not connect, if we create
+            the session. All other retries are made by `resilience`. Default: 1.
+        :param keep_alive: Whether to keep connections to this service open, if we create the session.
+            Default: True.
+        :param resilience: The Resilience (see renci_ner.services.resilience) that decides when to retry requests
+            to this service or fail fast. Default: Resilience().
         """
         self.url = url
         self.annotate_url = url + "/annotate/"
+        if requests_session is None:
+            requests_session = create_session(
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                keep_alive=keep_alive,
+            )
         self.requests_session = requests_session
-
-        result = self.requests_session.get(self.url + "/openapi.json", timeout=timeout)
-        result.raise_for_status()
-        openapi_data = result.json()
-        self.openapi_version = openapi_data.get("info", {"version": "NA"}).get(
-            "version", "NA"
+        self.resilience = resilience if resilience is not None else Resilience()
+        self._openapi_version = OpenAPIVersion(
+            url,
+            timeout=timeout,
+            version=openapi_version,
+            cache_ttl=version_cache_ttl,
+            service="BioMegatron",
+            resilience=self.resilience,
         )
 
+    @property
+    def openapi_version(self) -> str:
+        """The version of this service, looked up from its OpenAPI document on first use."""
+        return self._openapi_version.get(self.requests_session)
+
     def supported_properties(self):
-        """Some configurable parameters for BioMegatron (none at present)."""
+        """Some configurable parameters for BioMegatron."""
         return {
-            "timeout": "The timeout in seconds for requests to BioMegatron. Default: 120 seconds."
+            "timeout": "The timeout in seconds for requests to BioMegatron. Default: 120 seconds.",
+            "max_workers": "The maximum number of concurrent requests to BioMegatron when annotating many texts or chunks. Default: 1.",
+            "chunk_size": "Split texts longer than this many characters into chunks at paragraph or sentence boundaries, and annotate each chunk separately. Default: None (don't split texts).",
+            "chunk_overlap": f"The number of characters that each chunk shares with the previous chunk. Must be less than half of chunk_size. Default: {DEFAULT_CHUNK_OVERLAP}, or just under half of chunk_size if that is smaller.",
+            "pack_size": f"The maximum number of characters in each request made by annotate_many(). Default: {DEFAULT_PACK_SIZE}.",
+            "collect_errors": "Whether to record texts or chunks that could not be annotated in `errors` rather than raising the error. Default: false.",
         }
 
-    def annotate(self, text: str, props: dict = None) -> AnnotatedText:
+    def annotate(self, text: str, props: dict | None = None) -> AnnotatedText:
         """
         Annotate text using BioMegatron.
 
@@ -66,39 +359,202 @@ class BioMegatron(Annotator):
         if props is None:
             props = {}
 
-        session = self.requests_session
-        timeout = props.get("timeout", 120)
+        result, errors = self._annotate_chunked(text, props)
+
+        return AnnotatedText(
+            text, _denotations_to_annotations(result, self.provenance), errors
+        )
+
+    def annotate_columnar(
+        self, texts: list[str], props: dict | None = None
+    ) -> AnnotationBatch:
+        """
+        Annotate several texts using BioMegatron, adding the denotations directly to an AnnotationBatch. If
+        `max_workers` is greater than one, up to that many texts will be annotated concurrently. If `collect_errors`
+        is true, any text that could not be annotated will be recorded in the batch's `errors`; otherwise the error
+        is raised.
+
+        :param texts: The texts to annotate.
+        :param props: Properties to pass to BioMegatron.
+        :return: An AnnotationBatch with one text for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        results, errors = _map_texts(
+            type(self).__name__, self._annotate_chunked, texts, props
+        )
+
+        provenance = self.provenance
+        batch = AnnotationBatch()
+        for text, result, error in zip(texts, results, errors):
+            if error is not None:
+                batch.add_text(text, [error])
+            else:
+                result, chunk_errors = result
+                _add_denotations_to_batch(
+                    batch, batch.add_text(text, chunk_errors), result, provenance
+                )
+        return batch
+
+    def annotate_many(
+        self, texts: list[str], props: dict | None = None
+    ) -> list[AnnotatedText]:
+        """
+        Annotate many (usually short) texts using BioMegatron, joining them with PACK_SEPARATOR into requests of up to
+        `pack_size` characters so that we make far fewer requests than texts. The denotations for each request are
+        split back into one AnnotatedText for each text. If `max_workers` is greater than one, up to that many
+        requests will be made concurrently. If `collect_errors` is true, the texts in a request that fails will be
+        returned without annotations and with the error recorded; otherwise the error is raised.
+
+        :param texts: The texts to annotate.
+        :param props: Properties to pass to BioMegatron.
+        :return: A list of AnnotatedTexts, one for each text in `texts` in the same order.
+        """
+        if props is None:
+            props = {}
+
+        packs = _pack_texts(texts, props.get("pack_size", DEFAULT_PACK_SIZE))
+        results, errors = _map_texts(
+            type(self).__name__,
+            self._annotate_chunked,
+            [PACK_SEPARATOR.join(texts[index] for index in pack) for pack in packs],
+            props,
+        )
+
+        provenance = self.provenance
+        annotated_texts = [None] * len(texts)
+        for pack, result, error in zip(packs, results, errors):
+            if error is not None:
+                for index in pack:
+                    annotated_texts[index] = AnnotatedText(texts[index], [], [error])
+                continue
+
+            result, chunk_errors = result
+            pack_texts = [texts[index] for index in pack]
+            for index, text_result in zip(
+                pack, _split_packed_result(pack_texts, result)
+            ):
+                annotated_texts[index] = AnnotatedText(
+                    texts[index],
+                    _denotations_to_annotations(text_result, provenance),
+                    list(chunk_errors),
+                )
+        return annotated_texts
 
-        response = session.post(
+    def _annotate_chunked(self, text: str, props: dict) -> tuple[dict, list[str]]:
+        """
+        Annotate a text using BioMegatron, splitting it into chunks if it is longer than the `chunk_size` property.
+        Chunks are annotated concurrently if `max_workers` is greater than one. If `collect_errors` is true, chunks
+        that could not be annotated are reported as errors rather than raised.
+
+        :param text: The text to annotate.
+        :param props: Properties to pass to BioMegatron.
+        :return: The BioMegatron result for the whole text, and a list of errors.
+        """
+        chunk_size = props.get("chunk_size")
+        if not chunk_size or len(text) <= chunk_size:
+            return self._annotate_json(text, props), []
+
+        overlap = props.get("chunk_overlap")
+        if overlap is None:
+            overlap = min(DEFAULT_CHUNK_OVERLAP, chunk_size // 2 - 1)
+        spans = _chunk_spans(text, chunk_size, overlap)
+        results, errors = _map_texts(
+            type(self).__name__,
+            self._annotate_json,
+            [text[start:end] for start, end in spans],
+            props,
+        )
+        return _merge_chunk_results(text, spans, results), [
+            error for error in errors if error is not None
+        ]
+
+    def _annotate_json(self, text: str, props: dict) -> dict:
+        """Annotate a text using BioMegatron, returning the JSON response."""
+        _, result = request_json(
+            self.requests_session,
+            "BioMegatron",
+            "POST",
             self.annotate_url,
-            json={
-                "text": text,
-                "model_name": "token_classification",
-            },
+            resilience=self.resilience,
+            json=_annotate_request(text),
+            timeout=props.get("timeout", 120),
+        )
+        return result
+
+
+class AsyncBioMegatron(AsyncService, AsyncAnnotator):
+    """
+    An asynchronous version of BioMegatron, for use in asyncio applications. Requires httpx.
+    """
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this service."""
+        return AnnotationProvenance.shared(
+            name="BioMegatron", url=RENCI_BIOMEGATRON_URL, version=self.openapi_version
+        )
+
+    def __init__(
+        self,
+        url=RENCI_BIOMEGATRON_URL,
+        client=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        resilience=None,
+    ):
+        """
+        Set up an asynchronous BioMegatron service.
+
+        :param url: The URL of the BioMegatron service.
+        :param client: An httpx.AsyncClient to use, which may be shared with other services.
+        :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document on the first request.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk. Default: 0.
+        :param resilience: The Resilience that decides when to retry requests to this service or fail fast.
+            Default: Resilience().
+        """
+        super().__init__(
+            url,
+            client=client,
             timeout=timeout,
+            openapi_version=openapi_version,
+            version_cache_ttl=version_cache_ttl,
+            resilience=resilience,
+            service="BioMegatron",
         )
+        self.annotate_url = url + "/annotate/"
 
-        response.raise_for_status()
+    def supported_properties(self):
+        """Some configurable parameters for BioMegatron."""
+        return {
+            "timeout": "The timeout in seconds for requests to BioMegatron. Default: 120 seconds.",
+            "max_concurrency": "The maximum number of requests to BioMegatron in flight at once. Default: 100.",
+        }
 
-        result = response.json()
+    async def annotate(self, text: str, props: dict | None = None) -> AnnotatedText:
+        """
+        Annotate text using BioMegatron.
 
-        annotations = []
-        for denotation in result.get("denotations", []):
-            span = denotation.get("span", {})
-            start_index = span.get("begin", -1)
-            end_index = span.get("end", -1)
-
-            annotations.append(
-                Annotation(
-                    text=denotation.get("text", ""),
-                    start=start_index,
-                    end=end_index,
-                    id=denotation.get("id", ""),
-                    label="",
-                    type=denotation.get("obj", ""),
-                    props={},
-                    provenance=self.provenance,
-                )
-            )
+        :param text: Text to annotate.
+        :param props: Properties to pass to BioMegatron.
+        :return: An AnnotatedText object containing the annotations.
+        """
+
+        if props is None:
+            props = {}
+
+        await self.ensure_openapi_version()
+
+        _, result = await self.request_json(
+            "BioMegatron",
+            "POST",
+            self.annotate_url,
+            json=_annotate_request(text),
+            timeout=props.get("timeout", self.timeout),
+        )
 
-        return AnnotatedText(text, annotations)
+        return AnnotatedText(text, _denotations_to_annotations(result, self.provenance))
@@ -0,0 +1,414 @@
+#
+# A local dictionary-based annotator, which finds every synonym of a set of Babel cliques in a text with an
+# Aho-Corasick automaton. It scans each text once, however many synonyms there are, and doesn't need a remote service,
+# so it can replace BioMegatron (or find candidates for it) on high-volume jobs where a dictionary is good enough.
+#
+# Synonyms are matched case-insensitively, with any run of whitespace in the text matching a single space, and (by
+# default) only as whole words. Where matches overlap, only the longest is kept.
+#
+# The compiled automaton is stored as flat arrays of 64-bit integers, so it can be saved to a directory and
+# memory-mapped back in without being rebuilt:
+#
+# - `transition_offsets.bin`: the offset of the transitions of each state in the two transition files, followed by
+#   the total number of transitions.
+# - `transition_chars.bin`: the character (as a code point) of each transition, sorted within each state.
+# - `transition_targets.bin`: the state each transition leads to.
+# - `fail.bin`: the failure link of each state, i.e. the state for its longest proper suffix.
+# - `outputs.bin`: the synonym that ends at each state, or -1 if none does.
+# - `output_links.bin`: the next state along the failure links that has an output, or -1 if there isn't one.
+# - `lengths.bin`: the length of each synonym (after collapsing whitespace).
+# - `entries.jsonl`: the `id`, `label` and `type` of the clique for each synonym, one per line.
+# - `entry_offsets.bin`: the byte offset of each line in `entries.jsonl`.
+# - `index.json`: metadata about the automaton, such as its `version`.
+#
+import bisect
+import json
+from array import array
+from collections import deque
+from collections.abc import Iterable
+from pathlib import Path
+
+from renci_ner import instrumentation
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    Annotator,
+)
+from renci_ner.services.linkers.nameres import _as_bool
+from renci_ner.store import _Mapped
+
+# The integer arrays that make up a compiled automaton, each stored in a .bin file of the same name.
+_ARRAYS = (
+    "transition_offsets",
+    "transition_chars",
+    "transition_targets",
+    "fail",
+    "outputs",
+    "output_links",
+    "lengths",
+    "entry_offsets",
+)
+
+_SPACE = ord(" ")
+
+
+def _fold(char: str) -> int:
+    """
+    Fold a single character for matching, returning its code point. Characters are lowercased unless that would
+    change their length (e.g. "İ"), so that offsets in the folded text are offsets in the original text.
+    """
+    if char.isspace():
+        return _SPACE
+    lower = char.lower()
+    return ord(lower) if len(lower) == 1 else ord(char)
+
+
+def _fold_synonym(synonym: str) -> tuple[int, ...]:
+    """Fold a synonym for matching, collapsing runs of whitespace into single spaces."""
+    return tuple(_fold(char) for char in " ".join(synonym.split()))
+
+
+def _resolve_overlaps(
+    matches: list[tuple[int, int, int]],
+) -> list[tuple[int, int, int]]:
+    """
+    Keep the longest of any overlapping matches (or the first, if they are the same length).
+
+    :param matches: A list of (start, end, synonym) tuples.
+    :return: The matches that were kept, in order of start.
+    """
+    starts = []
+    kept = []
+    for match in sorted(matches, key=lambda match: (match[0] - match[1], match[0])):
+        start, end, _ = match
+        index = bisect.bisect_left(starts, start)
+        if index > 0 and kept[index - 1][1] > start:
+            continue
+        if index < len(kept) and kept[index][0] < end:
+            continue
+        starts.insert(index, start)
+        kept.insert(index, match)
+    return kept
+
+
+class Automaton:
+    """
+    An Aho-Corasick automaton that finds every occurrence of a set of synonyms in a text, stored as flat integer
+    arrays. Use `build()` to compile one, `save()` to write it to a directory and `load()` to memory-map it back.
+    """
+
+    def __init__(self, arrays: dict, entries, metadata: dict):
+        """
+        :param arrays: The integer arrays of the automaton (see _ARRAYS), as arrays or memoryviews.
+        :param entries: The entries file, as bytes or a _Mapped file.
+        :param metadata: Metadata about the automaton.
+        """
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.entries = entries
+        self.metadata = metadata
+        self._files = []
+
+    @classmethod
+    def build(cls, records: Iterable[dict], version: str | None = None) -> "Automaton":
+        """
+        Compile an automaton from Babel synonym records. Where several cliques have the same synonym, it is matched
+        to the clique for which it is the preferred name, otherwise the largest clique.
+
+        :param records: An iterable of Babel synonym records (e.g. each line of a Babel synonym file, parsed as JSON),
+            with the `curie`, `preferred_name`, `names`, `types` and `clique_identifier_count` of each clique.
+        :param version: The version of the automaton (e.g. the Babel release it was built from).
+        :return: The compiled automaton.
+        """
+        # Choose the best clique for each synonym.
+        best = {}
+        for order, record in enumerate(records):
+            label = record.get("preferred_name", "")
+            types = record.get("types") or ["NamedThing"]
+            entry = {
+                "id": record["curie"],
+                "label": label,
+                "type": types[0]
+                if types[0].startswith("biolink:")
+                else "biolink:" + types[0],
+            }
+            preferred = _fold_synonym(label)
+            for name in [label, *record.get("names", [])]:
+                synonym = _fold_synonym(name)
+                if not synonym:
+                    continue
+                rank = (
+                    synonym != preferred,
+                    -record.get("clique_identifier_count", 1),
+                    order,
+                )
+                if synonym not in best or rank < best[synonym][0]:
+                    best[synonym] = (rank, entry)
+
+        # Build the trie: children[state] maps each character to the next state.
+        children = [{}]
+        outputs = array("q", [-1])
+        lengths = array("q")
+        entry_offsets = array("q")
+        entries = bytearray()
+        for index, (synonym, (_, entry)) in enumerate(best.items()):
+            state = 0
+            for char in synonym:
+                next_state = children[state].get(char)
+                if next_state is None:
+                    next_state = len(children)
+                    children[state][char] = next_state
+                    children.append({})
+                    outputs.append(-1)
+                state = next_state
+            outputs[state] = index
+            lengths.append(len(synonym))
+            entry_offsets.append(len(entries))
+            entries += json.dumps(entry).encode() + b"\n"
+
+        # Compute the failure and output links breadth-first, so that every state's links are known before its
+        # children's.
+        fail = array("q", [0]) * len(children)
+        output_links = array("q", [-1]) * len(children)
+        queue = deque(children[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in children[state].items():
+                link = fail[state]
+                while link and char not in children[link]:
+                    link = fail[link]
+                target = children[link].get(char, 0)
+                fail[child] = target if target != child else 0
+                output_links[child] = (
+                    fail[child]
+                    if outputs[fail[child]] >= 0
+                    else output_links[fail[child]]
+                )
+                queue.append(child)
+
+        transition_offsets = array("q")
+        transition_chars = array("q")
+        transition_targets = array("q")
+        for transitions in children:
+            transition_offsets.append(len(transition_chars))
+            for char in sorted(transitions):
+                transition_chars.append(char)
+                transition_targets.append(transitions[char])
+        transition_offsets.append(len(transition_chars))
+
+        return cls(
+            {
+                "transition_offsets": transition_offsets,
+                "transition_chars": transition_chars,
+                "transition_targets": transition_targets,
+                "fail": fail,
+                "outputs": outputs,
+                "output_links": output_links,
+                "lengths": lengths,
+                "entry_offsets": entry_offsets,
+            },
+            bytes(entries),
+            {"version": version, "synonyms": len(lengths), "states": len(children)},
+        )
+
+    def save(self, path):
+        """Write the automaton to a directory, which is created if necessary."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in _ARRAYS:
+            with open(path / f"{name}.bin", "wb") as file:
+                file.write(getattr(self, name))
+        with open(path / "entries.jsonl", "wb") as file:
+            file.write(self._entry_bytes())
+        with open(path / "index.json", "w") as file:
+            json.dump(self.metadata, file)
+
+    @classmethod
+    def load(cls, path) -> "Automaton":
+        """Memory-map an automaton written by `save()`."""
+        path = Path(path)
+        with open(path / "index.json") as file:
+            metadata = json.load(file)
+        files = {name: _Mapped(path / f"{name}.bin") for name in _ARRAYS}
+        entries = _Mapped(path / "entries.jsonl")
+        automaton = cls(
+            {name: mapped.integers for name, mapped in files.items()},
+            entries,
+            metadata,
+        )
+        automaton._files = [*files.values(), entries]
+        return automaton
+
+    def close(self):
+        """Close the files of an automaton loaded with `load()`."""
+        for mapped in self._files:
+            mapped.close()
+        self._files = []
+
+    def _entry_bytes(self) -> bytes:
+        if isinstance(self.entries, _Mapped):
+            return self.entries.mmap[:] if self.entries.mmap is not None else b""
+        return self.entries
+
+    def entry(self, synonym: int) -> dict:
+        """Return the `id`, `label` and `type` of the clique for a synonym."""
+        offset = self.entry_offsets[synonym]
+        if isinstance(self.entries, _Mapped):
+            return json.loads(self.entries.line(offset))
+        return json.loads(self.entries[offset : self.entries.index(b"\n", offset)])
+
+    def find(self, text: str) -> list[tuple[int, int, int]]:
+        """
+        Find every occurrence of every synonym in a text, including overlapping ones.
+
+        :param text: The text to search.
+        :return: A list of (start, end, synonym) tuples, in order of end.
+        """
+        offsets = self.transition_offsets
+        chars = self.transition_chars
+        targets = self.transition_targets
+        fail = self.fail
+        outputs = self.outputs
+        output_links = self.output_links
+        lengths = self.lengths
+
+        matches = []
+        # The offset in `text` of each character fed to the automaton, so that we can find where matches start when
+        # runs of whitespace have been collapsed.
+        positions = []
+        state = 0
+        previous = None
+        for position, char in enumerate(text):
+            code = _fold(char)
+            if code == _SPACE and previous == _SPACE:
+                continue
+            previous = code
+            positions.append(position)
+
+            while True:
+                lower = offsets[state]
+                upper = offsets[state + 1]
+                index = bisect.bisect_left(chars, code, lower, upper)
+                if index < upper and chars[index] == code:
+                    state = targets[index]
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+
+            match_state = state if outputs[state] >= 0 else output_links[state]
+            while match_state >= 0:
+                synonym = outputs[match_state]
+                start = positions[len(positions) - lengths[synonym]]
+                matches.append((start, position + 1, synonym))
+                match_state = output_links[match_state]
+        return matches
+
+
+class DictionaryNER(Annotator):
+    """
+    Finds the synonyms of Babel cliques in full texts with an Aho-Corasick automaton, as a local alternative to
+    BioMegatron. Unlike BioMegatron, each annotation already has the `id`, `label` and `type` of its clique.
+    """
+
+    def __init__(self, automaton: Automaton, path=None):
+        """
+        Set up a dictionary annotator. Use `from_records()` to build one from Babel synonym records, or `load()` to
+        load a saved one.
+
+        :param automaton: The compiled Automaton.
+        :param path: The directory the automaton was loaded from, if any, which is recorded in provenance.
+        """
+        self.automaton = automaton
+        self.path = Path(path) if path is not None else None
+
+    @classmethod
+    def from_records(
+        cls, records: Iterable[dict], version: str | None = None
+    ) -> "DictionaryNER":
+        """Compile an annotator from Babel synonym records (see Automaton.build())."""
+        return cls(Automaton.build(records, version))
+
+    @classmethod
+    def load(cls, path) -> "DictionaryNER":
+        """Load an annotator whose automaton was saved with `save()`."""
+        return cls(Automaton.load(path), path)
+
+    def save(self, path):
+        """Save the compiled automaton to a directory, so that it can be loaded without rebuilding it."""
+        self.automaton.save(path)
+
+    def close(self):
+        """Close the files of a loaded automaton."""
+        self.automaton.close()
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this annotator."""
+        return AnnotationProvenance.shared(
+            name="DictionaryNER",
+            url=self.path.resolve().as_uri() if self.path is not None else "",
+            version=self.automaton.metadata.get("version") or "NA",
+        )
+
+    def supported_properties(self):
+        """Configurable properties for DictionaryNER."""
+        return {
+            "whole_words": "(true/false, default: true) Only match synonyms that start and end at word boundaries.",
+            "overlaps": "(true/false, default: false) Return overlapping matches, rather than only the longest of them.",
+            "biolink_types": "(list of biolink types, default: []) Only return matches with these biolink types.",
+        }
+
+    def annotate(self, text: str, props: dict | None = None) -> AnnotatedText:
+        """
+        Find the synonyms in a text.
+
+        :param text: Text to annotate.
+        :param props: The properties to use (see supported_properties()).
+        :return: An AnnotatedText object containing the annotations.
+        """
+        if props is None:
+            props = {}
+
+        matches = self.automaton.find(text)
+        if _as_bool(props.get("whole_words", True)):
+            matches = [
+                (start, end, synonym)
+                for start, end, synonym in matches
+                if (start == 0 or not text[start - 1].isalnum())
+                and (end == len(text) or not text[end].isalnum())
+            ]
+        biolink_types = set(props.get("biolink_types", []))
+        entries = {}
+        if biolink_types:
+            entries = {
+                synonym: self.automaton.entry(synonym) for _, _, synonym in matches
+            }
+            matches = [
+                match for match in matches if entries[match[2]]["type"] in biolink_types
+            ]
+        if _as_bool(props.get("overlaps", False)):
+            matches.sort()
+        else:
+            matches = _resolve_overlaps(matches)
+
+        provenance = self.provenance
+        annotations = []
+        for start, end, synonym in matches:
+            entry = entries.get(synonym) or self.automaton.entry(synonym)
+            entries[synonym] = entry
+            annotations.append(
+                Annotation(
+                    text=text[start:end],
+                    id=entry["id"],
+                    label=entry["label"],
+                    type=entry["type"],
+                    start=start,
+                    end=end,
+                    props={},
+                    provenance=provenance,
+                )
+            )
+        instrumentation.emit_annotations(provenance.name, len(annotations))
+        return AnnotatedText(text, annotations)
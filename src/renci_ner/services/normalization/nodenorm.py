@@ -3,19 +3,161 @@
 # Source code: https://github.com/TranslatorSRI/NodeNormalization
 # Hosted at: https://nodenormalization-sri.renci.org/
 #
+import asyncio
+import itertools
 import logging
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
+from renci_ner import instrumentation
+from renci_ner.cache import MISSING, make_key
 from renci_ner.core import (
+    DEFAULT_MAX_CONCURRENCY,
     AnnotatedText,
     AnnotationProvenance,
+    AsyncTransformer,
     NormalizedAnnotation,
     Transformer,
 )
+from renci_ner.services.async_http import AsyncService, _import_httpx
+from renci_ner.services.http import (
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    create_session,
+    request_json,
+)
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import (
+    DEFAULT_RETRY_STATUSES,
+    CircuitOpenError,
+    Resilience,
+    RetryPolicy,
+)
+
+logger = logging.getLogger(__name__)
 
 # Configuration.
 RENCI_NODENORM_URL = "https://nodenormalization-sri.renci.org"
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WINDOW_SIZE = 100
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+
+def _default_resilience() -> Resilience:
+    """
+    Return the default Resilience for NodeNorm, which (as NodeNorm can return a 500 error when it is overloaded)
+    also retries 500 errors.
+    """
+    return Resilience(
+        RetryPolicy(
+            retries=DEFAULT_RETRIES,
+            backoff=RETRY_BACKOFF,
+            statuses=DEFAULT_RETRY_STATUSES | {500},
+        )
+    )
+
+
+def _normalization_request(ids: list[str], props: dict) -> dict:
+    """Return the JSON request for normalizing a list of CURIEs with NodeNorm."""
+    return {
+        "curies": ids,
+        "conflate": "true" if props.get("geneprotein_conflation", True) else "false",
+        "drug_chemical_conflate": "true"
+        if props.get("drugchemical_conflation", False)
+        else "false",
+        "description": "true" if props.get("description", False) else "false",
+    }
+
+
+def _cache_key(url: str, version: str, curie: str, props: dict) -> str:
+    """
+    Return the cache key for normalizing a CURIE: this includes the conflation settings and the version of
+    NodeNorm, so that CURIEs are normalized again when NodeNorm is updated.
+    """
+    request = _normalization_request([], props)
+    del request["curies"]
+    return make_key("NodeNorm", url, version, curie, request)
+
+
+def _chunks(curies: list[str], props: dict) -> list[list[str]]:
+    """Split a list of CURIEs into chunks of `batch_size` CURIEs, to send to NodeNorm in separate requests."""
+    batch_size = props.get("batch_size", DEFAULT_BATCH_SIZE)
+    return [
+        curies[index : index + batch_size]
+        for index in range(0, len(curies), batch_size)
+    ]
+
+
+def _apply_normalization(
+    annotated_text: AnnotatedText,
+    results: dict,
+    props: dict,
+    provenance: AnnotationProvenance,
+) -> AnnotatedText:
+    """
+    Replace the annotations in an AnnotatedText with NormalizedAnnotations based on the results from NodeNorm.
+    Annotations that NodeNorm could not normalize, or that are already normalized, are left unchanged.
+
+    :param annotated_text: The annotated text to transform.
+    :param results: The results from NodeNorm, keyed by CURIE.
+    :param props: Properties passed to NodeNorm (see NodeNorm.supported_properties).
+    :param provenance: The provenance of the NodeNorm service that returned these results.
+    :return: The AnnotatedText with normalized annotations where possible.
+    """
+    output_annotations = []
+    normalized_count = 0
+    for annotation in annotated_text.annotations:
+        # No result?
+        if annotation.id not in results or results[annotation.id] is None:
+            output_annotations.append(annotation)
+            continue
+
+        # We have a result!
+        result = results[annotation.id]
+        if (
+            "id" not in result
+            or "identifier" not in result["id"]
+            or not result["id"]["identifier"]
+        ):
+            # No identifier, skip.
+            output_annotations.append(annotation)
+            continue
+
+        if (
+            isinstance(annotation, NormalizedAnnotation)
+            and result["id"]["identifier"] == annotation.id
+        ):
+            # Already normalized, skip.
+            output_annotations.append(annotation)
+            continue
+
+        types = result["type"]
+        if not types:
+            types = ["biolink:NamedThing"]
+
+        normalized_annotation = NormalizedAnnotation.from_annotation(
+            annotation,
+            provenance=provenance,
+            curie=result["id"]["identifier"],
+            biolink_type=types[0],
+            label=result["id"].get("label", ""),
+        )
+        normalized_annotation.props["types"] = types
+        normalized_annotation.props["ic"] = results.get("ic", None)
+
+        if props.get("description", False):
+            normalized_annotation.props["description"] = result["id"].get(
+                "description", None
+            )
+
+        output_annotations.append(normalized_annotation)
+        normalized_count += 1
+
+    instrumentation.emit_annotations(provenance.name, normalized_count)
+    return AnnotatedText(annotated_text.text, output_annotations, annotated_text.errors)
 
 
 class NodeNorm(Transformer):
@@ -26,33 +168,73 @@ class NodeNorm(Transformer):
     @property
     def provenance(self) -> AnnotationProvenance:
         """Return an AnnotationProvenance describing annotations produced by this service."""
-        return AnnotationProvenance(
+        return AnnotationProvenance.shared(
             name="NodeNorm", url=RENCI_NODENORM_URL, version=self.openapi_version
         )
 
     def __init__(
-        self, url=RENCI_NODENORM_URL, requests_session=requests.Session(), timeout=120
+        self,
+        url=RENCI_NODENORM_URL,
+        requests_session=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        keep_alive=True,
+        cache=None,
+        resilience=None,
     ):
         """
-        Set up a BioMegatron service.
+        Set up a NodeNorm service.
 
-        :param url: The URL of the BioMegatron service.
-        :param requests_session: A Requests session object to use instead of the default one.
+        :param url: The URL of the NodeNorm service.
+        :param requests_session: A Requests session to use, which may be shared with other services (see
+            create_session()). If not provided, a new session is created for this service.
         :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document when it is first needed.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk, so that other
+            processes don't need to look it up again. Default: 0 (don't cache on disk).
+        :param pool_maxsize: The maximum number of concurrent connections to this service, if we create the
+            session. Default: 100.
+        :param max_retries: The number of times the session retries a request that could not connect, if we create
+            the session. All other retries are made by `resilience`. Default: 1.
+        :param keep_alive: Whether to keep connections to this service open, if we create the session.
+            Default: True.
+        :param cache: A cache (see renci_ner.cache) to store the normalization of each CURIE in, so that each CURIE
+            only needs to be normalized once for each combination of properties. Default: None (don't cache).
+        :param resilience: The Resilience (see renci_ner.services.resilience) that decides when to retry requests
+            to this service or fail fast. Default: retry up to `retries` times, including when NodeNorm returns a
+            500 error.
         """
         self.url = url
+        self.cache = cache
         self.get_normalized_nodes_url = url + "/get_normalized_nodes"
+        if requests_session is None:
+            requests_session = create_session(
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+                keep_alive=keep_alive,
+            )
         self.requests_session = requests_session
-
-        response = self.requests_session.get(
-            self.url + "/openapi.json", timeout=timeout
+        self.resilience = (
+            resilience if resilience is not None else _default_resilience()
         )
-        response.raise_for_status()
-        openapi_data = response.json()
-        self.openapi_version = openapi_data.get("info", {"version": "NA"}).get(
-            "version", "NA"
+        self._openapi_version = OpenAPIVersion(
+            url,
+            timeout=timeout,
+            version=openapi_version,
+            cache_ttl=version_cache_ttl,
+            service="NodeNorm",
+            resilience=self.resilience,
         )
 
+    @property
+    def openapi_version(self) -> str:
+        """The version of this service, looked up from its OpenAPI document on first use."""
+        return self._openapi_version.get(self.requests_session)
+
     def supported_properties(self):
         """Some configurable parameters."""
         return {
@@ -60,6 +242,10 @@ class NodeNorm(Transformer):
             "geneprotein_conflation": "(true/false, default: true) Whether to conflate gene and protein identifiers.",
             "drugchemical_conflation": "(true/false, default: false) Whether to conflate drug and chemical identifiers.",
             "description": "(true/false, default: false) Whether to include descriptions in the response.",
+            "batch_size": f"(int, default: {DEFAULT_BATCH_SIZE}) The maximum number of CURIEs to send to NodeNorm in a single request.",
+            "max_workers": "(int, default: 1) The maximum number of concurrent requests to NodeNorm.",
+            "retries": f"(int, default: {DEFAULT_RETRIES}) The number of times to retry a request that NodeNorm returned an error for.",
+            "window_size": f"(int, default: {DEFAULT_WINDOW_SIZE}) The number of texts to normalize together in transform_many().",
         }
 
     def transform(self, annotated_text: AnnotatedText, props=None) -> AnnotatedText:
@@ -75,79 +261,309 @@ class NodeNorm(Transformer):
         if props is None:
             props = {}
 
-        session = self.requests_session
-        timeout = props.get("timeout", 120)
-
-        ids = list(set(map(lambda a: a.id, annotated_text.annotations)))
-
-        response = session.post(
-            self.get_normalized_nodes_url,
-            json={
-                "curies": ids,
-                "conflate": "true"
-                if props.get("geneprotein_conflation", True)
-                else "false",
-                "drug_chemical_conflate": "true"
-                if props.get("drugchemical_conflation", False)
-                else "false",
-                "description": "true" if props.get("description", False) else "false",
-            },
-            timeout=timeout,
-        )
-        if response.status_code != 200:
-            # raise Exception(f"NodeNorm returned status code {response.status_code}")
-            logging.error(
-                f"NodeNorm returned status code {response.status_code} {response.text} for CURIEs {ids}, skipping."
-            )
+        ids = list({annotation.id for annotation in annotated_text.annotations})
+
+        results = self.normalize(ids, props)
+        if results is None:
             return annotated_text
 
-        results = response.json()
+        return _apply_normalization(annotated_text, results, props, self.provenance)
 
-        output_annotations = []
-        for annotation in annotated_text.annotations:
-            # No result?
-            if annotation.id not in results or results[annotation.id] is None:
-                output_annotations.append(annotation)
-                continue
+    def transform_many(
+        self, annotated_texts: Iterable[AnnotatedText], props=None
+    ) -> Iterator[AnnotatedText]:
+        """
+        Transform many AnnotatedText objects using NodeNorm. Rather than normalizing each text separately, we
+        read `window_size` texts at a time and normalize all of their distinct CURIEs together, so that the
+        cost of each request to NodeNorm is shared between many texts.
 
-            # We have a result!
-            result = results[annotation.id]
-            if (
-                "id" not in result
-                or "identifier" not in result["id"]
-                or not result["id"]["identifier"]
-            ):
-                # No identifier, skip.
-                output_annotations.append(annotation)
-                continue
+        :param annotated_texts: The annotated texts to transform. This may be a generator.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: A generator of AnnotatedTexts with normalized annotations where possible, in the same order.
+        """
+        if props is None:
+            props = {}
+
+        window_size = props.get("window_size", DEFAULT_WINDOW_SIZE)
+        annotated_texts = iter(annotated_texts)
+        while window := list(itertools.islice(annotated_texts, window_size)):
+            ids = list(
+                dict.fromkeys(
+                    annotation.id
+                    for annotated_text in window
+                    for annotation in annotated_text.annotations
+                )
+            )
+
+            results = self.normalize(ids, props)
+            provenance = self.provenance
+            for annotated_text in window:
+                if results is None:
+                    yield annotated_text
+                else:
+                    yield _apply_normalization(
+                        annotated_text, results, props, provenance
+                    )
 
-            if (
-                isinstance(annotation, NormalizedAnnotation)
-                and result["id"]["identifier"] == annotation.id
-            ):
-                # Already normalized, skip.
-                output_annotations.append(annotation)
+    def _cache_key(self, curie: str, props: dict) -> str:
+        """Return the cache key for normalizing a CURIE with this NodeNorm (see _cache_key())."""
+        return _cache_key(self.url, self.openapi_version, curie, props)
+
+    def normalize(self, ids: list[str], props: dict | None = None) -> dict | None:
+        """
+        Normalize a list of CURIEs with NodeNorm. If we have a cache, only the CURIEs that aren't in the cache will
+        be sent to NodeNorm. CURIEs are sent in chunks of `batch_size`, up to `max_workers` chunks at a time, and
+        a chunk that fails is retried up to `retries` times; if it still fails, its CURIEs are left out of the
+        results (and so left unnormalized) without affecting the other chunks.
+
+        :param ids: The CURIEs to normalize.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: A dictionary of NodeNorm results keyed by CURIE (with None for CURIEs that could not be
+            normalized), or None if every request to NodeNorm failed and none of the CURIEs were cached.
+        """
+        if props is None:
+            props = {}
+
+        results = {}
+        if self.cache is not None:
+            for curie in ids:
+                cached = self.cache.get(self._cache_key(curie, props))
+                if cached is not MISSING:
+                    results[curie] = cached
+
+        missing = [curie for curie in ids if curie not in results]
+        if not missing:
+            return results
+
+        max_workers = props.get("max_workers", 1)
+        chunks = _chunks(missing, props)
+
+        if max_workers <= 1 or len(chunks) <= 1:
+            chunk_results = [self._normalize_chunk(chunk, props) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                chunk_results = list(
+                    executor.map(
+                        instrumentation.in_current_context(
+                            lambda chunk: self._normalize_chunk(chunk, props)
+                        ),
+                        chunks,
+                    )
+                )
+
+        failed = False
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if chunk_result is None:
+                failed = True
                 continue
+            for curie in chunk:
+                results[curie] = chunk_result.get(curie)
+                if self.cache is not None:
+                    self.cache.set(self._cache_key(curie, props), results[curie])
+
+        if failed and not results:
+            return None
+        return results
 
-            types = result["type"]
-            if not types:
-                types = ["biolink:NamedThing"]
+    def _normalize_chunk(self, curies: list[str], props: dict) -> dict | None:
+        """
+        Send a single chunk of CURIEs to NodeNorm, retrying up to `retries` times if NodeNorm returns an error.
 
-            normalized_annotation = NormalizedAnnotation.from_annotation(
-                annotation,
-                provenance=self.provenance,
-                curie=result["id"]["identifier"],
-                biolink_type=types[0],
-                label=result["id"].get("label", ""),
+        :param curies: The CURIEs to normalize in a single request.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: The response from NodeNorm, or None if NodeNorm failed on every attempt.
+        """
+        try:
+            response, result = request_json(
+                self.requests_session,
+                "NodeNorm",
+                "POST",
+                self.get_normalized_nodes_url,
+                raise_for_status=False,
+                resilience=self.resilience,
+                retries=props.get("retries"),
+                json=_normalization_request(curies, props),
+                timeout=props.get("timeout", 120),
+            )
+        except (requests.RequestException, CircuitOpenError) as err:
+            logger.error(
+                f"NodeNorm could not normalize CURIEs {curies}, skipping: {err}"
             )
-            normalized_annotation.props["types"] = types
-            normalized_annotation.props["ic"] = results.get("ic", None)
+            return None
+
+        if result is None:
+            logger.error(
+                f"NodeNorm returned status code {response.status_code} {response.text} for CURIEs {curies}, "
+                f"skipping."
+            )
+        return result
+
 
-            if props.get("description", False):
-                normalized_annotation.props["description"] = result["id"].get(
-                    "description", None
+class AsyncNodeNorm(AsyncService, AsyncTransformer):
+    """
+    An asynchronous version of NodeNorm, for use in asyncio applications. Requires httpx.
+    """
+
+    @property
+    def provenance(self) -> AnnotationProvenance:
+        """Return an AnnotationProvenance describing annotations produced by this service."""
+        return AnnotationProvenance.shared(
+            name="NodeNorm", url=RENCI_NODENORM_URL, version=self.openapi_version
+        )
+
+    def __init__(
+        self,
+        url=RENCI_NODENORM_URL,
+        client=None,
+        timeout=120,
+        openapi_version=None,
+        version_cache_ttl=0,
+        cache=None,
+        resilience=None,
+    ):
+        """
+        Set up an asynchronous NodeNorm service.
+
+        :param url: The URL of the NodeNorm service.
+        :param client: An httpx.AsyncClient to use, which may be shared with other services.
+        :param timeout: The timeout to use for requests in seconds. Default: 120 seconds.
+        :param openapi_version: The version of the service to record in provenance. If not provided, it will be
+            looked up from the service's OpenAPI document on the first request.
+        :param version_cache_ttl: How long (in seconds) to cache the looked-up version on disk. Default: 0.
+        :param cache: A cache (see renci_ner.cache) to store the normalization of each CURIE in, as for NodeNorm.
+            Default: None (don't cache).
+        :param resilience: The Resilience that decides when to retry requests to this service or fail fast.
+            Default: as for NodeNorm.
+        """
+        super().__init__(
+            url,
+            client=client,
+            timeout=timeout,
+            openapi_version=openapi_version,
+            version_cache_ttl=version_cache_ttl,
+            resilience=resilience if resilience is not None else _default_resilience(),
+            service="NodeNorm",
+        )
+        self.cache = cache
+        self.get_normalized_nodes_url = url + "/get_normalized_nodes"
+
+    def supported_properties(self):
+        """Some configurable parameters."""
+        properties = {
+            **NodeNorm.supported_properties(self),
+            "max_concurrency": "(int, default: 100) The maximum number of requests to NodeNorm in flight at once.",
+        }
+        del properties["max_workers"]
+        del properties["window_size"]
+        return properties
+
+    async def transform(
+        self, annotated_text: AnnotatedText, props=None
+    ) -> AnnotatedText:
+        """
+        Transform an AnnotatedText object using NodeNorm, in the same way as NodeNorm.transform().
+
+        :param annotated_text: The annotated text to transform.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: The AnnotatedText with normalized annotations where possible.
+        """
+        if props is None:
+            props = {}
+
+        ids = list({annotation.id for annotation in annotated_text.annotations})
+
+        results = await self.normalize(ids, props)
+        if results is None:
+            return annotated_text
+
+        return _apply_normalization(annotated_text, results, props, self.provenance)
+
+    async def normalize(self, ids: list[str], props: dict | None = None) -> dict | None:
+        """
+        Normalize a list of CURIEs with NodeNorm, in the same way as NodeNorm.normalize(), but with up to
+        `max_concurrency` chunks in flight at once.
+
+        :param ids: The CURIEs to normalize.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: A dictionary of NodeNorm results keyed by CURIE (with None for CURIEs that could not be
+            normalized), or None if every request to NodeNorm failed and none of the CURIEs were cached.
+        """
+        if props is None:
+            props = {}
+
+        await self.ensure_openapi_version()
+
+        results = {}
+        if self.cache is not None:
+            for curie in ids:
+                cached = self.cache.get(
+                    _cache_key(self.url, self.openapi_version, curie, props)
                 )
+                if cached is not MISSING:
+                    results[curie] = cached
 
-            output_annotations.append(normalized_annotation)
+        missing = [curie for curie in ids if curie not in results]
+        if not missing:
+            return results
 
-        return AnnotatedText(annotated_text.text, output_annotations)
+        chunks = _chunks(missing, props)
+        semaphore = asyncio.Semaphore(
+            props.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)
+        )
+
+        async def normalize_chunk(chunk: list[str]) -> dict | None:
+            async with semaphore:
+                return await self._normalize_chunk(chunk, props)
+
+        chunk_results = await asyncio.gather(
+            *(normalize_chunk(chunk) for chunk in chunks)
+        )
+
+        failed = False
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if chunk_result is None:
+                failed = True
+                continue
+            for curie in chunk:
+                results[curie] = chunk_result.get(curie)
+                if self.cache is not None:
+                    self.cache.set(
+                        _cache_key(self.url, self.openapi_version, curie, props),
+                        results[curie],
+                    )
+
+        if failed and not results:
+            return None
+        return results
+
+    async def _normalize_chunk(self, curies: list[str], props: dict) -> dict | None:
+        """
+        Send a single chunk of CURIEs to NodeNorm, in the same way as NodeNorm._normalize_chunk().
+
+        :param curies: The CURIEs to normalize in a single request.
+        :param props: Properties to pass to NodeNorm (see supported_properties).
+        :return: The response from NodeNorm, or None if NodeNorm failed on every attempt.
+        """
+        httpx = _import_httpx()
+        try:
+            response, result = await self.request_json(
+                "NodeNorm",
+                "POST",
+                self.get_normalized_nodes_url,
+                raise_for_status=False,
+                retries=props.get("retries"),
+                json=_normalization_request(curies, props),
+                timeout=props.get("timeout", self.timeout),
+            )
+        except (httpx.TransportError, CircuitOpenError) as err:
+            logger.error(
+                f"NodeNorm could not normalize CURIEs {curies}, skipping: {err}"
+            )
+            return None
+
+        if result is None:
+            logger.error(
+                f"NodeNorm returned status code {response.status_code} {response.text} for CURIEs {curies}, "
+                f"skipping."
+            )
+        return result
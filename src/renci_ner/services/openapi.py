@@ -0,0 +1,167 @@
+#
+# Lazy discovery of the version of a service from its OpenAPI document (`/openapi.json`), which we record in the
+# provenance of every annotation. Looking up the version is deferred until it is first needed, and can be cached on
+# disk or pinned so that short-lived processes don't need to look it up at all.
+#
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from renci_ner.services.http import request_json
+
+# Configuration.
+DEFAULT_TIMEOUT = 120
+CACHE_FILENAME = "openapi-versions.json"
+
+
+def default_cache_dir() -> Path:
+    """
+    Return the default directory for renci-ner caches: $RENCI_NER_CACHE_DIR if set, otherwise `renci-ner` in
+    $XDG_CACHE_HOME (or ~/.cache).
+    """
+    if "RENCI_NER_CACHE_DIR" in os.environ:
+        return Path(os.environ["RENCI_NER_CACHE_DIR"])
+    cache_home = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(cache_home) / "renci-ner"
+
+
+def _version_from_openapi(openapi_data: dict) -> str:
+    """Read the version from an OpenAPI document, or return 'NA' if it doesn't have one."""
+    return openapi_data.get("info", {"version": "NA"}).get("version", "NA")
+
+
+class OpenAPIVersion:
+    """
+    The version of a service, as reported by its OpenAPI document. The version is looked up on first use and then
+    remembered; if `cache_ttl` is set, it is also stored on disk and reused by other processes for that many seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout=DEFAULT_TIMEOUT,
+        version: str | None = None,
+        cache_ttl: float = 0,
+        cache_dir=None,
+        service: str = "service",
+        resilience=None,
+    ):
+        """
+        Set up the version lookup for a service.
+
+        :param url: The URL of the service (without `/openapi.json`).
+        :param timeout: The timeout to use when looking up the version in seconds. Default: 120 seconds.
+        :param version: A version to use instead of looking it up, e.g. to pin the version in a batch job.
+        :param cache_ttl: How long (in seconds) to cache the version on disk. Default: 0 (don't cache on disk).
+        :param cache_dir: The directory to cache the version in. Default: see default_cache_dir().
+        :param service: The name of the service, for logging and instrumentation.
+        :param resilience: The Resilience (see renci_ner.services.resilience) of the service, which decides whether
+            to retry the lookup or fail fast, as for the service's other requests. Default: make a single attempt.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.service = service
+        self.resilience = resilience
+        self._version = version
+        self._lock = threading.Lock()
+        self._async_lock = None
+
+    @property
+    def cache_path(self) -> Path:
+        """The file that versions are cached in."""
+        return self.cache_dir / CACHE_FILENAME
+
+    def _read_cache(self) -> dict:
+        """Read the on-disk cache of versions, keyed by URL."""
+        try:
+            with self.cache_path.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_cached_version(self):
+        """Return the version of this service from the on-disk cache, or None if it isn't cached or has expired."""
+        if not self.cache_ttl:
+            return None
+        entry = self._read_cache().get(self.url)
+        if entry is None or time.time() - entry.get("retrieved", 0) > self.cache_ttl:
+            return None
+        return entry.get("version")
+
+    def _write_cached_version(self, version: str):
+        """Store the version of this service in the on-disk cache."""
+        if not self.cache_ttl:
+            return
+        cache = self._read_cache()
+        cache[self.url] = {"version": version, "retrieved": time.time()}
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file and then rename it, so that other processes never see a partial file.
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.cache_dir, delete=False, suffix=".tmp"
+            ) as f:
+                json.dump(cache, f)
+            os.replace(f.name, self.cache_path)
+        except OSError:
+            # The cache is only an optimization, so we don't mind if we can't write it.
+            pass
+
+    @property
+    def known_version(self):
+        """The version of this service if it is already known (pinned, looked up or cached on disk), or None."""
+        if self._version is None:
+            self._version = self._read_cached_version()
+        return self._version
+
+    def get(self, requests_session) -> str:
+        """
+        Return the version of this service, looking it up with a Requests session if necessary.
+
+        :param requests_session: The Requests session to use to look up the OpenAPI document.
+        :return: The version of this service, or "NA" if the service doesn't report one.
+        """
+        with self._lock:
+            if self.known_version is None:
+                _, openapi_data = request_json(
+                    requests_session,
+                    self.service,
+                    "GET",
+                    self.url + "/openapi.json",
+                    resilience=self.resilience,
+                    timeout=self.timeout,
+                )
+                self._version = _version_from_openapi(openapi_data)
+                self._write_cached_version(self._version)
+            return self._version
+
+    async def aget(self, async_service) -> str:
+        """
+        Return the version of this service, looking it up with an AsyncService (see renci_ner.services.async_http)
+        if necessary. Concurrent calls wait for a single lookup rather than each requesting the OpenAPI document.
+
+        :param async_service: The AsyncService to look up the OpenAPI document with, using its client and
+            resilience.
+        :return: The version of this service, or "NA" if the service doesn't report one.
+        """
+        if self.known_version is not None:
+            return self._version
+
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if self.known_version is None:
+                _, openapi_data = await async_service.request_json(
+                    self.service,
+                    "GET",
+                    self.url + "/openapi.json",
+                    timeout=self.timeout,
+                )
+                self._version = _version_from_openapi(openapi_data)
+                self._write_cached_version(self._version)
+            return self._version
@@ -0,0 +1,230 @@
+#
+# Retries, backoff and circuit breaking for the requests made by the RENCI NER services, shared by the synchronous
+# (renci_ner.services.http) and asynchronous (renci_ner.services.async_http) services.
+#
+# Every service has its own Resilience, which decides whether (and after how long) a failed request should be retried:
+#
+# - RetryPolicy retries transient errors (connection errors, timeouts and statuses like 503) with jittered exponential
+#   backoff, honoring any Retry-After header sent by the service.
+# - RetryBudget limits retries to a fraction of all requests, so that an overloaded service isn't sent several times
+#   as many requests as usual.
+# - CircuitBreaker fails fast with a CircuitOpenError after repeated failures, rather than waiting for every request
+#   to a service that is down to time out, and lets a single trial request through after `reset_timeout` seconds.
+#
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+# Configuration.
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_RETRY_STATUSES = frozenset({408, 429, 502, 503, 504})
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_RETRY_RATIO = 0.2
+DEFAULT_RETRY_BURST = 10
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of making a request to a service whose circuit breaker is open."""
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Parse a Retry-After header, which may be a number of seconds or an HTTP date.
+
+    :param value: The value of the header, or None if there wasn't one.
+    :return: The number of seconds to wait, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Which failed requests to retry, how many times, and how long to wait between attempts."""
+
+    retries: int = DEFAULT_RETRIES
+    # The first retry waits up to `backoff` seconds, the second up to twice that, and so on, up to `max_backoff`.
+    backoff: float = DEFAULT_BACKOFF
+    max_backoff: float = DEFAULT_MAX_BACKOFF
+    statuses: frozenset = DEFAULT_RETRY_STATUSES
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Return the number of seconds to wait before retrying a request.
+
+        :param attempt: The attempt that failed, starting at 0.
+        :param retry_after: The delay requested by the service in a Retry-After header, if any.
+        :return: The delay, with "full jitter" so that many clients don't all retry at the same moment.
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+class RetryBudget:
+    """
+    A token bucket that limits retries to a fraction of requests: every first attempt adds `ratio` tokens (up to
+    `burst`), and every retry takes one.
+    """
+
+    def __init__(
+        self, ratio: float = DEFAULT_RETRY_RATIO, burst: int = DEFAULT_RETRY_BURST
+    ):
+        """
+        :param ratio: The number of retries allowed per request in the long run. Default: 0.2.
+        :param burst: The number of retries allowed at once, e.g. when a service first starts failing. Default: 10.
+        """
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = float(burst)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Record a first attempt."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Try to take a token for a retry, returning False if the budget has been used up."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a service after `failure_threshold` consecutive failures. Once `reset_timeout` seconds have
+    passed, a single trial request is allowed through: if it succeeds the circuit is closed again, otherwise it stays
+    open for another `reset_timeout` seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ):
+        """
+        :param failure_threshold: The number of consecutive failures that opens the circuit. Default: 5.
+        :param reset_timeout: How long (in seconds) to fail fast before trying the service again. Default: 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self, service: str = "service"):
+        """Raise a CircuitOpenError if a request should not be made right now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # Let this request through as a trial; any others fail fast until it finishes (or until another
+                # `reset_timeout` seconds have passed, in case its outcome is never recorded).
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+                return
+        raise CircuitOpenError(
+            f"{service} failed {self.failures} times in a row, not sending any requests for now."
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Resilience:
+    """The retry policy, retry budget and circuit breaker used for the requests made by a single service."""
+
+    def __init__(
+        self,
+        retry: RetryPolicy = None,
+        budget: RetryBudget = None,
+        circuit_breaker: CircuitBreaker = None,
+    ):
+        """
+        :param retry: The RetryPolicy to use. Default: RetryPolicy().
+        :param budget: The RetryBudget to use. Default: RetryBudget().
+        :param circuit_breaker: The CircuitBreaker to use. Default: CircuitBreaker().
+        """
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.budget = budget if budget is not None else RetryBudget()
+        self.circuit_breaker = (
+            circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        )
+
+    @classmethod
+    def disabled(cls) -> "Resilience":
+        """Return a Resilience that makes every request exactly once and never fails fast."""
+        resilience = cls(RetryPolicy(retries=0))
+        resilience.budget = None
+        resilience.circuit_breaker = None
+        return resilience
+
+    def before_attempt(self, service: str, attempt: int):
+        """Called before every attempt at a request: raises a CircuitOpenError if it shouldn't be made."""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.allow(service)
+        if attempt == 0 and self.budget is not None:
+            self.budget.deposit()
+
+    def after_attempt(
+        self,
+        attempt: int,
+        status: int | None = None,
+        retry_after: float | None = None,
+        retries: int | None = None,
+    ) -> float | None:
+        """
+        Called after every attempt at a request, to record its outcome and decide whether to retry it.
+
+        :param attempt: The attempt that was made, starting at 0.
+        :param status: The HTTP status code of the response, or None if the request could not connect or timed out.
+        :param retry_after: The delay requested in the Retry-After header of the response, if any.
+        :param retries: The maximum number of retries for this request. Default: the number in the retry policy.
+        :return: The number of seconds to wait before retrying, or None if the request should not be retried.
+        """
+        failed = status is None or status == 429 or status >= 500
+        if self.circuit_breaker is not None:
+            if failed:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+        if status is not None and status not in self.retry.statuses:
+            return None
+        if attempt >= (self.retry.retries if retries is None else retries):
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+        return self.retry.delay(attempt, retry_after)
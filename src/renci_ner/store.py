@@ -0,0 +1,605 @@
+"""
+An on-disk store for querying annotated corpora.
+
+An AnnotationStore is a directory of segments, each of which holds the annotations of up to `segment_size` documents
+(AnnotatedTexts) in memory-mapped columns:
+
+- `rows.bin` has one row of integers for each annotation, in document order: its document, start, end, the codes of
+  its text, ID, label, type and Biolink type in `dictionary.json`, the code of its provenance, whether it is a
+  NormalizedAnnotation (1) or a plain Annotation (0), the offset of its properties in `props.jsonl` (or -1 if it has
+  none) and its based_on history in `histories.bin` (or -1 if it has none).
+- `histories.bin` has one (offset in `histories.jsonl`, previous entry) pair for each distinct based_on history entry
+  in the segment, so each ancestor annotation is only written once per segment however many annotations are based on
+  it. `histories.jsonl` has the fields of each
+  history's last ancestor.
+- `intervals.bin` has one (row, maximum end so far) pair for each annotation, with the annotations of each document
+  sorted by start. This lets us find the annotations that overlap a range of offsets with two binary searches.
+- `documents.bin` has one (offset in `documents.jsonl`, first row, number of rows) triple for each document, and
+  `documents.jsonl` has the text and errors of each document.
+- `postings.bin` is an inverted index from each annotation ID (usually a CURIE) to the documents that mention it: the
+  sorted document numbers for each ID, one ID after the other. `posting_offsets.bin` has the offset of each ID's
+  documents in `postings.bin`, and `posting_ids.dat` has the IDs themselves, in sorted order, with their offsets in
+  `posting_id_offsets.bin`, so that an ID can be found with a binary search.
+- `dictionary.json` has the distinct strings and provenances used in the segment. It is only loaded when an
+  annotation is read from the segment.
+
+Segments are written to a temporary directory and renamed into place, and `store.json` lists the segments and the
+first document in each. Documents are numbered from zero in the order they were added.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import shutil
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from functools import cached_property
+from pathlib import Path
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationHistory,
+    AnnotationProvenance,
+    DictionaryColumn,
+    NormalizedAnnotation,
+)
+
+# The default number of documents in each segment.
+DEFAULT_SEGMENT_SIZE = 10000
+
+# The columns in rows.bin.
+_ROW_FIELDS = (
+    "document",
+    "start",
+    "end",
+    "text",
+    "id",
+    "label",
+    "type",
+    "biolink_type",
+    "provenance",
+    "normalized",
+    "props",
+    "history",
+)
+_ROW_SIZE = len(_ROW_FIELDS)
+_STRING_COLUMNS = ("text", "id", "label", "type", "biolink_type")
+
+
+def _encode_fields(annotation: Annotation, columns: dict) -> list[int]:
+    """
+    Return the dictionary codes of the string fields and provenance of an annotation, followed by 1 if it is a
+    NormalizedAnnotation (even one without a Biolink type) or 0 if it isn't.
+    """
+    return [
+        columns["text"].encode(annotation.text),
+        columns["id"].encode(annotation.id),
+        columns["label"].encode(annotation.label),
+        columns["type"].encode(annotation.type),
+        columns["biolink_type"].encode(getattr(annotation, "biolink_type", None)),
+        columns["provenance"].encode(annotation.provenance),
+        int(isinstance(annotation, NormalizedAnnotation)),
+    ]
+
+
+def _write_integers(path: Path, values: array):
+    with open(path, "wb") as file:
+        values.tofile(file)
+
+
+def _write_sorted_strings(data_path: Path, offsets_path: Path, strings: list[bytes]):
+    """
+    Write sorted byte strings one after the other, with their offsets (followed by the length of the data) as
+    64-bit integers, to be read back with _SortedStrings.
+    """
+    offsets = array("q")
+    with open(data_path, "wb") as file:
+        for string in strings:
+            offsets.append(file.tell())
+            file.write(string)
+        offsets.append(file.tell())
+    _write_integers(offsets_path, offsets)
+
+
+def _write_segment(path: Path, annotated_texts: list[AnnotatedText]):
+    """
+    Write a list of AnnotatedTexts into a new segment directory. The segment is written to a temporary directory
+    first, and renamed into place once it is complete, so a crash never leaves a partially written segment behind.
+    """
+    temporary_path = path.with_name(path.name + ".tmp")
+    # Clean up after a flush that crashed while writing this segment, or after writing it but before it was added to
+    # the manifest.
+    for leftover in (temporary_path, path):
+        if leftover.exists():
+            shutil.rmtree(leftover)
+    temporary_path.mkdir(parents=True)
+
+    columns = {name: DictionaryColumn() for name in (*_STRING_COLUMNS, "provenance")}
+    rows = array("q")
+    intervals = array("q")
+    documents = array("q")
+    histories = array("q")
+    postings = {}
+    # The number of each history entry written so far, keyed by the identity of its ancestor annotation and the number
+    # of the entry before it. Linkers usually build a separate history for each candidate of the same annotation, so
+    # keying by ancestor rather than by history means that each ancestor is only written once. We keep a reference to
+    # each ancestor so that its id() can't be reused while we're writing.
+    history_numbers = {}
+
+    with (
+        open(temporary_path / "documents.jsonl", "wb") as documents_file,
+        open(temporary_path / "props.jsonl", "wb") as props_file,
+        open(temporary_path / "histories.jsonl", "wb") as histories_file,
+    ):
+
+        def write_history(history: AnnotationHistory) -> int:
+            """Write the entries of a history that haven't been written yet, returning the number of its last one."""
+            number = -1
+            for ancestor in history:
+                key = (id(ancestor), number)
+                if key in history_numbers:
+                    number = history_numbers[key][0]
+                    continue
+                histories.extend([histories_file.tell(), number])
+                histories_file.write(
+                    json.dumps(
+                        [
+                            *_encode_fields(ancestor, columns),
+                            ancestor.start,
+                            ancestor.end,
+                            ancestor.props,
+                        ]
+                    ).encode()
+                    + b"\n"
+                )
+                number = len(histories) // 2 - 1
+                history_numbers[key] = (number, ancestor)
+            return number
+
+        for document, annotated_text in enumerate(annotated_texts):
+            first_row = len(rows) // _ROW_SIZE
+            documents.extend(
+                [documents_file.tell(), first_row, len(annotated_text.annotations)]
+            )
+            documents_file.write(
+                json.dumps(
+                    {"text": annotated_text.text, "errors": annotated_text.errors}
+                ).encode()
+                + b"\n"
+            )
+
+            for annotation in annotated_text.annotations:
+                props_offset = -1
+                if annotation.props:
+                    props_offset = props_file.tell()
+                    props_file.write(json.dumps(annotation.props).encode() + b"\n")
+
+                rows.extend(
+                    [
+                        document,
+                        annotation.start,
+                        annotation.end,
+                        *_encode_fields(annotation, columns),
+                        props_offset,
+                        write_history(annotation.based_on),
+                    ]
+                )
+                if annotation.id:
+                    documents_for_id = postings.setdefault(annotation.id, [])
+                    if not documents_for_id or documents_for_id[-1] != document:
+                        documents_for_id.append(document)
+
+            # Sort this document's annotations by start, and record the maximum end so far.
+            count = len(annotated_text.annotations)
+            by_start = sorted(
+                range(first_row, first_row + count),
+                key=lambda row: rows[row * _ROW_SIZE + 1],
+            )
+            max_end = None
+            for row in by_start:
+                end = rows[row * _ROW_SIZE + 2]
+                max_end = end if max_end is None else max(max_end, end)
+                intervals.extend([row, max_end])
+
+    _write_integers(temporary_path / "rows.bin", rows)
+    _write_integers(temporary_path / "intervals.bin", intervals)
+    _write_integers(temporary_path / "documents.bin", documents)
+    _write_integers(temporary_path / "histories.bin", histories)
+
+    # Write the inverted index, sorted by the UTF-8 encoding of each ID so that it can be binary-searched.
+    posting_ids = sorted(postings, key=str.encode)
+    posting_documents = array("q")
+    posting_offsets = array("q")
+    for posting_id in posting_ids:
+        posting_offsets.append(len(posting_documents))
+        posting_documents.extend(postings[posting_id])
+    posting_offsets.append(len(posting_documents))
+    _write_integers(temporary_path / "postings.bin", posting_documents)
+    _write_integers(temporary_path / "posting_offsets.bin", posting_offsets)
+    _write_sorted_strings(
+        temporary_path / "posting_ids.dat",
+        temporary_path / "posting_id_offsets.bin",
+        [posting_id.encode() for posting_id in posting_ids],
+    )
+
+    with open(temporary_path / "dictionary.json", "w") as file:
+        json.dump(
+            {
+                **{name: columns[name].values for name in _STRING_COLUMNS},
+                "provenances": [
+                    [provenance.name, provenance.url, provenance.version]
+                    for provenance in columns["provenance"].values
+                ],
+            },
+            file,
+        )
+
+    os.replace(temporary_path, path)
+
+
+class _Mapped:
+    """A read-only memory-mapped file. For .bin files, `integers` views the file as an array of 64-bit integers."""
+
+    def __init__(self, path: Path):
+        self.mmap = None
+        self.integers = array("q")
+        if path.stat().st_size > 0:
+            with open(path, "rb") as file:
+                self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if path.suffix == ".bin":
+                self.integers = memoryview(self.mmap).cast("q")
+
+    def line(self, offset: int) -> bytes:
+        """Return the line starting at a byte offset."""
+        end = self.mmap.find(b"\n", offset)
+        return self.mmap[offset:end]
+
+    def close(self):
+        if self.mmap is not None:
+            if isinstance(self.integers, memoryview):
+                self.integers.release()
+            self.mmap.close()
+            self.mmap = None
+
+
+class _SortedStrings(Sequence):
+    """Byte strings written by _write_sorted_strings(), as a sequence that can be binary-searched with bisect."""
+
+    def __init__(self, data: _Mapped, offsets: _Mapped):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return max(0, len(self.offsets.integers) - 1)
+
+    def __getitem__(self, index: int) -> bytes:
+        offsets = self.offsets.integers
+        return self.data.mmap[offsets[index] : offsets[index + 1]]
+
+    def index_of(self, string: bytes) -> int:
+        """Return the index of a string, or -1 if it isn't present."""
+        index = bisect.bisect_left(self, string)
+        return index if index < len(self) and self[index] == string else -1
+
+
+class _Segment:
+    """A read-only view of a segment written by _write_segment()."""
+
+    def __init__(self, path: Path, first_document: int):
+        self.path = path
+        self.first_document = first_document
+        self.rows = _Mapped(path / "rows.bin")
+        self.intervals = _Mapped(path / "intervals.bin")
+        self.documents = _Mapped(path / "documents.bin")
+        self.documents_text = _Mapped(path / "documents.jsonl")
+        self.props = _Mapped(path / "props.jsonl")
+        self.histories = _Mapped(path / "histories.bin")
+        self.histories_text = _Mapped(path / "histories.jsonl")
+        self.postings = _Mapped(path / "postings.bin")
+        self.posting_offsets = _Mapped(path / "posting_offsets.bin")
+        self.posting_id_data = _Mapped(path / "posting_ids.dat")
+        self.posting_id_offsets = _Mapped(path / "posting_id_offsets.bin")
+        self.posting_ids = _SortedStrings(self.posting_id_data, self.posting_id_offsets)
+
+    def __len__(self) -> int:
+        return len(self.documents.integers) // 3
+
+    def close(self):
+        for mapped in (
+            self.rows,
+            self.intervals,
+            self.documents,
+            self.documents_text,
+            self.props,
+            self.histories,
+            self.histories_text,
+            self.postings,
+            self.posting_offsets,
+            self.posting_id_data,
+            self.posting_id_offsets,
+        ):
+            mapped.close()
+
+    @cached_property
+    def dictionary(self) -> dict:
+        """The strings and provenances used in this segment, loaded the first time an annotation is read."""
+        with open(self.path / "dictionary.json") as file:
+            dictionary = json.load(file)
+        dictionary["provenances"] = [
+            AnnotationProvenance.shared(*provenance)
+            for provenance in dictionary["provenances"]
+        ]
+        return dictionary
+
+    def _string(self, column: str, code: int):
+        return None if code < 0 else self.dictionary[column][code]
+
+    def _annotation(self, fields: list, start: int, end: int, props: dict, based_on):
+        text, id, label, type, biolink_type, provenance, normalized = fields
+        values = {
+            "text": self._string("text", text),
+            "id": self._string("id", id),
+            "label": self._string("label", label),
+            "type": self._string("type", type),
+            "start": start,
+            "end": end,
+            "provenance": self.dictionary["provenances"][provenance],
+            "based_on": based_on,
+            "props": props,
+        }
+        if normalized:
+            return NormalizedAnnotation(
+                biolink_type=self._string("biolink_type", biolink_type), **values
+            )
+        return Annotation(**values)
+
+    def history(self, number: int) -> AnnotationHistory:
+        """Return a based_on history written by _write_segment()."""
+        numbers = []
+        while number >= 0:
+            numbers.append(number)
+            number = self.histories.integers[number * 2 + 1]
+
+        history = AnnotationHistory.EMPTY
+        for number in reversed(numbers):
+            *fields, start, end, props = json.loads(
+                self.histories_text.line(self.histories.integers[number * 2])
+            )
+            history = history.extended_with(
+                self._annotation(fields, start, end, props, history)
+            )
+        return history
+
+    def annotation(self, row: int) -> Annotation:
+        """Return the annotation in a row, loading its properties and history if it has any."""
+        fields = self.rows.integers[row * _ROW_SIZE : (row + 1) * _ROW_SIZE].tolist()
+        props = json.loads(self.props.line(fields[10])) if fields[10] >= 0 else {}
+        return self._annotation(
+            fields[3:10], fields[1], fields[2], props, self.history(fields[11])
+        )
+
+    def documents_mentioning(self, id: str) -> list[int]:
+        """Return the documents (numbered within this segment) that mention an ID, in order."""
+        index = self.posting_ids.index_of(id.encode())
+        if index < 0:
+            return []
+        offsets = self.posting_offsets.integers
+        return self.postings.integers[offsets[index] : offsets[index + 1]].tolist()
+
+    def document_rows(self, document: int) -> range:
+        """Return the rows of the annotations in a document (numbered within this segment)."""
+        first_row, count = self.documents.integers[
+            document * 3 + 1 : document * 3 + 3
+        ].tolist()
+        return range(first_row, first_row + count)
+
+    def document(self, document: int) -> AnnotatedText:
+        """Return a document (numbered within this segment) as an AnnotatedText."""
+        offset = self.documents.integers[document * 3]
+        record = json.loads(self.documents_text.line(offset))
+        return AnnotatedText(
+            record["text"],
+            [self.annotation(row) for row in self.document_rows(document)],
+            record["errors"],
+        )
+
+    def overlapping_rows(self, document: int, start: int, end: int) -> list[int]:
+        """Return the rows of the annotations in a document that overlap the offsets [start, end)."""
+        rows = self.document_rows(document)
+        intervals = self.intervals.integers
+
+        def interval_start(index):
+            return self.rows.integers[intervals[index * 2] * _ROW_SIZE + 1]
+
+        def interval_max_end(index):
+            return intervals[index * 2 + 1]
+
+        # Of this document's annotations sorted by start, we want those that start before `end`, from the first one
+        # that (or an earlier one that) ends after `start`.
+        indexes = range(rows.start, rows.stop)
+        upper = bisect.bisect_left(indexes, end, key=interval_start)
+        lower = bisect.bisect_right(indexes, start, hi=upper, key=interval_max_end)
+
+        return sorted(
+            intervals[index * 2]
+            for index in indexes[lower:upper]
+            if self.rows.integers[intervals[index * 2] * _ROW_SIZE + 2] > start
+        )
+
+
+class AnnotationStore:
+    """
+    An on-disk store of AnnotatedTexts that can find the documents that mention an ID (usually a CURIE) and the
+    annotations in a range of offsets in a document, without loading whole documents.
+
+    Documents are added with `add()` or `add_all()`, and written to disk as a new segment every `segment_size`
+    documents or when the store is flushed or closed. Documents that haven't been written yet can be queried too,
+    from memory. The store can be used as a context manager, which closes it on exit.
+    """
+
+    def __init__(self, path, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        """
+        Open an AnnotationStore, creating it if necessary.
+
+        :param path: The directory to store annotations in.
+        :param segment_size: The maximum number of documents in each segment. Default: 10,000.
+        """
+        self.path = Path(path)
+        self.segment_size = segment_size
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.segments = []
+        self._pending = []
+        # The pending documents that mention each ID, so that they can be queried before they are flushed.
+        self._pending_postings = {}
+        manifest_path = self.path / "store.json"
+        if manifest_path.exists():
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            for segment in manifest["segments"]:
+                self.segments.append(
+                    _Segment(self.path / segment["name"], segment["first_document"])
+                )
+
+    def __len__(self) -> int:
+        """The number of documents in this store, including any that haven't been flushed."""
+        return self._flushed_documents() + len(self._pending)
+
+    def _flushed_documents(self) -> int:
+        if not self.segments:
+            return 0
+        return self.segments[-1].first_document + len(self.segments[-1])
+
+    def add(self, annotated_text: AnnotatedText) -> int:
+        """
+        Add an AnnotatedText to this store.
+
+        :param annotated_text: The AnnotatedText to add.
+        :return: The number of the new document.
+        """
+        self._pending.append(annotated_text)
+        document = len(self) - 1
+        for annotation in annotated_text.annotations:
+            if annotation.id:
+                documents = self._pending_postings.setdefault(annotation.id, [])
+                if not documents or documents[-1] != document:
+                    documents.append(document)
+        if len(self._pending) >= self.segment_size:
+            self.flush()
+        return document
+
+    def add_all(self, annotated_texts: Iterable[AnnotatedText]):
+        """Add every AnnotatedText in an iterable to this store, one at a time."""
+        for annotated_text in annotated_texts:
+            self.add(annotated_text)
+
+    def flush(self):
+        """Write any documents that have been added since the last flush as a new segment."""
+        if not self._pending:
+            return
+
+        first_document = self._flushed_documents()
+        name = f"segment-{len(self.segments):06d}"
+        _write_segment(self.path / name, self._pending)
+        self.segments.append(_Segment(self.path / name, first_document))
+        self._pending = []
+        self._pending_postings = {}
+
+        # Write the manifest atomically, so that readers never see a partially written one.
+        manifest = {
+            "segments": [
+                {"name": segment.path.name, "first_document": segment.first_document}
+                for segment in self.segments
+            ]
+        }
+        temporary_path = self.path / "store.json.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, self.path / "store.json")
+
+    def close(self):
+        """Flush any pending documents and close the memory-mapped files."""
+        self.flush()
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _locate(self, document: int) -> tuple[_Segment, int]:
+        """
+        Return the segment containing a document and its number within that segment, or None and the pending
+        AnnotatedText if it hasn't been flushed yet.
+        """
+        flushed = self._flushed_documents()
+        if not 0 <= document < flushed + len(self._pending):
+            raise IndexError(f"Document {document} is not in this AnnotationStore.")
+        if document >= flushed:
+            return None, self._pending[document - flushed]
+        index = (
+            bisect.bisect_right(
+                self.segments, document, key=lambda segment: segment.first_document
+            )
+            - 1
+        )
+        segment = self.segments[index]
+        return segment, document - segment.first_document
+
+    def document(self, document: int) -> AnnotatedText:
+        """Return a document as an AnnotatedText, with all its annotations."""
+        segment, local_document = self._locate(document)
+        if segment is None:
+            return local_document
+        return segment.document(local_document)
+
+    __getitem__ = document
+
+    def __iter__(self) -> Iterator[AnnotatedText]:
+        """Iterate over every document in this store, in the order they were added."""
+        for segment in list(self.segments):
+            for local_document in range(len(segment)):
+                yield segment.document(local_document)
+        yield from list(self._pending)
+
+    def documents_mentioning(self, id: str) -> list[int]:
+        """
+        Return the documents with at least one annotation with a particular ID (usually a CURIE).
+
+        :param id: The ID to look for.
+        :return: A sorted list of document numbers.
+        """
+        return [
+            segment.first_document + local_document
+            for segment in self.segments
+            for local_document in segment.documents_mentioning(id)
+        ] + self._pending_postings.get(id, [])
+
+    def annotations_between(
+        self, document: int, start: int, end: int
+    ) -> list[Annotation]:
+        """
+        Return the annotations in a document that overlap the offsets from `start` to `end` (exclusive), in the
+        order they were added, without loading the rest of the document.
+
+        :param document: The document number.
+        :param start: The first offset in the range.
+        :param end: The offset after the end of the range.
+        :return: A list of Annotations (or NormalizedAnnotations).
+        """
+        segment, local_document = self._locate(document)
+        if segment is None:
+            return [
+                annotation
+                for annotation in local_document.annotations
+                if annotation.start < end and annotation.end > start
+            ]
+        return [
+            segment.annotation(row)
+            for row in segment.overlapping_rows(local_document, start, end)
+        ]
@@ -0,0 +1,277 @@
+"""
+A local stand-in for the RENCI NER services, for testing and benchmarking without the real services.
+
+FakeServer runs a small HTTP server that emulates the endpoints used by this library:
+
+- `GET /openapi.json`, which returns the configured version.
+- `POST /annotate/`, which behaves like BioMegatron (annotating every word in the text) unless the request asks for
+  the `sapbert` model, in which case it behaves like SAPBERT (returning `count` results for the text).
+- `GET /lookup` and `POST /bulk-lookup`, which behave like NameRes, returning `limit` results for each text.
+- `POST /get_normalized_nodes`, which behaves like NodeNorm, normalizing each CURIE to a `NORM:` CURIE.
+
+Results are made up, but deterministic: the same text always gets the same CURIEs. Every request can be delayed by
+`latency` seconds, and the size of the responses can be changed with `synonyms_per_result` and
+`equivalent_identifiers`. Point every service at the same server:
+
+    with FakeServer(latency=0.01) as server:
+        biomegatron = BioMegatron(url=server.url)
+        nameres = NameRes(url=server.url)
+
+It can also be run on its own, e.g. for benchmarking from another process:
+
+    $ python -m renci_ner.testing --port 8080 --latency 0.01
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Every word annotated by the fake BioMegatron.
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _fake_curie(prefix: str, text: str, index: int = 0) -> str:
+    """Return a deterministic made-up CURIE for a text."""
+    return f"{prefix}:{zlib.crc32(text.encode())}{index or ''}"
+
+
+class FakeServer:
+    """
+    A local HTTP server that emulates the BioMegatron, SAPBERT, NameRes and NodeNorm endpoints. Can be used as a
+    context manager, which starts the server on entry and stops it on exit.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        version: str = "1.0.0",
+        synonyms_per_result: int = 5,
+        equivalent_identifiers: int = 5,
+    ):
+        """
+        Set up a FakeServer.
+
+        :param host: The host to listen on. Default: 127.0.0.1.
+        :param port: The port to listen on. Default: 0 (pick a free port).
+        :param latency: The number of seconds to wait before answering each request. Default: 0.
+        :param version: The version to report in `/openapi.json`. Default: 1.0.0.
+        :param synonyms_per_result: The number of synonyms in each NameRes result. Default: 5.
+        :param equivalent_identifiers: The number of equivalent identifiers in each NodeNorm result. Default: 5.
+        """
+        self.latency = latency
+        self.version = version
+        self.synonyms_per_result = synonyms_per_result
+        self.equivalent_identifiers = equivalent_identifiers
+
+        # The number of requests received for each path.
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        fake_server = self
+
+        class Handler(_FakeServiceHandler):
+            server_config = fake_server
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """The base URL of this server, to be passed to each service."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start answering requests in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count(self, path: str):
+        with self._lock:
+            self.request_counts[path] += 1
+
+    def biomegatron(self, request: dict) -> dict:
+        """Annotate every word in the text, like BioMegatron would."""
+        text = request.get("text", "")
+        return {
+            "text": text,
+            "denotations": [
+                {
+                    "id": _fake_curie("FAKE", match.group()),
+                    "obj": "biolink:NamedThing",
+                    "span": {"begin": match.start(), "end": match.end()},
+                    "text": match.group(),
+                }
+                for match in WORD_PATTERN.finditer(text)
+            ],
+        }
+
+    def sapbert(self, request: dict) -> list:
+        """Return `count` results for the text, like SAPBERT would."""
+        text = request.get("text", "")
+        return [
+            {
+                "name": text,
+                "curie": _fake_curie("FAKE", text, index),
+                "category": "biolink:NamedThing",
+                "score": 1.0 / (index + 1),
+            }
+            for index in range(int(request.get("count", 10)))
+        ]
+
+    def nameres(self, text: str, limit: int) -> list:
+        """Return `limit` results for a text, like NameRes would."""
+        return [
+            {
+                "curie": _fake_curie("FAKE", text, index),
+                "label": text,
+                "types": ["biolink:NamedThing"],
+                "score": 100.0 / (index + 1),
+                "clique_identifier_count": 1,
+                "synonyms": [
+                    f"{text} {synonym}" for synonym in range(self.synonyms_per_result)
+                ],
+                "highlighting": {},
+                "taxa": [],
+            }
+            for index in range(limit)
+        ]
+
+    def nodenorm(self, request: dict) -> dict:
+        """Normalize every CURIE, like NodeNorm would."""
+        return {
+            curie: {
+                "id": {"identifier": "NORM:" + curie.split(":", 1)[-1], "label": curie},
+                "equivalent_identifiers": [
+                    {"identifier": f"EQUIV{index}:{curie}"}
+                    for index in range(self.equivalent_identifiers)
+                ],
+                "type": ["biolink:NamedThing", "biolink:Entity"],
+            }
+            for curie in request.get("curies", [])
+        }
+
+
+class _FakeServiceHandler(BaseHTTPRequestHandler):
+    """Answers requests for a FakeServer (set as `server_config` on a subclass)."""
+
+    # Keep connections alive, as the real services do, and don't let Nagle's algorithm delay our responses (which
+    # are written as headers and then a body).
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server_config: FakeServer = None
+
+    def _respond(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start(self) -> str:
+        config = self.server_config
+        path = urlsplit(self.path).path
+        config._count(path)
+        if config.latency > 0:
+            time.sleep(config.latency)
+        return path
+
+    def do_GET(self):
+        path = self._start()
+        config = self.server_config
+        if path == "/openapi.json":
+            self._respond(200, {"info": {"version": config.version}})
+        elif path == "/lookup":
+            query = parse_qs(urlsplit(self.path).query)
+            self._respond(
+                200,
+                config.nameres(
+                    query.get("string", [""])[0], int(query.get("limit", [10])[0])
+                ),
+            )
+        else:
+            self._respond(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        path = self._start()
+        config = self.server_config
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if path == "/annotate/":
+            if request.get("model_name") == "sapbert":
+                self._respond(200, config.sapbert(request))
+            else:
+                self._respond(200, config.biomegatron(request))
+        elif path == "/bulk-lookup":
+            limit = int(request.get("limit", 10))
+            self._respond(
+                200,
+                {
+                    string: config.nameres(string, limit)
+                    for string in request.get("strings", [])
+                },
+            )
+        elif path == "/get_normalized_nodes":
+            self._respond(200, config.nodenorm(request))
+        else:
+            self._respond(404, {"detail": "Not Found"})
+
+    def log_message(self, format, *args):
+        """Don't log every request."""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to wait per request."
+    )
+    parser.add_argument("--synonyms-per-result", type=int, default=5)
+    parser.add_argument("--equivalent-identifiers", type=int, default=5)
+    args = parser.parse_args()
+
+    server = FakeServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        synonyms_per_result=args.synonyms_per_result,
+        equivalent_identifiers=args.equivalent_identifiers,
+    )
+    print(f"Serving fake RENCI NER services at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,25 @@
+import re
+
 import pytest
+from conftest import FakeResponse
 from requests import HTTPError
 
 from renci_ner.core import AnnotationProvenance
-from renci_ner.services.ner.biomegatron import BioMegatron
+from renci_ner.services.ner.biomegatron import (
+    BioMegatron,
+    _merge_chunk_results,
+)
+from renci_ner.testing import FakeServer
 
 
 def test_check():
     """
     Basic functionality checking for BioMegatron.
     """
+    biomegatron = BioMegatron()
     try:
-        biomegatron = BioMegatron()
+        # The OpenAPI version is looked up lazily, so this is the first request we make to BioMegatron.
+        assert biomegatron.openapi_version
     except HTTPError as err:
         pytest.skip(f"BioMegatron is not available: {err}")
         return
@@ -36,3 +45,118 @@ def test_check():
     assert nervous_system.provenances[0] == AnnotationProvenance(
         name="BioMegatron", version="0.1.0", url="https://med-nemo.apps.renci.org"
     )
+
+
+def fake_annotate(kwargs):
+    """A fake BioMegatron annotate endpoint, which annotates every word in the text (and fails on "fail")."""
+    text = kwargs["json"]["text"]
+    if text == "fail":
+        return FakeResponse({"detail": "Internal Server Error"}, status_code=500)
+    return {
+        "denotations": [
+            {
+                "text": match.group(),
+                "span": {"begin": match.start(), "end": match.end()},
+                "id": f"TEST:{match.group()}",
+                "obj": "biolink:AnatomicalEntity",
+            }
+            for match in re.finditer(r"\w+", text)
+        ]
+    }
+
+
+def test_annotate_columnar(fake_session):
+    """Check that BioMegatron.annotate_columnar() returns the same annotations as annotate_batch()."""
+    session = fake_session({("POST", "/annotate/"): fake_annotate})
+    biomegatron = BioMegatron(url="http://biomegatron.test", requests_session=session)
+    texts = ["brain heart", "fail", "lung"]
+    props = {"max_workers": 2, "collect_errors": True}
+
+    batch = biomegatron.annotate_columnar(texts, props)
+    assert list(batch.documents) == [0, 0, 2]
+    assert list(batch.annotation_texts) == ["brain", "heart", "lung"]
+    assert list(batch.ends) == [5, 11, 4]
+    assert list(batch.errors) == [1]
+    assert batch.to_annotated_texts() == biomegatron.annotate_batch(texts, props)
+
+
+def test_chunking(fake_session):
+    """Check that chunked long texts are annotated in the same way as unchunked texts."""
+    session = fake_session({("POST", "/annotate/"): fake_annotate})
+    biomegatron = BioMegatron(url="http://biomegatron.test", requests_session=session)
+    text = (
+        " ".join(
+            f"Sentence {index} mentions the brain and the heart." for index in range(20)
+        )
+        + "\n\nA second paragraph mentions the lung."
+    )
+
+    unchunked = biomegatron.annotate(text)
+    session.calls.clear()
+    chunked = biomegatron.annotate(
+        text, {"chunk_size": 120, "chunk_overlap": 30, "max_workers": 4}
+    )
+    assert len(session.calls) > 1
+    assert all(len(call[2]["json"]["text"]) <= 120 for call in session.calls)
+    assert chunked == unchunked
+
+    # Annotations at the edges of chunks that don't overlap are kept.
+    session.calls.clear()
+    assert (
+        biomegatron.annotate(text, {"chunk_size": 120, "chunk_overlap": 0}) == unchunked
+    )
+    assert len(session.calls) > 1
+
+    # The default overlap is reduced for small chunks, but an overlap of half a chunk or more is rejected.
+    assert biomegatron.annotate(text, {"chunk_size": 120}) == unchunked
+    for overlap in [60, 119, -1]:
+        with pytest.raises(ValueError):
+            biomegatron.annotate(text, {"chunk_size": 120, "chunk_overlap": overlap})
+
+    # Short texts aren't chunked at all.
+    session.calls.clear()
+    short = "The brain."
+    assert biomegatron.annotate(short, {"chunk_size": 120}) == biomegatron.annotate(
+        short
+    )
+    assert len(session.calls) == 2
+
+
+def test_merge_chunk_results():
+    """Check that words cut off at the edge of a chunk are only dropped when the neighbouring chunk covers them."""
+    text = "brain heart"
+
+    def result(chunk_start, chunk_end):
+        return fake_annotate({"json": {"text": text[chunk_start:chunk_end]}})
+
+    def merged(spans):
+        results = [result(start, end) for start, end in spans]
+        return [
+            text[denotation["span"]["begin"] : denotation["span"]["end"]]
+            for denotation in _merge_chunk_results(text, spans, results)["denotations"]
+        ]
+
+    # "brain he" and "n heart": "he" and "n" are cut off, but the other chunk found "heart" and "brain".
+    assert merged([(0, 8), (4, 11)]) == ["brain", "heart"]
+    # Chunks that don't overlap don't drop anything at their edges.
+    assert merged([(0, 6), (6, 11)]) == ["brain", "heart"]
+    assert merged([(0, 8), (8, 11)]) == ["brain", "he", "art"]
+    # A word at the edge of both chunks is only included once.
+    assert merged([(0, 11), (6, 11)]) == ["brain", "heart"]
+
+
+def test_annotate_many():
+    """Check that annotate_many() packs texts into fewer requests and splits the results back up."""
+    texts = [f"Abstract {index} mentions the brain." for index in range(50)] + [""]
+    with FakeServer() as server:
+        biomegatron = BioMegatron(url=server.url)
+        results = biomegatron.annotate_many(texts, {"pack_size": 200, "max_workers": 4})
+        assert server.request_counts["/annotate/"] < 15
+        assert [result.text for result in results] == texts
+
+        server.request_counts.clear()
+        assert results == [biomegatron.annotate(text) for text in texts]
+        assert server.request_counts["/annotate/"] == len(texts)
+
+    assert results[7].annotations[1].text == "7"
+    assert results[7].annotations[1].start == 9
@@ -0,0 +1,201 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from renci_ner.cache import (
+    MISSING,
+    LRUCache,
+    SingleFlight,
+    SQLiteCache,
+    TieredCache,
+    make_key,
+)
+from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
+from renci_ner.services.linkers.nameres import NameRes
+
+
+def test_lru_cache():
+    """Check that the LRU cache evicts the least recently used values and counts hits and misses."""
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", None)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+
+    expired = LRUCache(ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is MISSING
+
+
+def test_sqlite_cache(tmp_path):
+    """Check that the SQLite cache persists values between instances."""
+    path = tmp_path / "cache.sqlite3"
+    key = make_key("NameRes", "brain", {"limit": 1})
+
+    cache = SQLiteCache(path)
+    assert cache.get(key) is MISSING
+    cache.set(key, [{"curie": "UBERON:0000955"}])
+    cache.close()
+
+    cache = SQLiteCache(path)
+    assert cache.get(key) == [{"curie": "UBERON:0000955"}]
+    assert len(cache) == 1
+    assert SQLiteCache(path, ttl=-1).get(key) is MISSING
+
+
+def test_nameres_cache(fake_session):
+    """Check that NameRes only looks up texts that aren't already cached."""
+
+    def lookup(kwargs):
+        string = kwargs["params"]["string"]
+        return [{"curie": f"TEST:{string}", "types": ["biolink:NamedThing"]}]
+
+    def bulk_lookup(kwargs):
+        return {
+            string: lookup({"params": {"string": string}})
+            for string in kwargs["json"]["strings"]
+        }
+
+    session = fake_session(
+        {("GET", "/lookup"): lookup, ("POST", "/bulk-lookup"): bulk_lookup}
+    )
+    cache = LRUCache()
+    nameres = NameRes(url="http://nameres.test", requests_session=session, cache=cache)
+
+    first = nameres.annotate("brain", {"limit": 1}).annotations[0]
+    assert first.id == "TEST:brain"
+    # Changing the properties of an annotation doesn't change the cached result.
+    first.props["types"].append("biolink:Cell")
+    second = nameres.annotate("brain", {"limit": 1}).annotations[0]
+    assert second.id == "TEST:brain"
+    assert second.props["types"] == ["biolink:NamedThing"]
+    nameres.annotate("brain", {"limit": 2})
+    lookups = [call for call in session.calls if call[1].endswith("/lookup")]
+    assert len(lookups) == 2
+
+    results = nameres.annotate_batch(["brain", "heart"], {"limit": 1})
+    assert [result.annotations[0].id for result in results] == [
+        "TEST:brain",
+        "TEST:heart",
+    ]
+    bulk_lookups = [call for call in session.calls if call[1].endswith("/bulk-lookup")]
+    assert [call[2]["json"]["strings"] for call in bulk_lookups] == [["heart"]]
+    assert cache.stats.hits == 2
+
+
+def test_tiered_cache(tmp_path):
+    """Check that a tiered cache copies values from slower caches into faster ones."""
+    memory = LRUCache()
+    disk = SQLiteCache(tmp_path / "cache.sqlite3")
+    disk.set("a", 1)
+
+    cache = TieredCache(memory, disk)
+    assert cache.get("a") == 1
+    assert memory.get("a") == 1
+    cache.set("b", 2)
+    assert disk.get("b") == 2
+    assert cache.get("c") is MISSING
+
+
+def test_single_flight():
+    """Check that concurrent calls for the same key share a single call, including its exception."""
+    in_flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def lookup(key):
+        def function():
+            calls.append(key)
+            release.wait(5)
+            if key == "bad":
+                raise ValueError(key)
+            return [key]
+
+        return in_flight.do(key, function)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [
+            executor.submit(lookup, key) for key in ["a", "a", "a", "bad", "bad", "b"]
+        ]
+        deadline = time.monotonic() + 5
+        while in_flight.coalesced < 3 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+
+        assert [future.result() for future in futures[:3]] == [["a"]] * 3
+        for future in futures[3:5]:
+            with pytest.raises(ValueError):
+                future.result()
+        assert futures[5].result() == ["b"]
+
+    assert sorted(calls) == ["a", "b", "bad"]
+    assert in_flight.coalesced == 3
+
+    # Nothing is kept once a call has finished.
+    assert in_flight.do("a", lambda: "again") == "again"
+
+    # Bulk lookups claim the keys that nobody else is looking up, and wait for the rest.
+    assert in_flight.claim(["x", "y", "x"]) == (["x", "y"], {})
+    claimed, waiting = in_flight.claim(["y", "z"])
+    assert claimed == ["z"]
+    in_flight.finish("y", [1])
+    in_flight.finish("x", error=ValueError("x"))
+    in_flight.finish("z", [2])
+    assert waiting["y"].wait() == [1]
+    assert in_flight.coalesced == 4
+
+
+@pytest.mark.parametrize("linker", [NameRes, BabelSAPBERTAnnotator])
+def test_linkers_coalesce_lookups(fake_session, linker):
+    """Check that NameRes and SAPBERT share concurrent lookups of the same text, but not their annotations."""
+    threads = 8
+    holder = {}
+
+    def lookup(kwargs):
+        # Wait until every other thread is waiting for this lookup.
+        deadline = time.monotonic() + 5
+        while holder["linker"].in_flight.coalesced < threads - 1:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.001)
+        return [
+            {
+                "curie": "TEST:1",
+                "name": "brain",
+                "label": "brain",
+                "category": "biolink:Cell",
+                "types": ["biolink:Cell"],
+                "score": 10.0,
+            }
+        ]
+
+    session = fake_session({("GET", "/lookup"): lookup, ("POST", "/annotate/"): lookup})
+    holder["linker"] = linker(url="http://linker.test", requests_session=session)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(
+            executor.map(lambda _: holder["linker"].annotate("brain"), range(threads))
+        )
+
+    assert (
+        len(
+            [
+                call
+                for call in session.calls
+                if call[1].endswith(("/lookup", "/annotate/"))
+            ]
+        )
+        == 1
+    )
+    annotations = [result.annotations[0] for result in results]
+    assert all(annotation.id == "TEST:1" for annotation in annotations)
+    assert len({id(annotation) for annotation in annotations}) == threads
+    assert len({id(annotation.props) for annotation in annotations}) == threads
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+
+class FakeResponse:
+    """A minimal stand-in for requests.Response."""
+
+    def __init__(self, data, status_code=200, headers=None):
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(data)
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            from requests import HTTPError
+
+            raise HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeSession:
+    """
+    A minimal stand-in for requests.Session that answers requests from a dictionary of handlers, keyed by
+    (method, path). Every request is recorded in `calls`.
+    """
+
+    def __init__(self, handlers: dict | None = None, version="1.2.3"):
+        self.handlers = {
+            ("GET", "/openapi.json"): lambda kwargs: {"info": {"version": version}},
+            **(handlers or {}),
+        }
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        for (handler_method, path), handler in self.handlers.items():
+            if method == handler_method and url.endswith(path):
+                result = handler(kwargs)
+                if isinstance(result, FakeResponse):
+                    return result
+                return FakeResponse(result)
+        return FakeResponse({"detail": "Not Found"}, status_code=404)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+@pytest.fixture
+def fake_session():
+    """Returns a factory for FakeSession objects."""
+    return FakeSession
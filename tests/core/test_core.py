@@ -1,6 +1,21 @@
+import asyncio
+import dataclasses
+import pickle
+import time
+
 import pytest
 
-from renci_ner.core import AnnotationProvenance, NormalizedAnnotation
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationBatch,
+    AnnotationHistory,
+    AnnotationProvenance,
+    Annotator,
+    AsyncAnnotator,
+    NormalizedAnnotation,
+    Pipeline,
+)
 
 
 def test_normalized_annotations_biolink_type():
@@ -33,3 +48,387 @@ def test_normalized_annotations_biolink_type():
     )
     with pytest.raises(ValueError):
         normalized_annotation.biolink_type = "AnatomicalEntity"
+
+
+class CountingAnnotator(Annotator):
+    """An annotator that annotates every text as a single entity, and records the texts it was asked about."""
+
+    def __init__(self):
+        self.texts = []
+
+    def annotate(self, text, props=None):
+        self.texts.append(text)
+        return AnnotatedText(
+            text,
+            [
+                NormalizedAnnotation(
+                    text=text,
+                    id=f"TEST:{text}",
+                    label=text,
+                    type="biolink:NamedThing",
+                    biolink_type="biolink:NamedThing",
+                    start=0,
+                    end=len(text),
+                    provenance=self.provenance,
+                )
+            ],
+        )
+
+
+def test_reannotate_deduplicates_texts():
+    """
+    Check that reannotate() only annotates each distinct text once, and fixes up the offsets and based_on of each
+    resulting annotation separately.
+    """
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    text = "brain and brain and heart"
+    annotations = [
+        Annotation("brain", "I1-", "", "biolink:AnatomicalEntity", 0, 5, provenance),
+        Annotation("brain", "I2-", "", "biolink:AnatomicalEntity", 10, 15, provenance),
+        Annotation("heart", "I3-", "", "biolink:AnatomicalEntity", 20, 25, provenance),
+    ]
+
+    annotator = CountingAnnotator()
+    result = AnnotatedText(text, annotations).reannotate(annotator)
+
+    assert annotator.texts == ["brain", "heart"]
+    assert [(a.id, a.start, a.end) for a in result.annotations] == [
+        ("TEST:brain", 0, 5),
+        ("TEST:brain", 10, 15),
+        ("TEST:heart", 20, 25),
+    ]
+    for annotation, original in zip(result.annotations, annotations):
+        assert text[annotation.start : annotation.end] == annotation.text
+        assert annotation.based_on == (original,)
+        assert annotation.provenances == [provenance, annotator.provenance]
+    assert result.annotations[0] is not result.annotations[1]
+
+
+class FlakyAnnotator(CountingAnnotator):
+    """An annotator that fails to annotate the text 'heart'."""
+
+    def annotate(self, text, props=None):
+        if text == "heart":
+            raise RuntimeError("heart is unavailable")
+        return super().annotate(text, props)
+
+
+def test_reannotate_concurrently():
+    """
+    Check that reannotate() with max_workers keeps the annotations in order and, with collect_errors, records
+    per-annotation failures without losing the rest of the document.
+    """
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    words = ["brain", "heart", "liver", "lung", "skin", "bone"]
+    text = " ".join(words)
+    annotations = []
+    for word in words:
+        start = text.index(word)
+        annotations.append(
+            Annotation(word, "", "", "", start, start + len(word), provenance)
+        )
+
+    annotator = FlakyAnnotator()
+    result = AnnotatedText(text, annotations).reannotate(
+        annotator, max_workers=4, collect_errors=True
+    )
+
+    assert sorted(annotator.texts) == sorted(set(words) - {"heart"})
+    assert [a.text for a in result.annotations] == words
+    assert result.annotations[1] is annotations[1]
+    assert [a.id for a in result.annotations if a is not annotations[1]] == [
+        f"TEST:{word}" for word in words if word != "heart"
+    ]
+    assert len(result.errors) == 1
+    assert "heart is unavailable" in result.errors[0]
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_reannotate_errors(max_workers):
+    """Check that reannotate() handles failures in the same way whether or not the calls are concurrent."""
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    annotations = [
+        Annotation("brain", "", "", "", 0, 5, provenance),
+        Annotation("heart", "", "", "", 6, 11, provenance),
+        Annotation("liver", "", "", "", 12, 17, provenance),
+    ]
+    annotated = AnnotatedText("brain heart liver", annotations)
+
+    with pytest.raises(RuntimeError, match="heart is unavailable"):
+        annotated.reannotate(FlakyAnnotator(), max_workers=max_workers)
+
+    result = annotated.reannotate(
+        FlakyAnnotator(), max_workers=max_workers, collect_errors=True
+    )
+    assert [a.id for a in result.annotations] == ["TEST:brain", "", "TEST:liver"]
+    assert len(result.errors) == 1
+    assert "heart is unavailable" in result.errors[0]
+
+
+class CountingAsyncAnnotator(AsyncAnnotator):
+    """An asynchronous annotator that annotates every text as a single entity, and tracks how many calls overlap."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def annotate(self, text, props=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if text == "heart":
+            raise RuntimeError("heart is unavailable")
+        return CountingAnnotator().annotate(text, props)
+
+
+def test_areannotate():
+    """
+    Check that areannotate() keeps the annotations in order, limits the number of calls in flight and records
+    per-annotation failures with collect_errors (or raises them without it).
+    """
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    words = ["brain", "heart", "liver", "lung", "skin", "bone"]
+    text = " ".join(words)
+    annotations = []
+    for word in words:
+        start = text.index(word)
+        annotations.append(
+            Annotation(word, "", "", "", start, start + len(word), provenance)
+        )
+
+    annotator = CountingAsyncAnnotator()
+    result = asyncio.run(
+        AnnotatedText(text, annotations).areannotate(
+            annotator, max_concurrency=2, collect_errors=True
+        )
+    )
+
+    assert annotator.max_in_flight == 2
+    assert [a.text for a in result.annotations] == words
+    assert [text[a.start : a.end] for a in result.annotations] == words
+    assert result.annotations[1] is annotations[1]
+    assert result.annotations[0].provenances == [provenance, annotator.provenance]
+    assert len(result.errors) == 1
+
+    # Without collect_errors, the failure is raised.
+    with pytest.raises(RuntimeError, match="heart is unavailable"):
+        asyncio.run(
+            AnnotatedText(text, annotations).areannotate(
+                CountingAsyncAnnotator(), max_concurrency=2
+            )
+        )
+
+
+class SlowSentenceAnnotator(Annotator):
+    """An annotator that annotates every word in a text, slowly, and logs when it starts and finishes."""
+
+    def __init__(self, events: list):
+        self.events = events
+
+    def annotate(self, text, props=None):
+        self.events.append(("annotate", text))
+        time.sleep(0.02)
+        annotations = []
+        start = 0
+        for word in text.split(" "):
+            annotations.append(
+                Annotation(word, "", "", "", start, start + len(word), self.provenance)
+            )
+            start += len(word) + 1
+        self.events.append(("annotated", text))
+        return AnnotatedText(text, annotations)
+
+
+def test_pipeline():
+    """Check that a Pipeline runs its stages concurrently and yields results in order."""
+    events = []
+    texts = [f"brain {index}" for index in range(6)]
+
+    class LoggingAnnotator(CountingAnnotator):
+        def annotate(self, text, props=None):
+            events.append(("reannotate", text))
+            return super().annotate(text, props)
+
+    pipeline = Pipeline(SlowSentenceAnnotator(events), max_in_flight=2).reannotate(
+        LoggingAnnotator()
+    )
+    results = list(pipeline.run(iter(texts)))
+
+    assert [result.text for result in results] == texts
+    assert [a.id for a in results[3].annotations] == ["TEST:brain", "TEST:3"]
+    assert results[3].annotations[1].start == 6
+
+    # The first text should have been reannotated before the last text was annotated.
+    assert events.index(("reannotate", "0")) < events.index(("annotated", texts[-1]))
+
+    records = [{"id": index, "body": text} for index, text in enumerate(texts)]
+    results = list(pipeline.run_records(records, text_field="body"))
+    assert [record["id"] for record, _ in results] == list(range(6))
+    assert [result.text for _, result in results] == texts
+
+
+def test_pipeline_errors():
+    """Check that a Pipeline can record a document that fails mid-stream and carry on with the rest."""
+    texts = [f"brain {index}" for index in range(6)]
+
+    class FailingAnnotator(CountingAnnotator):
+        def annotate(self, text, props=None):
+            if text in {"1", "4"}:
+                raise RuntimeError(f"Could not look up {text}")
+            return super().annotate(text, props)
+
+    pipeline = Pipeline(SlowSentenceAnnotator([]), max_in_flight=2).reannotate(
+        FailingAnnotator()
+    )
+    with pytest.raises(RuntimeError):
+        list(pipeline.run(texts))
+
+    pipeline.collect_errors = True
+    results = list(pipeline.run(texts))
+    assert [result.text for result in results] == texts
+    assert [result.errors for result in results] == [
+        [],
+        ["FailingAnnotator could not reannotate 'brain 1': Could not look up 1"],
+        [],
+        [],
+        ["FailingAnnotator could not reannotate 'brain 4': Could not look up 4"],
+        [],
+    ]
+    # A failed document keeps the annotations from before the failing stage.
+    assert [a.id for a in results[1].annotations] == ["", ""]
+    assert [a.id for a in results[2].annotations] == ["TEST:brain", "TEST:2"]
+
+    # A failure in the first stage leaves the document without annotations.
+    class FailingSentenceAnnotator(SlowSentenceAnnotator):
+        def annotate(self, text, props=None):
+            if text == texts[3]:
+                raise RuntimeError("Unavailable")
+            return super().annotate(text, props)
+
+    pipeline = Pipeline(FailingSentenceAnnotator([]), collect_errors=True)
+    results = list(pipeline.run(texts))
+    assert [len(result.annotations) for result in results] == [2, 2, 2, 0, 2, 2]
+    assert results[3].errors == [
+        "FailingSentenceAnnotator could not annotate 'brain 3': Unavailable"
+    ]
+
+
+def test_shared_provenance():
+    """Check that services share a single, immutable AnnotationProvenance between their annotations."""
+    provenance = AnnotationProvenance.shared("Test", "http://example.com", "0.1.0")
+    assert provenance is AnnotationProvenance.shared(
+        "Test", "http://example.com", "0.1.0"
+    )
+    assert provenance == AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        provenance.version = "0.2.0"
+
+    annotator = CountingAnnotator()
+    first, second = annotator.annotate_batch(["brain", "heart"])
+    assert first.annotations[0].provenance is second.annotations[0].provenance
+    assert not hasattr(first.annotations[0], "__dict__")
+
+
+def test_annotation_history():
+    """Check that based_on histories share their earlier entries and still behave like tuples."""
+    provenances = [
+        AnnotationProvenance.shared(f"Stage{index}", "http://example.com", "0.1.0")
+        for index in range(3)
+    ]
+    first = Annotation("brain", "TEST:0", "brain", "", 0, 5, provenances[0])
+    second = dataclasses.replace(
+        first, provenance=provenances[1], based_on=first.history()
+    )
+    third = dataclasses.replace(
+        second, provenance=provenances[2], based_on=second.history()
+    )
+
+    assert first.based_on == () and first.based_on == []
+    assert third.based_on == (first, second)
+    assert third.based_on.previous is second.based_on
+    assert len(third.based_on) == 2
+    assert third.based_on[-1] is second and third.based_on[0] is first
+    assert third.based_on[:1] == (first,)
+    with pytest.raises(IndexError):
+        third.based_on[2]
+
+    assert third.provenances == provenances
+    assert list(third.provenances) == provenances
+    assert third.provenances[-1] is provenances[2]
+    assert len(third.provenances) == 3
+
+    # Lists are still accepted and converted into histories.
+    converted = Annotation(
+        "brain", "TEST:0", "brain", "", 0, 5, provenances[2], [first, second]
+    )
+    assert isinstance(converted.based_on, AnnotationHistory)
+    assert converted == third
+
+    # Pickling keeps the shared entries shared.
+    unpickled_second, unpickled_third = pickle.loads(pickle.dumps([second, third]))
+    assert unpickled_third == third
+    assert unpickled_third.based_on.previous is unpickled_second.based_on
+
+
+def test_annotation_batch():
+    """Check that AnnotationBatch stores annotations in columns and converts back to the same annotations."""
+    provenance = AnnotationProvenance.shared("Test", "http://example.com", "0.1.0")
+    brain = Annotation("brain", "TEST:brain", "brain", "anatomy", 4, 9, provenance)
+    normalized = NormalizedAnnotation.from_annotation(
+        brain,
+        provenance,
+        curie="UBERON:0000955",
+        biolink_type="biolink:GrossAnatomicalStructure",
+    )
+    annotated_texts = [
+        AnnotatedText("The brain", [brain, normalized]),
+        AnnotatedText("Nothing", [], ["Could not annotate"]),
+        AnnotatedText(
+            "brain", [dataclasses.replace(brain, start=0, end=5, props={"score": 1})]
+        ),
+    ]
+
+    batch = AnnotationBatch.from_annotated_texts(annotated_texts)
+    assert len(batch) == 3
+    assert list(batch.documents) == [0, 0, 2]
+    assert list(batch.starts) == [4, 4, 0]
+    assert list(batch.biolink_types) == [None, "biolink:GrossAnatomicalStructure", None]
+    assert batch.ids.values == ["TEST:brain", "UBERON:0000955"]
+    assert batch.provenances.values == [provenance]
+    assert batch.histories[batch.history_codes[1]] is normalized.based_on
+    assert batch.to_annotated_texts() == annotated_texts
+
+    numpy = pytest.importorskip("numpy")
+    columns = batch.to_numpy()
+    assert columns["start"].tolist() == list(batch.starts)
+    assert not numpy.shares_memory(
+        columns["start"], numpy.frombuffer(batch.starts, numpy.int64)
+    )
+
+    pytest.importorskip("pyarrow")
+    table = batch.to_arrow()
+    assert table.num_rows == 3
+    assert table.column("id").to_pylist() == list(batch.ids)
+    assert table.column("biolink_type").to_pylist() == list(batch.biolink_types)
+    assert table.column("provenance_name").to_pylist() == ["Test"] * 3
+
+
+def test_annotation_batch_add_after_export():
+    """Check that a batch can still be added to after its columns have been exported to NumPy or Arrow."""
+    numpy = pytest.importorskip("numpy")
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    batch = AnnotationBatch()
+    document = batch.add_text("brain heart")
+    batch.add(document, "brain", "TEST:brain", "", "", 0, 5, provenance)
+
+    columns = batch.to_numpy()
+    batch.add(document, "heart", "TEST:heart", "", "", 6, 11, provenance)
+    assert columns["start"].tolist() == [0]
+    assert batch.to_numpy()["start"].tolist() == [0, 6]
+
+    pytest.importorskip("pyarrow")
+    table = batch.to_arrow()
+    batch.add(document, "brain heart", "TEST:both", "", "", 0, 11, provenance)
+    assert table.column("start").to_pylist() == [0, 6]
+    assert numpy.array_equal(batch.to_numpy()["end"], [5, 11, 11])
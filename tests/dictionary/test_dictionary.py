@@ -0,0 +1,153 @@
+from renci_ner.services.ner.dictionary import (
+    Automaton,
+    DictionaryNER,
+    _resolve_overlaps,
+)
+
+RECORDS = [
+    {
+        "curie": "UBERON:0000955",
+        "preferred_name": "brain",
+        "names": ["brain", "encephalon"],
+        "types": ["AnatomicalEntity"],
+        "clique_identifier_count": 12,
+    },
+    {
+        "curie": "MONDO:0001657",
+        "preferred_name": "brain cancer",
+        "names": ["brain cancer", "brain  neoplasm"],
+        "types": ["biolink:Disease"],
+        "clique_identifier_count": 8,
+    },
+    {
+        "curie": "MONDO:0004992",
+        "preferred_name": "cancer",
+        "names": ["cancer", "malignant neoplasm"],
+        "types": ["biolink:Disease"],
+        "clique_identifier_count": 40,
+    },
+    {
+        "curie": "NCBIGene:7157",
+        "preferred_name": "TP53",
+        "names": ["TP53", "p53"],
+        "types": ["Gene"],
+        "clique_identifier_count": 6,
+    },
+    {
+        "curie": "NCBIGene:22059",
+        "preferred_name": "Trp53",
+        "names": ["Trp53", "p53"],
+        "types": ["Gene"],
+        "clique_identifier_count": 4,
+    },
+]
+
+
+def spans(annotated):
+    return [
+        (annotation.text, annotation.start, annotation.end, annotation.id)
+        for annotation in annotated.annotations
+    ]
+
+
+def test_find():
+    # The classic Aho-Corasick example, with overlapping matches and matches found through output links.
+    automaton = Automaton.build(
+        [
+            {"curie": f"X:{name}", "preferred_name": name}
+            for name in ["he", "she", "his", "hers"]
+        ]
+    )
+    found = [
+        ("ushers"[start:end], start, end) for start, end, _ in automaton.find("ushers")
+    ]
+    assert sorted(found) == [("he", 2, 4), ("hers", 2, 6), ("she", 1, 4)]
+    assert automaton.find("") == []
+    assert automaton.find("xyz") == []
+
+
+def test_resolve_overlaps():
+    assert _resolve_overlaps([(0, 5, 0), (0, 12, 1), (6, 12, 2), (13, 16, 3)]) == [
+        (0, 12, 1),
+        (13, 16, 3),
+    ]
+    # A longer match later on beats a shorter one it overlaps with.
+    assert _resolve_overlaps([(0, 4, 0), (2, 10, 1)]) == [(2, 10, 1)]
+    # Of matches with the same length, the first is kept.
+    assert _resolve_overlaps([(3, 6, 1), (0, 4, 0)]) == [(0, 4, 0)]
+
+
+def test_annotate():
+    dictionary = DictionaryNER.from_records(RECORDS, version="2025mar31")
+    assert dictionary.provenance.name == "DictionaryNER"
+    assert dictionary.provenance.version == "2025mar31"
+
+    text = "Mutations in TP53 are common in Brain\n  Cancer, but not in the BRAIN-stem or brainstem."
+    annotated = dictionary.annotate(text)
+    assert spans(annotated) == [
+        ("TP53", 13, 17, "NCBIGene:7157"),
+        ("Brain\n  Cancer", 32, 46, "MONDO:0001657"),
+        ("BRAIN", 63, 68, "UBERON:0000955"),
+    ]
+    for annotation in annotated.annotations:
+        assert text[annotation.start : annotation.end] == annotation.text
+        assert annotation.provenance == dictionary.provenance
+    [_, cancer, brain] = annotated.annotations
+    assert cancer.label == "brain cancer"
+    assert cancer.type == "biolink:Disease"
+    assert brain.type == "biolink:AnatomicalEntity"
+
+    # A shared synonym is matched to the clique with the largest clique size.
+    assert spans(dictionary.annotate("p53")) == [("p53", 0, 3, "NCBIGene:7157")]
+
+
+def test_properties():
+    dictionary = DictionaryNER.from_records(RECORDS)
+    text = "brain cancer in brainstem"
+
+    assert spans(dictionary.annotate(text, {"overlaps": True})) == [
+        ("brain", 0, 5, "UBERON:0000955"),
+        ("brain cancer", 0, 12, "MONDO:0001657"),
+        ("cancer", 6, 12, "MONDO:0004992"),
+    ]
+    assert spans(dictionary.annotate(text, {"whole_words": False})) == [
+        ("brain cancer", 0, 12, "MONDO:0001657"),
+        ("brain", 16, 21, "UBERON:0000955"),
+    ]
+    assert spans(
+        dictionary.annotate(text, {"biolink_types": ["biolink:AnatomicalEntity"]})
+    ) == [("brain", 0, 5, "UBERON:0000955")]
+
+    # Properties may be given as "true"/"false" strings, as for NameRes.
+    assert spans(dictionary.annotate(text, {"overlaps": "false"})) == spans(
+        dictionary.annotate(text)
+    )
+    assert spans(dictionary.annotate(text, {"whole_words": "false"})) == spans(
+        dictionary.annotate(text, {"whole_words": False})
+    )
+    assert spans(dictionary.annotate(text, {"overlaps": "true"})) == spans(
+        dictionary.annotate(text, {"overlaps": True})
+    )
+
+
+def test_save_and_load(tmp_path):
+    dictionary = DictionaryNER.from_records(RECORDS, version="2025mar31")
+    dictionary.save(tmp_path)
+
+    loaded = DictionaryNER.load(tmp_path)
+    assert loaded.provenance.url == tmp_path.resolve().as_uri()
+    assert loaded.provenance.version == "2025mar31"
+    text = "Malignant neoplasm of the encephalon, and p53."
+    assert spans(loaded.annotate(text)) == spans(dictionary.annotate(text))
+    assert [annotation.id for annotation in loaded.annotate(text).annotations] == [
+        "MONDO:0004992",
+        "UBERON:0000955",
+        "NCBIGene:7157",
+    ]
+    loaded.close()
+
+    # An empty dictionary can be saved and loaded too.
+    DictionaryNER.from_records([]).save(tmp_path / "empty")
+    empty = DictionaryNER.load(tmp_path / "empty")
+    assert empty.annotate("brain").annotations == []
+    empty.close()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import socket
+import threading
+
+import httpx
+import pytest
+import requests
+from conftest import FakeResponse
+
+from renci_ner.services.http import create_session
+from renci_ner.services.linkers.nameres import AsyncNameRes, NameRes
+from renci_ner.services.normalization.nodenorm import NodeNorm
+from renci_ner.services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    Resilience,
+    RetryBudget,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+
+def test_create_session():
+    """Check that create_session() configures the connection pool as requested."""
+    session = create_session(pool_maxsize=50, max_retries=5, keep_alive=False)
+    adapter = session.get_adapter("https://example.org/")
+    assert adapter._pool_maxsize == 50
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.connect == 5
+    assert adapter.max_retries.read == 0
+    assert session.headers["Connection"] == "close"
+
+
+def test_retries_not_multiplied():
+    """Check that a request that fails after being sent is only retried by the service's Resilience."""
+    attempts = []
+    listener = socket.create_server(("127.0.0.1", 0))
+    listener.settimeout(0.05)
+    done = threading.Event()
+
+    def hang_up():
+        # Read each request and close the connection without responding.
+        while not done.is_set():
+            try:
+                connection, _ = listener.accept()
+            except TimeoutError:
+                continue
+            with connection:
+                connection.recv(65536)
+                attempts.append(1)
+
+    thread = threading.Thread(target=hang_up, daemon=True)
+    thread.start()
+    try:
+        nameres = NameRes(
+            url=f"http://127.0.0.1:{listener.getsockname()[1]}",
+            openapi_version="1.0.0",
+            resilience=Resilience(RetryPolicy(retries=2, backoff=0)),
+        )
+        with pytest.raises(requests.ConnectionError):
+            nameres.annotate("brain")
+    finally:
+        done.set()
+        thread.join()
+        listener.close()
+    assert len(attempts) == 3
+
+
+def test_services_own_sessions():
+    """Check that services don't share a session unless we ask them to."""
+    nameres = NameRes(pool_maxsize=20)
+    nodenorm = NodeNorm()
+    assert nameres.requests_session is not nodenorm.requests_session
+    assert (
+        nameres.requests_session.get_adapter("https://example.org/")._pool_maxsize == 20
+    )
+
+    session = create_session()
+    nameres = NameRes(requests_session=session)
+    nodenorm = NodeNorm(requests_session=session)
+    assert nameres.requests_session is nodenorm.requests_session
+
+
+def flaky_lookup(failures: list):
+    """A fake NameRes lookup endpoint that returns each of `failures` in turn before succeeding."""
+
+    def lookup(kwargs):
+        if failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        return [{"curie": "TEST:1", "label": "brain", "types": ["biolink:Cell"]}]
+
+    return lookup
+
+
+def test_retries(fake_session):
+    """Check that transient errors are retried, honoring Retry-After, and that other errors aren't."""
+    failures = [
+        FakeResponse({}, status_code=503, headers={"Retry-After": "0"}),
+        requests.ConnectionError("connection reset"),
+    ]
+    session = fake_session({("GET", "/lookup"): flaky_lookup(failures)})
+    resilience = Resilience(RetryPolicy(retries=2, backoff=0))
+    nameres = NameRes(
+        url="http://nameres.test", requests_session=session, resilience=resilience
+    )
+
+    result = nameres.annotate("brain")
+    assert [annotation.id for annotation in result.annotations] == ["TEST:1"]
+    assert len([call for call in session.calls if call[0] == "GET"]) == 4
+
+    # A 404 isn't transient, so it's raised straight away.
+    failures.append(FakeResponse({}, status_code=404))
+    with pytest.raises(requests.HTTPError):
+        nameres.annotate("brain")
+    assert len([call for call in session.calls if call[0] == "GET"]) == 5
+
+    # A transient error that lasts for longer than the retries is raised too.
+    failures.extend([FakeResponse({}, status_code=503)] * 3)
+    with pytest.raises(requests.HTTPError):
+        nameres.annotate("brain")
+    assert not failures
+
+
+def test_retry_budget_and_circuit_breaker(fake_session):
+    """Check that retries are limited by the budget, and that repeated failures open the circuit."""
+    failures = [FakeResponse({}, status_code=503)] * 10
+    session = fake_session({("GET", "/lookup"): flaky_lookup(failures)})
+    breaker = CircuitBreaker(failure_threshold=4, reset_timeout=60)
+    nameres = NameRes(
+        url="http://nameres.test",
+        requests_session=session,
+        resilience=Resilience(
+            RetryPolicy(retries=5, backoff=0),
+            budget=RetryBudget(ratio=0, burst=2),
+            circuit_breaker=breaker,
+        ),
+    )
+
+    # One attempt and two retries (the whole budget).
+    with pytest.raises(requests.HTTPError):
+        nameres.annotate("brain")
+    assert len(failures) == 7
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # The fourth failure in a row opens the circuit, after which we fail fast.
+    with pytest.raises(requests.HTTPError):
+        nameres.annotate("brain")
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        nameres.annotate("brain")
+    assert len(failures) == 6
+
+    # Once the reset timeout has passed, a successful trial closes the circuit again.
+    failures.clear()
+    breaker.reset_timeout = 0
+    assert len(nameres.annotate("brain").annotations) == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert RetryPolicy(max_backoff=10).delay(0, retry_after=120) == 10
+    assert 0 <= RetryPolicy(backoff=1).delay(3) <= 8
+
+
+def test_async_retries():
+    """Check that asynchronous services retry transient errors too."""
+    statuses = [429, 502]
+
+    def handler(request):
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"info": {"version": "1.2.3"}})
+        if statuses:
+            return httpx.Response(statuses.pop(0), headers={"Retry-After": "0"})
+        strings = json.loads(request.content)["strings"]
+        return httpx.Response(
+            200,
+            json={string: [{"curie": f"TEST:{string}"}] for string in strings},
+        )
+
+    async def annotate():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            nameres = AsyncNameRes(url="http://nameres.test", client=client)
+            return await nameres.annotate_batch(["brain"])
+
+    results = asyncio.run(annotate())
+    assert not statuses
+    assert [result.annotations[0].id for result in results] == ["TEST:brain"]
+    assert not results[0].errors
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from requests import HTTPError
+
+from renci_ner import instrumentation
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    Annotator,
+    Transformer,
+)
+from renci_ner.instrumentation import Instrument, StatsCollector
+from renci_ner.services.linkers.nameres import AsyncNameRes, NameRes
+from renci_ner.services.ner.biomegatron import BioMegatron
+from renci_ner.services.normalization.nodenorm import NodeNorm
+from renci_ner.testing import FakeServer
+
+
+class RecordingInstrument(Instrument):
+    def __init__(self):
+        self.events = []
+
+    def on_request(self, event):
+        self.events.append(event)
+
+
+def test_stats_collector():
+    """Check that a StatsCollector adds up the requests, annotations and stages of a chain of services."""
+    text = "The brain is part of the nervous system."
+    with FakeServer() as server:
+        biomegatron = BioMegatron(url=server.url)
+        nameres = NameRes(url=server.url)
+        nodenorm = NodeNorm(url=server.url)
+
+        stats = StatsCollector()
+        with instrumentation.instrument(stats):
+            annotated = biomegatron.annotate(text)
+        result = annotated.reannotate(nameres, {"limit": 2}, stats=stats).transform(
+            nodenorm, stats=stats
+        )
+
+    services = stats.services
+    assert set(services) == {"BioMegatron", "NameRes", "NodeNorm"}
+    # Each service is sent one request, after looking up its OpenAPI version.
+    assert services["BioMegatron"].requests == 2
+    assert services["BioMegatron"].annotations == 8
+    assert services["NameRes"].requests == 2
+    assert services["NameRes"].annotations == 16
+    assert services["NodeNorm"].annotations == len(result.annotations) == 16
+    for service in services.values():
+        assert service.errors == 0
+        assert service.bytes_sent > 0
+        assert service.bytes_received > 0
+        assert service.network_seconds > 0
+
+    assert set(stats.stages) == {"NameRes", "NodeNorm"}
+    assert stats.stages["NodeNorm"].runs == 1
+    assert stats.stages["NodeNorm"].annotations == 16
+    assert stats.as_dict()["stages"]["NameRes"]["annotations"] == 16
+
+    # Once the stages are over, the collector no longer receives events.
+    assert not instrumentation.is_enabled()
+
+
+def test_concurrent_stages():
+    """Check that stages running at the same time on different threads only collect their own events."""
+    with FakeServer() as server:
+        biomegatron = BioMegatron(url=server.url)
+        nameres = NameRes(url=server.url)
+        # Look up the OpenAPI version first, so that it isn't counted by whichever stage needs it first.
+        assert nameres.openapi_version
+        annotated = biomegatron.annotate("The brain and the heart.")
+        barrier = threading.Barrier(4)
+
+        def reannotate(annotated_text, props):
+            # Wait until every stage has started, so that they all overlap.
+            barrier.wait()
+            result = annotated_text.reannotate(nameres, props)
+            barrier.wait()
+            return result
+
+        shared = StatsCollector()
+        separate = [StatsCollector(), StatsCollector()]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                # Identical lookups would be shared between the stages, so use different limits.
+                executor.submit(
+                    shared.run_stage, "NameRes", reannotate, annotated, {"limit": 1}
+                ),
+                executor.submit(
+                    shared.run_stage, "NameRes", reannotate, annotated, {"limit": 4}
+                ),
+                executor.submit(
+                    separate[0].run_stage,
+                    "NameRes",
+                    reannotate,
+                    annotated,
+                    {"limit": 2, "batch_size": 1, "max_workers": 2},
+                ),
+                executor.submit(
+                    separate[1].run_stage,
+                    "NameRes",
+                    reannotate,
+                    annotated,
+                    {"limit": 3},
+                ),
+            ]
+            for future in futures:
+                future.result()
+
+    assert shared.stages["NameRes"].runs == 2
+    assert shared.services["NameRes"].requests == 2
+    assert shared.services["NameRes"].annotations == 5 * len(annotated.annotations)
+    # Requests made from the stage's own thread pool are collected too.
+    assert separate[0].services["NameRes"].requests == len(annotated.annotations)
+    assert separate[0].services["NameRes"].annotations == 2 * len(annotated.annotations)
+    assert separate[1].services["NameRes"].requests == 1
+    assert separate[1].services["NameRes"].annotations == 3 * len(annotated.annotations)
+    assert "BioMegatron" not in shared.services
+    assert not instrumentation.is_enabled()
+
+
+class FailingAnnotator(Annotator):
+    """An annotator that can't annotate "heart"."""
+
+    def annotate(self, text, props=None):
+        if text == "heart":
+            raise RuntimeError("heart is unavailable")
+        return AnnotatedText(text, [])
+
+
+def test_stage_errors():
+    """Check that each stage only counts the errors it added, not those of earlier stages."""
+    provenance = AnnotationProvenance.shared("Test", "http://example.com", "0.1.0")
+    text = "brain heart"
+    annotated = AnnotatedText(
+        text,
+        [
+            Annotation("brain", "", "", "", 0, 5, provenance),
+            Annotation("heart", "", "", "", 6, 11, provenance),
+        ],
+    )
+
+    stats = StatsCollector()
+    result = annotated.reannotate(
+        FailingAnnotator(), stats=stats, collect_errors=True
+    ).transform(Transformer(), stats=stats)
+
+    assert len(result.errors) == 1
+    assert stats.stages["FailingAnnotator"].errors == 1
+    assert stats.stages["Transformer"].errors == 0
+
+
+def test_failed_requests():
+    """Check that failed requests are reported, and that nothing is reported without instruments."""
+    with FakeServer() as server:
+        biomegatron = BioMegatron(url=server.url)
+        biomegatron.annotate_url = server.url + "/missing"
+
+        recorder = RecordingInstrument()
+        with instrumentation.instrument(recorder), pytest.raises(HTTPError):
+            biomegatron.annotate("The brain")
+
+        with pytest.raises(HTTPError):
+            biomegatron.annotate("The brain")
+
+    assert len(recorder.events) == 1
+    event = recorder.events[0]
+    assert event.service == "BioMegatron"
+    assert event.method == "POST"
+    assert event.status == 404
+    assert event.error is not None
+
+
+def test_async_requests():
+    """Check that asynchronous services report their requests."""
+
+    def handler(request):
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"info": {"version": "1.2.3"}})
+        return httpx.Response(
+            200, json=[{"curie": "TEST:1", "types": ["biolink:Cell"]}]
+        )
+
+    async def annotate():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            nameres = AsyncNameRes(url="http://nameres.test", client=client)
+            return await nameres.annotate("brain")
+
+    stats = StatsCollector()
+    with instrumentation.instrument(stats):
+        result = asyncio.run(annotate())
+
+    assert len(result.annotations) == 1
+    # The lookup of the OpenAPI version and the lookup of "brain".
+    assert stats.services["NameRes"].requests == 2
+    assert stats.services["NameRes"].annotations == 1
+    assert stats.services["NameRes"].bytes_received > 0
@@ -0,0 +1,253 @@
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    Annotator,
+    NormalizedAnnotation,
+)
+from renci_ner.services.linkers.local_nameres import (
+    LocalNameRes,
+    build_index,
+    normalize,
+)
+
+RECORDS = [
+    {
+        "curie": "UBERON:0000955",
+        "preferred_name": "brain",
+        "names": ["brain", "Encephalon", "brain organ"],
+        "types": ["AnatomicalEntity", "NamedThing"],
+        "taxa": [],
+        "clique_identifier_count": 12,
+    },
+    {
+        "curie": "MONDO:0005559",
+        "preferred_name": "brain disease",
+        "names": ["brain disease", "Encephalopathy", "disorder of brain"],
+        "types": ["biolink:Disease"],
+        "taxa": [],
+        "clique_identifier_count": 30,
+    },
+    {
+        "curie": "NCBIGene:7157",
+        "preferred_name": "TP53",
+        "names": ["TP53", "tumor protein p53", "p53"],
+        "types": ["Gene"],
+        "taxa": ["NCBITaxon:9606"],
+        "clique_identifier_count": 6,
+    },
+    {
+        "curie": "NCBIGene:22059",
+        "preferred_name": "Trp53",
+        "names": ["Trp53", "p53"],
+        "types": ["Gene"],
+        "taxa": ["NCBITaxon:10090"],
+        "clique_identifier_count": 4,
+    },
+]
+
+
+class FakeFallback(Annotator):
+    """An annotator that records the texts it is asked to annotate."""
+
+    def __init__(self):
+        self.texts = []
+        self.batches = []
+
+    @property
+    def provenance(self):
+        return AnnotationProvenance.shared(name="Fallback", url="", version="1")
+
+    def annotate(self, text, props=None):
+        self.texts.append(text)
+        return AnnotatedText(
+            text,
+            [Annotation(text, "FALLBACK:1", text, "", 0, 0, self.provenance)],
+        )
+
+    def annotate_batch(self, texts, props=None):
+        self.batches.append(list(texts))
+        return [self.annotate(text, props) for text in texts]
+
+
+def make_index(tmp_path, fallback=None) -> LocalNameRes:
+    build_index(tmp_path, RECORDS, version="2025mar31")
+    return LocalNameRes(tmp_path, fallback=fallback)
+
+
+def test_normalize():
+    assert normalize("  Tumor   Protein\tP53 ") == "tumor protein p53"
+    assert normalize("ＢＲＡＩＮ") == "brain"
+
+
+def test_lookup(tmp_path):
+    local = make_index(tmp_path)
+    assert local.provenance.name == "LocalNameRes"
+    assert local.provenance.version == "2025mar31"
+
+    # Matches are case- and whitespace-insensitive, with NameRes-compatible results.
+    [result] = local.lookup("  ENCEPHALON ")
+    assert result["curie"] == "UBERON:0000955"
+    assert result["label"] == "brain"
+    assert result["types"] == ["biolink:AnatomicalEntity", "biolink:NamedThing"]
+    assert result["score"] == 0.5
+    assert result["clique_identifier_count"] == 12
+    assert "Encephalon" in result["synonyms"]
+    assert local.lookup("brain")[0]["score"] == 1.0
+
+    # Preferred names rank first, then larger cliques.
+    assert [result["curie"] for result in local.lookup("p53")] == [
+        "NCBIGene:7157",
+        "NCBIGene:22059",
+    ]
+    assert local.lookup("cerebellum") == []
+    assert local.lookup("   ") == []
+
+    # Autocomplete also matches synonyms starting with the text, with lower scores.
+    results = local.lookup("brain", {"autocomplete": "true"})
+    assert [result["curie"] for result in results] == [
+        "UBERON:0000955",
+        "MONDO:0005559",
+    ]
+    assert [result["score"] for result in results] == [1.0, 0.5]
+    assert local.lookup("bra") == []
+    assert len(local.lookup("bra", {"autocomplete": True})) == 2
+    local.close()
+
+
+def test_filters(tmp_path):
+    local = make_index(tmp_path)
+
+    def curies(text, props):
+        return [result["curie"] for result in local.lookup(text, props)]
+
+    props = {"autocomplete": True}
+    assert curies("brain", {**props, "biolink_types": ["biolink:Disease"]}) == [
+        "MONDO:0005559"
+    ]
+    assert curies(
+        "brain", {**props, "biolink_types": ["biolink:Disease", "biolink:Gene"]}
+    ) == ["MONDO:0005559"]
+    assert curies("brain", {**props, "only_prefixes": ["UBERON", "NCBIGene"]}) == [
+        "UBERON:0000955"
+    ]
+    assert curies("brain", {**props, "exclude_prefixes": ["UBERON"]}) == [
+        "MONDO:0005559"
+    ]
+    assert curies("brain", {**props, "exclude_prefixes": ["UBERON", "MONDO"]}) == []
+    assert curies("p53", {"only_taxa": ["NCBITaxon:10090"]}) == ["NCBIGene:22059"]
+    assert curies("p53", {"limit": 1}) == ["NCBIGene:7157"]
+    local.close()
+
+
+def test_annotate(tmp_path):
+    local = make_index(tmp_path)
+    annotated = local.annotate("Encephalopathy", {"limit": 1})
+    [annotation] = annotated.annotations
+    assert isinstance(annotation, NormalizedAnnotation)
+    assert annotation.id == "MONDO:0005559"
+    assert annotation.label == "brain disease"
+    assert annotation.biolink_type == "biolink:Disease"
+    assert annotation.props["score"] == 0.5
+    assert annotation.provenance == local.provenance
+    assert local.annotate("cerebellum").annotations == []
+
+    # Reannotating maps each annotation to its lookup results.
+    provenance = AnnotationProvenance.shared(name="Test", url="", version="1")
+    reannotated = AnnotatedText(
+        "TP53 mutations cause brain disease",
+        [
+            Annotation("TP53", "", "", "", 0, 4, provenance),
+            Annotation("brain disease", "", "", "", 21, 34, provenance),
+        ],
+    ).reannotate(local, {"limit": 1})
+    assert [(a.id, a.start, a.end) for a in reannotated.annotations] == [
+        ("NCBIGene:7157", 0, 4),
+        ("MONDO:0005559", 21, 34),
+    ]
+    local.close()
+
+
+def test_fallback(tmp_path):
+    fallback = FakeFallback()
+    local = make_index(tmp_path, fallback=fallback)
+
+    assert local.annotate("brain").annotations[0].id == "UBERON:0000955"
+    assert fallback.texts == []
+    assert local.annotate("cerebellum").annotations[0].id == "FALLBACK:1"
+    assert fallback.texts == ["cerebellum"]
+
+    # In a batch, all the misses are sent to the fallback together.
+    fallback.texts.clear()
+    annotated = local.annotate_batch(
+        ["brain", "cerebellum", "p53", "cerebellum", "liver"]
+    )
+    assert [a.annotations[0].id for a in annotated] == [
+        "UBERON:0000955",
+        "FALLBACK:1",
+        "NCBIGene:7157",
+        "FALLBACK:1",
+        "FALLBACK:1",
+    ]
+    assert fallback.batches == [["cerebellum", "liver"]]
+
+    # Texts that are in the index aren't sent to the fallback, even if the filters remove all their matches.
+    fallback.texts.clear()
+    fallback.batches.clear()
+    props = {"biolink_types": ["biolink:Disease"]}
+    assert local.annotate("p53", props).annotations == []
+    assert [
+        a.annotations for a in local.annotate_batch(["p53", "cerebellum"], props)
+    ] == [[], [local.fallback.annotate("cerebellum").annotations[0]]]
+    assert fallback.batches == [["cerebellum"]]
+    local.close()
+
+
+def test_ranking(tmp_path):
+    """Check that matches are ranked without parsing every matching clique."""
+    records = [
+        {
+            "curie": f"TEST:{index}",
+            "preferred_name": f"gene {index}",
+            "names": ["gene", f"gene {index}"],
+            "types": ["Gene"],
+            "clique_identifier_count": index % 7,
+        }
+        for index in range(100)
+    ]
+    build_index(tmp_path, records)
+    local = LocalNameRes(tmp_path)
+    parsed = []
+    clique = local._clique
+
+    def counting_clique(number):
+        parsed.append(number)
+        return clique(number)
+
+    local._clique = counting_clique
+
+    results = local.lookup("gene", {"autocomplete": True, "limit": 3})
+    # Every clique matches "gene" exactly, so the largest cliques rank first, in the order of the dump.
+    assert [result["curie"] for result in results] == ["TEST:6", "TEST:13", "TEST:20"]
+    assert [result["score"] for result in results] == [0.5, 0.5, 0.5]
+    assert len(parsed) == 3
+
+    # With filters, records are parsed in order until enough of them pass.
+    parsed.clear()
+    results = local.lookup("gene", {"only_prefixes": ["TEST"], "limit": 3})
+    assert [result["curie"] for result in results] == ["TEST:6", "TEST:13", "TEST:20"]
+    assert len(parsed) == 3
+    parsed.clear()
+    results = local.lookup("gene", {"only_prefixes": ["OTHER"], "limit": 3})
+    assert results == []
+    assert len(parsed) == 100
+    local.close()
+
+
+def test_empty_index(tmp_path):
+    build_index(tmp_path, [])
+    local = LocalNameRes(tmp_path)
+    assert local.lookup("brain", {"autocomplete": True}) == []
+    assert local.annotate("brain").annotations == []
+    assert local.provenance.version == "NA"
+    local.close()
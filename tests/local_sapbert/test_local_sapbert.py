@@ -0,0 +1,147 @@
+import zlib
+
+import pytest
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    NormalizedAnnotation,
+)
+
+np = pytest.importorskip("numpy")
+
+from renci_ner.services.linkers.local_sapbert import (
+    Encoder,
+    LocalSAPBERTAnnotator,
+    write_index,
+)
+
+CLIQUES = [
+    {
+        "curie": "UBERON:0000955",
+        "label": "brain",
+        "category": "biolink:AnatomicalEntity",
+    },
+    {
+        "curie": "UBERON:0000948",
+        "label": "heart",
+        "category": "biolink:AnatomicalEntity",
+    },
+    {"curie": "MONDO:0004992", "label": "cancer", "category": "biolink:Disease"},
+    {
+        "curie": "UBERON:0002107",
+        "label": "liver",
+        "category": "biolink:AnatomicalEntity",
+    },
+    {"curie": "MONDO:0005015", "label": "diabetes", "category": "biolink:Disease"},
+]
+
+
+class TrigramEncoder(Encoder):
+    """A toy encoder that embeds texts as hashed bags of character trigrams."""
+
+    dimensions = 64
+
+    def encode(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f"  {text.lower()} "
+            for index in range(len(padded) - 2):
+                matrix[row, zlib.crc32(padded[index : index + 3].encode()) % 64] += 1
+        return matrix
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    encoder = TrigramEncoder()
+    embeddings = encoder.encode([clique["label"] for clique in CLIQUES])
+    write_index(tmp_path, embeddings, CLIQUES, model="trigrams", version="2025-01")
+    return tmp_path
+
+
+def test_annotate(index_path):
+    """Check that LocalSAPBERTAnnotator finds the most similar cliques, like BabelSAPBERTAnnotator."""
+    sapbert = LocalSAPBERTAnnotator(index_path, TrigramEncoder())
+
+    result = sapbert.annotate("Brains", {"limit": 2})
+    assert result.text == "Brains"
+    assert len(result.annotations) == 2
+    top = result.annotations[0]
+    assert isinstance(top, NormalizedAnnotation)
+    assert (top.id, top.label, top.biolink_type) == (
+        "UBERON:0000955",
+        "brain",
+        "biolink:AnatomicalEntity",
+    )
+    assert (top.start, top.end) == (0, 6)
+    assert top.props["score"] > result.annotations[1].props["score"]
+    assert top.provenance.name == "LocalSAPBERT"
+    assert top.provenance.version == "2025-01"
+
+    # An exact match has a score of 1, so a high minimum score only keeps that.
+    result = sapbert.annotate("cancer", {"limit": 5, "score": 0.99})
+    assert [annotation.id for annotation in result.annotations] == ["MONDO:0004992"]
+    assert result.annotations[0].props["score"] == pytest.approx(1.0)
+
+
+def test_annotate_batch(index_path):
+    """Check that searching in small chunks and in batches gives the same results as searching one at a time."""
+    texts = ["liver", "heart disease", "diabetic", "liver"]
+    sapbert = LocalSAPBERTAnnotator(index_path, TrigramEncoder())
+    chunked = LocalSAPBERTAnnotator(index_path, TrigramEncoder(), search_chunk_size=2)
+
+    def summarize(results):
+        # Scores may differ in the last few bits depending on how many vectors are multiplied at once.
+        return [
+            [(a.id, round(a.props["score"], 5)) for a in result.annotations]
+            for result in results
+        ]
+
+    expected = [sapbert.annotate(text, {"limit": 3}) for text in texts]
+    assert summarize(sapbert.annotate_batch(texts, {"limit": 3})) == summarize(expected)
+    assert summarize(chunked.annotate_batch(texts, {"limit": 3})) == summarize(expected)
+    assert [result.annotations[0].id for result in expected] == [
+        "UBERON:0002107",
+        "UBERON:0000948",
+        "MONDO:0005015",
+        "UBERON:0002107",
+    ]
+
+    # It can be used in place of SAPBERT to reannotate.
+    annotated = AnnotatedText(
+        "The liver",
+        [
+            Annotation(
+                text="liver",
+                id="TEST:1",
+                label="",
+                type="biolink:NamedThing",
+                start=4,
+                end=9,
+                provenance=AnnotationProvenance("Test", "http://example.org", "1"),
+            )
+        ],
+    ).reannotate(sapbert, {"limit": 1})
+    assert [(a.id, a.start, a.end) for a in annotated.annotations] == [
+        ("UBERON:0002107", 4, 9)
+    ]
+
+
+def test_approximate_index(index_path):
+    """Check that an approximate index with a faiss-style search() method is used if provided."""
+
+    class FirstRowIndex:
+        def search(self, queries, k):
+            scores = np.full((len(queries), k), 0.5, dtype=np.float32)
+            rows = np.full((len(queries), k), -1, dtype=np.int64)
+            rows[:, 0] = 3
+            return scores, rows
+
+    sapbert = LocalSAPBERTAnnotator(
+        index_path, TrigramEncoder(), approximate_index=FirstRowIndex()
+    )
+    result = sapbert.annotate("brain", {"limit": 3})
+    assert [(a.id, a.props["score"]) for a in result.annotations] == [
+        ("UBERON:0002107", 0.5)
+    ]
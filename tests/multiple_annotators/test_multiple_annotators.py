@@ -6,8 +6,8 @@ from renci_ner.core import (
     Annotation,
     NormalizedAnnotation,
 )
-from renci_ner.services.linkers.nameres import NameRes
 from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
+from renci_ner.services.linkers.nameres import NameRes
 from renci_ner.services.ner.biomegatron import BioMegatron
 from renci_ner.services.normalization.nodenorm import NodeNorm
 
@@ -17,8 +17,10 @@ def test_multiple_annotators():
     Test multiple annotators and transformers on the same text.
     """
 
+    biomegatron = BioMegatron()
     try:
-        biomegatron = BioMegatron()
+        # The OpenAPI version is looked up lazily, so this is the first request we make to BioMegatron.
+        assert biomegatron.openapi_version
     except HTTPError as err:
         pytest.skip(f"BioMegatron is not available: {err}")
         return
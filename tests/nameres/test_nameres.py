@@ -1,6 +1,14 @@
+import asyncio
+import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from renci_ner.services.linkers.nameres import NameRes
+import pytest
+
+from renci_ner.core import AnnotatedText, Annotation, AnnotationProvenance
+from renci_ner.services.linkers.nameres import AsyncNameRes, NameRes
 
 
 def test_check():
@@ -20,3 +28,170 @@ def test_check():
 
     # NameRes version changes quite frequently, but we can confirm that we're still in a 1.x.x version.
     assert re.compile(r"^1.\d+.\d+").match(top_annot.provenance.version)
+
+
+def test_annotate_batch(fake_session):
+    """Check that NameRes.annotate_batch() sends texts to the bulk lookup endpoint in batches."""
+
+    def bulk_lookup(kwargs):
+        return {
+            string: [
+                {
+                    "curie": f"TEST:{string}",
+                    "label": string,
+                    "types": ["biolink:AnatomicalEntity"],
+                }
+            ]
+            for string in kwargs["json"]["strings"]
+            if string != "nothing"
+        }
+
+    session = fake_session({("POST", "/bulk-lookup"): bulk_lookup})
+    nameres = NameRes(url="http://nameres.test", requests_session=session)
+    results = nameres.annotate_batch(
+        ["brain", "nothing", "heart"], {"limit": 1, "batch_size": 2}
+    )
+
+    bulk_calls = [call for call in session.calls if call[1].endswith("/bulk-lookup")]
+    assert [call[2]["json"]["strings"] for call in bulk_calls] == [
+        ["brain", "nothing"],
+        ["heart"],
+    ]
+    assert [result.text for result in results] == ["brain", "nothing", "heart"]
+    assert [len(result.annotations) for result in results] == [1, 0, 1]
+    assert results[2].annotations[0].id == "TEST:heart"
+    assert results[2].annotations[0].provenance.version == "1.2.3"
+
+
+def test_annotate_columnar(fake_session):
+    """Check that NameRes.annotate_columnar() returns the same annotations as annotate_batch()."""
+
+    def bulk_lookup(kwargs):
+        return {
+            string: [
+                {"curie": f"TEST:{string}:{index}", "types": ["biolink:Cell"]}
+                for index in range(2)
+            ]
+            for string in kwargs["json"]["strings"]
+        }
+
+    session = fake_session({("POST", "/bulk-lookup"): bulk_lookup})
+    nameres = NameRes(url="http://nameres.test", requests_session=session)
+    texts = ["brain", "heart", "brain"]
+
+    batch = nameres.annotate_columnar(texts, {"batch_size": 2})
+    assert len(batch) == 6
+    assert list(batch.documents) == [0, 0, 1, 1, 2, 2]
+    assert batch.types.values == ["biolink:Cell"]
+    assert batch.to_annotated_texts() == nameres.annotate_batch(
+        texts, {"batch_size": 2}
+    )
+
+
+def test_concurrent_reannotate(fake_session):
+    """Check that concurrent reannotations share the lookups of texts they have in common."""
+    holder = {}
+    released = threading.Event()
+
+    def bulk_lookup(kwargs):
+        strings = kwargs["json"]["strings"]
+        # Wait until the other reannotation is waiting for this one's texts.
+        deadline = time.monotonic() + 5
+        while holder["nameres"].in_flight.coalesced < 2 and not released.is_set():
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.001)
+        released.set()
+        if "fail" in strings:
+            raise ConnectionError("NameRes is unavailable")
+        return {
+            string: [{"curie": f"TEST:{string}", "types": ["biolink:Cell"]}]
+            for string in strings
+        }
+
+    session = fake_session({("POST", "/bulk-lookup"): bulk_lookup})
+    holder["nameres"] = nameres = NameRes(
+        url="http://nameres.test", requests_session=session
+    )
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+
+    def annotated_text(words):
+        text = " ".join(words)
+        annotations = []
+        for word in words:
+            start = text.index(word)
+            annotations.append(
+                Annotation(word, "", "", "", start, start + len(word), provenance)
+            )
+        return AnnotatedText(text, annotations)
+
+    def reannotate(words):
+        return annotated_text(words).reannotate(
+            nameres, {"batch_size": 1}, collect_errors=True
+        )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(
+            executor.map(
+                reannotate, [["brain", "heart", "fail"], ["heart", "fail", "lung"]]
+            )
+        )
+
+    looked_up = [
+        string
+        for call in session.calls
+        if call[1].endswith("/bulk-lookup")
+        for string in call[2]["json"]["strings"]
+    ]
+    assert sorted(looked_up) == ["brain", "fail", "heart", "lung"]
+    assert nameres.in_flight.coalesced == 2
+    assert [[a.id for a in result.annotations] for result in results] == [
+        ["TEST:brain", "TEST:heart", ""],
+        ["TEST:heart", "", "TEST:lung"],
+    ]
+    # The failed lookup is reported by both reannotations.
+    for result in results:
+        assert len(result.errors) == 1
+        assert "NameRes is unavailable" in result.errors[0]
+
+
+def test_async_annotate_batch():
+    """Check that AsyncNameRes.annotate_batch() sends texts to the bulk lookup endpoint in batches."""
+    httpx = pytest.importorskip("httpx")
+
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"info": {"version": "1.2.3"}})
+        strings = json.loads(request.content)["strings"]
+        return httpx.Response(
+            200,
+            json={
+                string: [{"curie": f"TEST:{string}", "types": ["biolink:Cell"]}]
+                for string in strings
+            },
+        )
+
+    async def annotate():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            nameres = AsyncNameRes(url="http://nameres.test", client=client)
+            return await nameres.annotate_batch(
+                ["brain", "heart", "liver"], {"batch_size": 2}
+            )
+
+    results = asyncio.run(annotate())
+
+    assert [request.url.path for request in seen] == [
+        "/openapi.json",
+        "/bulk-lookup",
+        "/bulk-lookup",
+    ]
+    assert [result.annotations[0].id for result in results] == [
+        "TEST:brain",
+        "TEST:heart",
+        "TEST:liver",
+    ]
+    assert results[0].annotations[0].provenance.version == "1.2.3"
@@ -1,23 +1,32 @@
+import asyncio
+import json
+
 import pytest
+from conftest import FakeResponse
 from requests import HTTPError
 
+from renci_ner.cache import LRUCache
 from renci_ner.core import (
     AnnotatedText,
-    NormalizedAnnotation,
     Annotation,
+    AnnotationProvenance,
+    NormalizedAnnotation,
 )
-from renci_ner.services.linkers.nameres import NameRes
 from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
+from renci_ner.services.linkers.nameres import NameRes
 from renci_ner.services.ner.biomegatron import BioMegatron
-from renci_ner.services.normalization.nodenorm import NodeNorm
+from renci_ner.services.normalization import nodenorm as nodenorm_module
+from renci_ner.services.normalization.nodenorm import AsyncNodeNorm, NodeNorm
 
 
 def test_check():
     """
     Test if we can use NodeNorm as a transformer on top of NameRes and BabelSAPBERT.
     """
+    biomegatron = BioMegatron()
     try:
-        biomegatron = BioMegatron()
+        # The OpenAPI version is looked up lazily, so this is the first request we make to BioMegatron.
+        assert biomegatron.openapi_version
     except HTTPError as err:
         pytest.skip(f"BioMegatron is not available: {err}")
         return
@@ -172,3 +181,179 @@ def test_check():
             )
         ],
     )
+
+
+def test_cache(fake_session):
+    """Check that NodeNorm only sends CURIEs that aren't already cached."""
+
+    def get_normalized_nodes(kwargs):
+        return {
+            curie: {
+                "id": {"identifier": curie.replace("OLD", "NEW"), "label": curie},
+                "type": ["biolink:Gene"],
+            }
+            if curie.startswith("OLD")
+            else None
+            for curie in kwargs["json"]["curies"]
+        }
+
+    session = fake_session({("POST", "/get_normalized_nodes"): get_normalized_nodes})
+    nodenorm = NodeNorm(
+        url="http://nodenorm.test", requests_session=session, cache=LRUCache()
+    )
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+
+    def annotated_text(*curies):
+        return AnnotatedText(
+            "gene",
+            [Annotation("gene", curie, "", "", 0, 4, provenance) for curie in curies],
+        )
+
+    result = nodenorm.transform(annotated_text("OLD:1", "UNKNOWN:1"))
+    assert [a.id for a in result.annotations] == ["NEW:1", "UNKNOWN:1"]
+
+    result = nodenorm.transform(annotated_text("OLD:1", "OLD:2", "UNKNOWN:1"))
+    assert [a.id for a in result.annotations] == ["NEW:1", "NEW:2", "UNKNOWN:1"]
+
+    # Changing the conflation settings changes the cache key.
+    nodenorm.transform(annotated_text("OLD:1"), {"geneprotein_conflation": False})
+
+    requests = [call for call in session.calls if call[0] == "POST"]
+    assert [sorted(call[2]["json"]["curies"]) for call in requests] == [
+        ["OLD:1", "UNKNOWN:1"],
+        ["OLD:2"],
+        ["OLD:1"],
+    ]
+
+
+def test_chunks(fake_session, monkeypatch):
+    """Check that NodeNorm sends CURIEs in chunks, and that a failing chunk doesn't affect the others."""
+    monkeypatch.setattr(nodenorm_module, "RETRY_BACKOFF", 0)
+
+    def get_normalized_nodes(kwargs):
+        curies = kwargs["json"]["curies"]
+        if "BAD:1" in curies:
+            return FakeResponse({"detail": "Internal Server Error"}, status_code=500)
+        return {
+            curie: {"id": {"identifier": "NEW:" + curie}, "type": ["biolink:Gene"]}
+            for curie in curies
+        }
+
+    session = fake_session({("POST", "/get_normalized_nodes"): get_normalized_nodes})
+    nodenorm = NodeNorm(url="http://nodenorm.test", requests_session=session)
+    ids = ["A:1", "A:2", "BAD:1", "A:3", "A:4"]
+    results = nodenorm.normalize(ids, {"batch_size": 2, "max_workers": 3, "retries": 1})
+
+    assert results == {
+        curie: {"id": {"identifier": "NEW:" + curie}, "type": ["biolink:Gene"]}
+        for curie in ["A:1", "A:2", "A:4"]
+    }
+    requests = [
+        call[2]["json"]["curies"] for call in session.calls if call[0] == "POST"
+    ]
+    assert sorted(requests) == [
+        ["A:1", "A:2"],
+        ["A:4"],
+        ["BAD:1", "A:3"],
+        ["BAD:1", "A:3"],
+    ]
+
+
+def test_transform_many(fake_session):
+    """Check that transform_many() normalizes the CURIEs from several texts together."""
+
+    def get_normalized_nodes(kwargs):
+        return {
+            curie: {"id": {"identifier": "NEW:" + curie}, "type": ["biolink:Gene"]}
+            for curie in kwargs["json"]["curies"]
+        }
+
+    session = fake_session({("POST", "/get_normalized_nodes"): get_normalized_nodes})
+    nodenorm = NodeNorm(url="http://nodenorm.test", requests_session=session)
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+
+    texts = [
+        AnnotatedText(
+            f"text {index}",
+            [Annotation("gene", f"A:{index % 2}", "", "", 0, 4, provenance)],
+        )
+        for index in range(5)
+    ]
+    results = list(nodenorm.transform_many(iter(texts), {"window_size": 2}))
+
+    assert [result.text for result in results] == [text.text for text in texts]
+    assert [result.annotations[0].id for result in results] == [
+        "NEW:A:0",
+        "NEW:A:1",
+        "NEW:A:0",
+        "NEW:A:1",
+        "NEW:A:0",
+    ]
+    requests = [
+        call[2]["json"]["curies"] for call in session.calls if call[0] == "POST"
+    ]
+    assert requests == [["A:0", "A:1"], ["A:0", "A:1"], ["A:0"]]
+
+
+def test_async_normalize(monkeypatch):
+    """
+    Check that AsyncNodeNorm sends CURIEs in chunks, skips chunks that fail, and only sends CURIEs that aren't
+    already cached.
+    """
+    httpx = pytest.importorskip("httpx")
+    monkeypatch.setattr(nodenorm_module, "RETRY_BACKOFF", 0)
+
+    seen = []
+
+    def handler(request):
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"info": {"version": "1.2.3"}})
+        curies = json.loads(request.content)["curies"]
+        seen.append(curies)
+        if "BAD:1" in curies:
+            return httpx.Response(500, json={"detail": "Internal Server Error"})
+        if "DOWN:1" in curies:
+            raise httpx.ConnectError("NodeNorm is down", request=request)
+        return httpx.Response(
+            200,
+            json={
+                curie: {"id": {"identifier": "NEW:" + curie}, "type": ["biolink:Gene"]}
+                for curie in curies
+            },
+        )
+
+    provenance = AnnotationProvenance("Test", "http://example.com", "0.1.0")
+    annotated_text = AnnotatedText(
+        "gene",
+        [
+            Annotation("gene", curie, "", "", 0, 4, provenance)
+            for curie in ["A:1", "A:2", "BAD:1", "A:3", "DOWN:1", "A:4"]
+        ],
+    )
+    props = {"batch_size": 1, "retries": 1}
+
+    async def transform():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with client:
+            nodenorm = AsyncNodeNorm(
+                url="http://nodenorm.test", client=client, cache=LRUCache()
+            )
+            first = await nodenorm.transform(annotated_text, props)
+            seen.clear()
+            second = await nodenorm.transform(annotated_text, props)
+            return first, second
+
+    first, second = asyncio.run(transform())
+
+    for result in (first, second):
+        assert [a.id for a in result.annotations] == [
+            "NEW:A:1",
+            "NEW:A:2",
+            "BAD:1",
+            "NEW:A:3",
+            "DOWN:1",
+            "NEW:A:4",
+        ]
+    # Only the CURIEs in the failed chunks are sent again (and by then the circuit breaker may be open, which
+    # leaves them unnormalized in the same way).
+    assert {curie for curies in seen for curie in curies} == {"BAD:1", "DOWN:1"}
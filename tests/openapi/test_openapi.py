@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from conftest import FakeResponse
+
+from renci_ner.services.linkers.nameres import NameRes
+from renci_ner.services.openapi import OpenAPIVersion
+from renci_ner.services.resilience import Resilience, RetryPolicy
+from renci_ner.testing import FakeServer
+
+
+def test_lazy_version(fake_session):
+    """Check that services don't look up their OpenAPI version until it is needed."""
+    session = fake_session(version="1.2.3")
+    nameres = NameRes(url="http://nameres.test", requests_session=session)
+    assert session.calls == []
+
+    assert nameres.provenance.version == "1.2.3"
+    assert nameres.provenance.version == "1.2.3"
+    assert len(session.calls) == 1
+
+
+def test_pinned_version(fake_session):
+    """Check that a pinned version is used without looking it up."""
+    session = fake_session(version="1.2.3")
+    nameres = NameRes(
+        url="http://nameres.test", requests_session=session, openapi_version="0.9.0"
+    )
+    assert nameres.provenance.version == "0.9.0"
+    assert session.calls == []
+
+
+def test_version_resilience(fake_session):
+    """Check that looking up the version is retried by the service's Resilience, like its other requests."""
+    statuses = [503]
+
+    def openapi(kwargs):
+        if statuses:
+            return FakeResponse(
+                {}, status_code=statuses.pop(), headers={"Retry-After": "0"}
+            )
+        return {"info": {"version": "1.2.3"}}
+
+    session = fake_session({("GET", "/openapi.json"): openapi})
+    nameres = NameRes(
+        url="http://nameres.test",
+        requests_session=session,
+        resilience=Resilience(RetryPolicy(retries=1, backoff=0)),
+    )
+    assert nameres.openapi_version == "1.2.3"
+    assert len(session.calls) == 2
+
+
+def test_cached_version(fake_session, tmp_path):
+    """Check that versions cached on disk are reused until they expire."""
+    session = fake_session(version="1.2.3")
+    version = OpenAPIVersion("http://nameres.test", cache_ttl=60, cache_dir=tmp_path)
+    assert version.get(session) == "1.2.3"
+    assert len(session.calls) == 1
+
+    # A new lookup (e.g. in another process) should use the cached version.
+    assert (
+        OpenAPIVersion("http://nameres.test", cache_ttl=60, cache_dir=tmp_path).get(
+            session
+        )
+        == "1.2.3"
+    )
+    assert len(session.calls) == 1
+
+    # But not if it's for a different service, or if the cache has expired.
+    assert (
+        OpenAPIVersion("http://other.test", cache_ttl=60, cache_dir=tmp_path).get(
+            session
+        )
+        == "1.2.3"
+    )
+    assert len(session.calls) == 2
+    assert (
+        OpenAPIVersion("http://nameres.test", cache_ttl=-1, cache_dir=tmp_path).get(
+            session
+        )
+        == "1.2.3"
+    )
+    assert len(session.calls) == 3
+
+
+def test_async_version_looked_up_once():
+    """Check that concurrent asynchronous annotations share a single lookup of the OpenAPI version."""
+    pytest.importorskip("httpx")
+    from renci_ner.services.ner.biomegatron import AsyncBioMegatron
+
+    with FakeServer(version="9.9.9", latency=0.01) as server:
+        biomegatron = AsyncBioMegatron(url=server.url)
+
+        async def annotate_cold():
+            try:
+                return await biomegatron.annotate_batch(
+                    [f"brain {index}" for index in range(20)]
+                )
+            finally:
+                await biomegatron.aclose()
+
+        results = asyncio.run(annotate_cold())
+        assert server.request_counts["/openapi.json"] == 1
+        assert server.request_counts["/annotate/"] == 20
+        assert all(
+            result.annotations[0].provenance.version == "9.9.9" for result in results
+        )
@@ -1,3 +1,7 @@
+import pytest
+from conftest import FakeResponse
+from requests import HTTPError
+
 from renci_ner.core import AnnotationProvenance
 from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
 
@@ -16,3 +20,55 @@ def test_check():
     assert top_annot.provenance == AnnotationProvenance(
         name="BabelSAPBERT", version="0.1.0", url="https://sap-qdrant.apps.renci.org"
     )
+
+
+def test_annotate_batch(fake_session):
+    """Check that annotate_batch() looks up each distinct text once, and filters the results of each text."""
+
+    def annotate(kwargs):
+        text = kwargs["json"]["text"]
+        if text == "fail":
+            return FakeResponse({"detail": "Not Found"}, status_code=404)
+        return [
+            {
+                "name": text,
+                "curie": f"TEST:{text}{index}",
+                "category": "biolink:Cell",
+                "score": 1.0 / (index + 1),
+            }
+            for index in range(kwargs["json"]["count"])
+        ]
+
+    session = fake_session({("POST", "/annotate/"): annotate})
+    sapbert = BabelSAPBERTAnnotator(url="http://sapbert.test", requests_session=session)
+    texts = ["brain", "heart", "brain", "fail", "liver"]
+    props = {"limit": 4, "score": 0.3, "collect_errors": True}
+
+    results = sapbert.annotate_batch(texts, props)
+    # Texts are looked up one at a time, in order, unless max_workers is set.
+    assert [call[2]["json"]["text"] for call in session.calls if call[0] == "POST"] == [
+        "brain",
+        "heart",
+        "fail",
+        "liver",
+    ]
+    assert sapbert.annotate_batch(texts, {**props, "max_workers": 4}) == results
+
+    assert [result.text for result in results] == texts
+    # Scores are 1, 1/2, 1/3 and 1/4, so only the first three are kept.
+    assert [len(result.annotations) for result in results] == [3, 3, 3, 0, 3]
+    assert [annotation.props["score"] for annotation in results[1].annotations] == [
+        1.0,
+        0.5,
+        1 / 3,
+    ]
+    assert "404" in results[3].errors[0]
+    assert results[0].annotations[0] is not results[2].annotations[0]
+
+    batch = sapbert.annotate_columnar(texts, props)
+    assert batch.to_annotated_texts() == results
+
+    # Without collect_errors, the failure is raised whether or not the lookups are concurrent.
+    for max_workers in [1, 4]:
+        with pytest.raises(HTTPError):
+            sapbert.annotate_batch(texts, {"limit": 4, "max_workers": max_workers})
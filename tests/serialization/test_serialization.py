@@ -0,0 +1,128 @@
+import dataclasses
+import io
+import json
+
+import pytest
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    NormalizedAnnotation,
+)
+from renci_ner.serialization import (
+    AnnotationReader,
+    AnnotationWriter,
+    from_jsonl,
+    from_msgpack,
+    to_jsonl,
+    to_msgpack,
+)
+
+
+def annotated_texts():
+    """Return some AnnotatedTexts whose annotations share based_on histories and provenances."""
+    ner = AnnotationProvenance.shared("NER", "http://ner.test", "1.0.0")
+    linker = AnnotationProvenance.shared("Linker", "http://linker.test", "2.0.0")
+
+    results = []
+    for index in range(3):
+        text = f"The brain {index}"
+        brain = Annotation(text[4:9], "", "", "anatomy", 4, 9, ner)
+        history = brain.history()
+        linked = [
+            NormalizedAnnotation(
+                "brain",
+                f"TEST:{curie}",
+                "brain",
+                "biolink:AnatomicalEntity",
+                4,
+                9,
+                linker,
+                history,
+                {"score": curie},
+                biolink_type="biolink:AnatomicalEntity",
+            )
+            for curie in range(2)
+        ]
+        normalized = NormalizedAnnotation.from_annotation(
+            linked[0], linker, curie="UBERON:0000955"
+        )
+        results.append(
+            AnnotatedText(text, [*linked, normalized], ["An error"] if index else [])
+        )
+    return results
+
+
+def test_jsonl(tmp_path):
+    """Check that AnnotatedTexts round-trip through JSON Lines, with provenances and ancestors written once."""
+    originals = annotated_texts()
+    path = tmp_path / "annotations.jsonl"
+    to_jsonl(originals, path)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 3
+    assert len(records[0]["provenances"]) == 2
+    assert "provenances" not in records[1]
+    # The BioMegatron-style annotation and the first linked annotation are each written once as ancestors.
+    # The NER annotation and the first linked annotation are each written once, although they appear in the
+    # histories of several annotations.
+    assert len(records[0]["ancestors"]) == 2
+
+    results = list(from_jsonl(path))
+    assert results == originals
+    # Shared histories and provenances are still shared.
+    assert results[0].annotations[0].based_on is results[0].annotations[1].based_on
+    assert results[0].annotations[0].provenance is results[2].annotations[0].provenance
+
+
+def test_streaming():
+    """Check that AnnotationWriter and AnnotationReader work one AnnotatedText at a time on open files."""
+    originals = annotated_texts()
+    file = io.StringIO()
+    with AnnotationWriter(file) as writer:
+        for annotated_text in originals:
+            writer.write(annotated_text)
+
+    file.seek(0)
+    reader = iter(AnnotationReader(file))
+    assert next(reader) == originals[0]
+    assert list(reader) == originals[1:]
+
+    with pytest.raises(ValueError):
+        AnnotationWriter(file, format="xml")
+
+
+def test_msgpack(tmp_path):
+    """Check that AnnotatedTexts round-trip through MessagePack."""
+    pytest.importorskip("msgpack")
+    originals = annotated_texts()
+    path = tmp_path / "annotations.msgpack"
+    to_msgpack(originals, path)
+
+    assert list(from_msgpack(path)) == originals
+
+    to_jsonl(originals, tmp_path / "annotations.jsonl")
+    assert path.stat().st_size < (tmp_path / "annotations.jsonl").stat().st_size
+
+
+def test_untyped_normalized_annotations(tmp_path):
+    """Check that a NormalizedAnnotation without a Biolink type is still read back as a NormalizedAnnotation."""
+    ner = AnnotationProvenance.shared("NER", "http://ner.test", "1.0.0")
+    brain = Annotation("brain", "", "", "anatomy", 4, 9, ner)
+    untyped = NormalizedAnnotation(
+        "brain", "UBERON:0000955", "brain", "anatomy", 4, 9, ner, brain.history()
+    )
+    originals = [
+        AnnotatedText(
+            "The brain",
+            [untyped, dataclasses.replace(untyped, based_on=untyped.history())],
+        )
+    ]
+
+    to_jsonl(originals, tmp_path / "annotations.jsonl")
+    assert list(from_jsonl(tmp_path / "annotations.jsonl")) == originals
+
+    pytest.importorskip("msgpack")
+    to_msgpack(originals, tmp_path / "annotations.msgpack")
+    assert list(from_msgpack(tmp_path / "annotations.msgpack")) == originals
@@ -0,0 +1,166 @@
+import dataclasses
+import json
+
+import pytest
+
+from renci_ner.core import (
+    AnnotatedText,
+    Annotation,
+    AnnotationProvenance,
+    NormalizedAnnotation,
+)
+from renci_ner.store import AnnotationStore
+
+
+def annotated_text(index: int) -> AnnotatedText:
+    """Return an AnnotatedText with a normalized annotation (with a history) and an unnormalized one."""
+    ner = AnnotationProvenance.shared("NER", "http://ner.test", "1.0.0")
+    normalizer = AnnotationProvenance.shared("Normalizer", "http://norm.test", "1.0.0")
+    text = f"The heart and brain {index}"
+    brain = Annotation("brain", "", "", "anatomy", 14, 19, ner, props={"index": index})
+    heart = Annotation("heart", "", "", "anatomy", 4, 9, ner)
+    normalized = NormalizedAnnotation.from_annotation(
+        brain,
+        normalizer,
+        curie="UBERON:0000955",
+        biolink_type="biolink:GrossAnatomicalStructure",
+    )
+    annotations = [normalized, heart]
+    if index % 2:
+        annotations.append(dataclasses.replace(heart, id="UBERON:0000948"))
+    return AnnotatedText(text, annotations, ["An error"] if index == 3 else [])
+
+
+def test_store(tmp_path):
+    """Check that documents round-trip through an AnnotationStore spread over several segments."""
+    originals = [annotated_text(index) for index in range(5)]
+    with AnnotationStore(tmp_path / "store", segment_size=2) as store:
+        assert store.add(originals[0]) == 0
+        store.add_all(originals[1:])
+        assert len(store) == 5
+        assert store.document(3) == originals[3]
+        # Reading doesn't flush the last, pending document.
+        assert len(store.segments) == 2
+
+    # Reopen the store and query it.
+    with AnnotationStore(tmp_path / "store") as store:
+        assert len(store) == 5
+        assert list(store) == originals
+        assert store[4].annotations[0].based_on[0].props == {"index": 4}
+
+        assert store.documents_mentioning("UBERON:0000955") == [0, 1, 2, 3, 4]
+        assert store.documents_mentioning("UBERON:0000948") == [1, 3]
+        assert store.documents_mentioning("UBERON:0000000") == []
+
+        assert store.annotations_between(1, 0, 4) == []
+        assert store.annotations_between(1, 0, 5) == originals[1].annotations[1:]
+        assert store.annotations_between(1, 8, 15) == originals[1].annotations
+        assert store.annotations_between(2, 10, 100) == originals[2].annotations[:1]
+
+        with pytest.raises(IndexError):
+            store.document(5)
+
+
+def test_reads_during_ingestion(tmp_path):
+    """Check that pending documents can be queried without flushing them into tiny segments."""
+    originals = [annotated_text(index) for index in range(5)]
+    with AnnotationStore(tmp_path / "store", segment_size=3) as store:
+        for index, original in enumerate(originals):
+            store.add(original)
+            assert store.document(index) == original
+            assert store.documents_mentioning("UBERON:0000948") == [
+                document for document in range(index + 1) if document % 2
+            ]
+            assert store.annotations_between(index, 0, 5) == original.annotations[1:]
+            assert list(store) == originals[: index + 1]
+        assert len(store.segments) == 1
+        assert store.annotations_between(4, 8, 15) == originals[4].annotations
+
+    with AnnotationStore(tmp_path / "store") as store:
+        assert len(store.segments) == 2
+        assert list(store) == originals
+
+
+def test_reopen(tmp_path):
+    """Check that documents can be added to a store after reopening it."""
+    originals = [annotated_text(index) for index in range(6)]
+    with AnnotationStore(tmp_path / "store", segment_size=2) as store:
+        store.add_all(originals[:3])
+
+    with AnnotationStore(tmp_path / "store", segment_size=2) as store:
+        assert len(store) == 3
+        assert store.add(originals[3]) == 3
+        store.add_all(originals[4:])
+        assert store.documents_mentioning("UBERON:0000948") == [1, 3, 5]
+
+    with AnnotationStore(tmp_path / "store") as store:
+        assert list(store) == originals
+        assert store.documents_mentioning("UBERON:0000955") == list(range(6))
+
+
+def test_shared_histories(tmp_path):
+    """Check that ancestors shared between annotations are only written once per segment."""
+    ner = AnnotationProvenance.shared("NER", "http://ner.test", "1.0.0")
+    normalizer = AnnotationProvenance.shared("Normalizer", "http://norm.test", "1.0.0")
+    brain = Annotation("brain", "", "", "anatomy", 0, 5, ner, props={"score": 1})
+    candidates = [
+        NormalizedAnnotation.from_annotation(
+            brain, normalizer, curie=f"TEST:{index}", biolink_type="biolink:Cell"
+        )
+        for index in range(10)
+    ]
+    annotated = AnnotatedText("brain", candidates)
+    with AnnotationStore(tmp_path / "store") as store:
+        store.add(annotated)
+
+    [segment] = (tmp_path / "store").glob("segment-*")
+    assert len((segment / "histories.jsonl").read_bytes().splitlines()) == 1
+    with AnnotationStore(tmp_path / "store") as store:
+        [document] = store
+        assert document == annotated
+        assert document.annotations[3].based_on[0].props == {"score": 1}
+
+
+def test_crash_recovery(tmp_path):
+    """Check that a flush that crashed part of the way through doesn't stop later flushes."""
+    originals = [annotated_text(index) for index in range(3)]
+    store = AnnotationStore(tmp_path / "store")
+    store.add(originals[0])
+    store.add(AnnotatedText("unserializable", [], [object()]))
+    with pytest.raises(TypeError):
+        store.flush()
+    assert (tmp_path / "store" / "segment-000000.tmp").exists()
+    assert not (tmp_path / "store" / "segment-000000").exists()
+
+    # A segment that was renamed into place but never added to the manifest is ignored and replaced.
+    (tmp_path / "store" / "segment-000000").mkdir()
+
+    with AnnotationStore(tmp_path / "store") as store:
+        assert len(store) == 0
+        store.add_all(originals)
+    with AnnotationStore(tmp_path / "store") as store:
+        assert list(store) == originals
+    manifest = json.loads((tmp_path / "store" / "store.json").read_text())
+    assert [segment["name"] for segment in manifest["segments"]] == ["segment-000000"]
+    assert not (tmp_path / "store" / "segment-000000.tmp").exists()
+
+
+def test_untyped_normalized_annotations(tmp_path):
+    """Check that a NormalizedAnnotation without a Biolink type is still read back as a NormalizedAnnotation."""
+    ner = AnnotationProvenance.shared("NER", "http://ner.test", "1.0.0")
+    brain = Annotation("brain", "", "", "anatomy", 4, 9, ner)
+    untyped = NormalizedAnnotation(
+        "brain", "UBERON:0000955", "brain", "anatomy", 4, 9, ner, brain.history()
+    )
+    original = AnnotatedText(
+        "The brain",
+        [brain, untyped, dataclasses.replace(brain, based_on=untyped.history())],
+    )
+
+    with AnnotationStore(tmp_path / "store") as store:
+        store.add(original)
+    with AnnotationStore(tmp_path / "store") as store:
+        assert store.document(0) == original
+        assert (
+            type(store.document(0).annotations[2].based_on[-1]) is NormalizedAnnotation
+        )
@@ -0,0 +1,49 @@
+from renci_ner.core import NormalizedAnnotation, Pipeline
+from renci_ner.services.linkers.babelsapbert import BabelSAPBERTAnnotator
+from renci_ner.services.linkers.nameres import NameRes
+from renci_ner.services.ner.biomegatron import BioMegatron
+from renci_ner.services.normalization.nodenorm import NodeNorm
+from renci_ner.testing import FakeServer
+
+
+def test_fake_server():
+    """Check that all four services can be chained against a FakeServer."""
+    text = "The brain is part of the nervous system."
+    with FakeServer(version="9.9.9", synonyms_per_result=2) as server:
+        biomegatron = BioMegatron(url=server.url)
+        nameres = NameRes(url=server.url)
+        sapbert = BabelSAPBERTAnnotator(url=server.url)
+        nodenorm = NodeNorm(url=server.url)
+
+        result_nameres = (
+            biomegatron.annotate(text)
+            .reannotate(nameres, {"limit": 1})
+            .transform(nodenorm)
+        )
+        result_sapbert = (
+            biomegatron.annotate(text)
+            .reannotate(sapbert, {"limit": 1})
+            .transform(nodenorm)
+        )
+
+        for result in (result_nameres, result_sapbert):
+            assert [annotation.text for annotation in result.annotations] == [
+                word for word in text.rstrip(".").split()
+            ]
+            assert all(
+                isinstance(annotation, NormalizedAnnotation)
+                and annotation.id.startswith("NORM:")
+                for annotation in result.annotations
+            )
+            assert result.annotations[1].provenances[0].version == "9.9.9"
+        assert len(result_nameres.annotations[1].based_on[-1].props["synonyms"]) == 2
+
+        pipeline = Pipeline(biomegatron).reannotate(nameres, {"limit": 1})
+        assert [
+            (annotation.id, annotation.start)
+            for annotation in next(pipeline.run([text])).annotations
+        ] == [
+            (annotation.based_on[-1].id, annotation.start)
+            for annotation in result_nameres.annotations
+        ]
+        assert server.request_counts["/get_normalized_nodes"] == 2